@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочные тесты и бенчмарки бота (запускаются вручную, в бота не входят)
+"""
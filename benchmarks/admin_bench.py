@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк админских запросов на большой базе
+Замеряет то, что админ вызывает кнопками панели: текст /stats
+(_build_stats_text), список /users (_build_users_text), выгрузку /export
+(build_contacts_export без сжатия и с gzip) и полный проход get_all_user_ids()
+для рассылки. Для каждой операции — min/медиана/max по --repeat прогонам
+и число SQL-запросов. Результат сохраняется в JSON (--output) и сравнивается
+с прошлым прогоном (--baseline), чтобы ловить деградации до выкладки:
+
+    DATABASE_NAME=bench.db python -m benchmarks.dataset --users 1000000 --actions 50000000
+    DATABASE_NAME=bench.db python -m benchmarks.admin_bench --output admin.json
+    DATABASE_NAME=bench.db python -m benchmarks.admin_bench --baseline admin.json
+
+Для PostgreSQL задайте DATABASE_URL (или POSTGRES_*) вместо DATABASE_NAME
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Кэш /stats измерял бы сам себя, а не запрос
+os.environ['STATS_CACHE_TTL'] = '0'
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+
+from config import USE_POSTGRES  # noqa: E402
+from database import db  # noqa: E402
+from database.profiler import profiler  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк админских запросов")
+    parser.add_argument('--repeat', type=int, default=5, help="прогонов каждой операции")
+    parser.add_argument('--skip-export', action='store_true', help="не замерять /export")
+    parser.add_argument('--output', help="сохранить результат в JSON")
+    parser.add_argument('--baseline', help="сравнить с сохранённым результатом")
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help="рост медианы (%%), начиная с которого операция считается деградацией")
+    return parser.parse_args(argv)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _table_counts():
+    counts = {}
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        for table in ('users', 'user_actions', 'tariff_selections'):
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cursor.fetchone()[0]
+    return counts
+
+
+def _schema_version():
+    from database.migrations import get_schema_version
+    with db.get_connection() as conn:
+        return get_schema_version(conn)
+
+
+def _queries_total():
+    return sum(item.calls for item in profiler.get_stats())
+
+
+async def _build_export(compression):
+    from database.aio import run_db
+    from services.export import build_contacts_export
+
+    file, _, count = await run_db(build_contacts_export, compression)
+    try:
+        file.seek(0, os.SEEK_END)
+        return {'rows': count, 'bytes': file.tell()}
+    finally:
+        file.close()
+
+
+async def _iterate_user_ids():
+    from database.aio import run_db
+
+    def consume():
+        count = 0
+        for _ in db.get_all_user_ids():
+            count += 1
+        return {'rows': count}
+
+    return await run_db(consume)
+
+
+async def _build_text(builder):
+    text = await builder()
+    return {'chars': len(text)}
+
+
+def _operations(args):
+    from handlers.admin import _build_stats_text, _build_users_text
+
+    operations = [
+        ('stats_text', lambda: _build_text(_build_stats_text)),
+        ('users_text', lambda: _build_text(_build_users_text)),
+    ]
+    if not args.skip_export:
+        operations += [
+            ('export_csv', lambda: _build_export('none')),
+            ('export_gzip', lambda: _build_export('gzip')),
+        ]
+    operations.append(('all_user_ids', _iterate_user_ids))
+    return operations
+
+
+async def measure(name, operation, repeat):
+    """Прогнать операцию repeat раз (плюс один прогрев), вернуть статистику"""
+    await operation()
+
+    durations = []
+    queries = []
+    details = None
+    for _ in range(repeat):
+        before = _queries_total()
+        started = time.perf_counter()
+        details = await operation()
+        durations.append(time.perf_counter() - started)
+        queries.append(_queries_total() - before)
+
+    return {
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'max': max(durations),
+        'queries': max(queries),
+        **(details or {}),
+    }
+
+
+def _ms(value):
+    return f"{value * 1000:10.1f}"
+
+
+def _delta(current, previous):
+    if current is None or not previous:
+        return None
+    return (current - previous) / previous * 100
+
+
+def print_report(report, baseline=None, threshold=20.0):
+    """Таблица результатов; возвращает список деградировавших операций"""
+    meta = report['meta']
+    print(f"\n{meta['backend']}, схема v{meta['schema_version']}: "
+          + ", ".join(f"{table}={count:,}" for table, count in meta['rows'].items()))
+
+    base_operations = (baseline or {}).get('operations', {})
+    if baseline:
+        base_meta = baseline.get('meta', {})
+        if base_meta.get('rows') != meta['rows'] or base_meta.get('backend') != meta['backend']:
+            print("⚠️ Базовый прогон сделан на другой базе — сравнение приблизительное")
+
+    print(f"\n  {'операция':<14}{'min, мс':>10}{'медиана':>11}{'max, мс':>11}{'запросов':>10}")
+    regressions = []
+    for name, stats in report['operations'].items():
+        line = (f"  {name:<14}{_ms(stats['min'])} {_ms(stats['median'])} "
+                f"{_ms(stats['max'])}{stats['queries']:>10}")
+        delta = _delta(stats['median'], base_operations.get(name, {}).get('median'))
+        if delta is not None:
+            line += f"  ({delta:+.1f}%)"
+            if delta >= threshold:
+                line += " ❗"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+async def run(args):
+    db.init_pool()
+    db.init_db()
+
+    report = {
+        'meta': {
+            'backend': 'PostgreSQL' if USE_POSTGRES else 'SQLite',
+            'rows': _table_counts(),
+            'schema_version': _schema_version(),
+            'repeat': args.repeat,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+        },
+        'operations': {},
+    }
+    for name, operation in _operations(args):
+        sys.stdout.write(f"⏱ {name}...\n")
+        sys.stdout.flush()
+        report['operations'][name] = await measure(name, operation, args.repeat)
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        db.close_pool()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.threshold)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат сохранён в {args.output}")
+
+    if regressions:
+        print(f"\n❌ Медиана выросла больше чем на {args.threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
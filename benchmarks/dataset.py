@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Генератор большой синтетической базы для бенчмарков админ-запросов
+Заполняет users, user_actions и tariff_selections в БД из настроек бота
+(SQLite по DATABASE_NAME или PostgreSQL по DATABASE_URL / POSTGRES_*)
+с правдоподобными распределениями:
+
+- регистрации растут со временем (новых пользователей больше в последние дни);
+- у части пользователей есть username, фамилия, телефон; часть заблокировала бота;
+- действия распределены неравномерно: старые пользователи активнее,
+  типы действий — с весами воронки (start > тарифы > контакт > выбор тарифа);
+- last_tariff соответствует последнему выбору тарифа
+
+    DATABASE_NAME=bench.db python -m benchmarks.dataset --users 1000000 --actions 50000000
+
+Счётчики /stats поддерживаются триггерами, как и в рабочей базе
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Профилирование каждого INSERT при массовой загрузке только мешает
+os.environ.setdefault('DB_PROFILE', 'False')
+
+from config import USE_POSTGRES  # noqa: E402
+from database import db  # noqa: E402
+from database.retention import ensure_action_partitions  # noqa: E402
+
+if USE_POSTGRES:
+    from psycopg2.extras import execute_values
+
+FIRST_NAMES = (
+    'Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Екатерина', 'Анастасия', 'Татьяна',
+    'Ирина', 'Юлия', 'Дарья', 'Алина', 'Виктория', 'Ксения', 'Полина', 'Алексей',
+    'Дмитрий', 'Иван', 'Сергей', 'Андрей', 'Amalia', 'Kate', None,
+)
+LAST_NAMES = ('Иванова', 'Петрова', 'Смирнова', 'Кузнецова', 'Попова', 'Соколова', 'Лебедева')
+
+# Типы действий и их доли (как в воронке бота)
+ACTION_WEIGHTS = (
+    ('start', 35),
+    ('view_tariffs', 25),
+    ('view_about', 12),
+    ('ask_question', 8),
+    ('shared_contact', 5),
+    ('select_basic', 10),
+    ('select_assistant', 5),
+)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетическая база для бенчмарков")
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--actions', type=int, default=5_000_000)
+    parser.add_argument('--contact-ratio', type=float, default=0.4,
+                        help="доля пользователей с телефоном")
+    parser.add_argument('--tariff-ratio', type=float, default=0.15,
+                        help="выборов тарифа на пользователя")
+    parser.add_argument('--blocked-ratio', type=float, default=0.03,
+                        help="доля пользователей, заблокировавших бота")
+    parser.add_argument('--days', type=int, default=365, help="за сколько дней история")
+    parser.add_argument('--batch-size', type=int, default=20_000)
+    parser.add_argument('--first-user-id', type=int, default=1_000_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--append', action='store_true',
+                        help="дописывать в непустую базу (по умолчанию — только в пустую)")
+    return parser.parse_args(argv)
+
+
+class Timeline:
+    """
+    Время регистрации i-го пользователя и случайные моменты после неё
+    Регистрации ускоряются: t(i) = начало + период * sqrt(i / n)
+    """
+
+    def __init__(self, users, days):
+        self.users = users
+        self.end = datetime.now().replace(microsecond=0)
+        self.span = days * 86400
+        self.start = self.end - timedelta(seconds=self.span)
+
+    def registered_offset(self, index):
+        return self.span * (index / self.users) ** 0.5
+
+    def registered_at(self, index):
+        return self.start + timedelta(seconds=self.registered_offset(index))
+
+    def random_after(self, index, rnd):
+        offset = self.registered_offset(index)
+        return self.start + timedelta(seconds=offset + rnd.random() * (self.span - offset))
+
+
+def _insert(cursor, table, columns, rows):
+    """Пакетная вставка: execute_values (PostgreSQL) или executemany (SQLite)"""
+    if not rows:
+        return
+    column_list = ', '.join(columns)
+    if USE_POSTGRES:
+        execute_values(cursor, f"INSERT INTO {table} ({column_list}) VALUES %s", rows,
+                       page_size=len(rows))
+    else:
+        placeholders = ', '.join('?' * len(columns))
+        cursor.executemany(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", rows)
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _progress(label, done, total, started):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0
+    sys.stdout.write(f"\r  {label}: {done:,}/{total:,} ({rate:,.0f} строк/сек)")
+    sys.stdout.flush()
+
+
+def generate_users(args, timeline, rnd):
+    for index in range(args.users):
+        user_id = args.first_user_id + index
+        has_phone = rnd.random() < args.contact_ratio
+        registered = timeline.registered_at(index)
+        last_seen = timeline.random_after(index, rnd)
+        yield (
+            user_id,
+            f"user{user_id}" if rnd.random() < 0.7 else None,
+            rnd.choice(FIRST_NAMES),
+            rnd.choice(LAST_NAMES) if rnd.random() < 0.5 else None,
+            f"+79{rnd.randrange(10 ** 9):09d}" if has_phone else None,
+            registered.strftime(TIMESTAMP_FORMAT),
+            last_seen.strftime(TIMESTAMP_FORMAT),
+            db.DELIVERY_BLOCKED if rnd.random() < args.blocked_ratio else None,
+        )
+
+
+def _pick_user(args, rnd):
+    """Индекс пользователя: старые (малые индексы) активнее"""
+    return min(args.users - 1, int(args.users * rnd.random() ** 1.6))
+
+
+def generate_actions(args, timeline, rnd):
+    types = [name for name, _ in ACTION_WEIGHTS]
+    weights = [weight for _, weight in ACTION_WEIGHTS]
+    chunk = 10_000
+    produced = 0
+    while produced < args.actions:
+        count = min(chunk, args.actions - produced)
+        for action_type in rnd.choices(types, weights, k=count):
+            index = _pick_user(args, rnd)
+            yield (
+                args.first_user_id + index,
+                action_type,
+                None,
+                timeline.random_after(index, rnd).strftime(TIMESTAMP_FORMAT),
+            )
+        produced += count
+
+
+def generate_tariff_selections(args, timeline, rnd):
+    total = int(args.users * args.tariff_ratio)
+    for _ in range(total):
+        index = _pick_user(args, rnd)
+        yield (
+            args.first_user_id + index,
+            'basic' if rnd.random() < 0.7 else 'assistant',
+            timeline.random_after(index, rnd).strftime(TIMESTAMP_FORMAT),
+        )
+
+
+def load_table(table, columns, rows, total, batch_size):
+    started = time.perf_counter()
+    done = 0
+    for batch in _batches(rows, batch_size):
+        with db.get_connection() as conn:
+            _insert(conn.cursor(), table, columns, batch)
+        done += len(batch)
+        _progress(table, done, total, started)
+    print()
+
+
+def update_last_tariff(first_user_id, last_user_id):
+    """users.last_tariff = последний выбранный тариф (как в log_tariff_selection)"""
+    placeholder = '%s' if USE_POSTGRES else '?'
+    with db.get_connection() as conn:
+        conn.cursor().execute(f"""
+            UPDATE users SET last_tariff = (
+                SELECT tariff_type FROM tariff_selections ts
+                WHERE ts.user_id = users.user_id
+                ORDER BY ts.timestamp DESC, ts.id DESC
+                LIMIT 1
+            )
+            WHERE user_id BETWEEN {placeholder} AND {placeholder}
+        """, (first_user_id, last_user_id))
+
+
+def analyze():
+    """Обновить статистику планировщика после массовой загрузки"""
+    with db.get_connection() as conn:
+        conn.cursor().execute("ANALYZE")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rnd = random.Random(args.seed)
+
+    db.init_pool()
+    db.init_db()
+
+    existing = db.get_user_count()
+    if existing and not args.append:
+        print(f"❌ В базе уже {existing} пользователей. Используйте отдельную базу "
+              f"(DATABASE_NAME=bench.db) или --append")
+        return 1
+
+    timeline = Timeline(args.users, args.days)
+    backend = 'PostgreSQL' if USE_POSTGRES else 'SQLite'
+    print(f"📦 {backend}: {args.users:,} пользователей, {args.actions:,} действий, "
+          f"{int(args.users * args.tariff_ratio):,} выборов тарифа")
+
+    started = time.perf_counter()
+    load_table(
+        'users',
+        ('user_id', 'username', 'first_name', 'last_name', 'phone_number',
+         'first_interaction', 'last_interaction', 'delivery_status'),
+        generate_users(args, timeline, rnd), args.users, args.batch_size
+    )
+    # PostgreSQL: секции на всю историю, чтобы строки не ложились в секцию по умолчанию
+    ensure_action_partitions(since=timeline.start.date())
+    load_table(
+        'user_actions', ('user_id', 'action_type', 'action_data', 'timestamp'),
+        generate_actions(args, timeline, rnd), args.actions, args.batch_size
+    )
+    load_table(
+        'tariff_selections', ('user_id', 'tariff_type', 'timestamp'),
+        generate_tariff_selections(args, timeline, rnd),
+        int(args.users * args.tariff_ratio), args.batch_size
+    )
+    update_last_tariff(args.first_user_id, args.first_user_id + args.users - 1)
+    analyze()
+    db.close_pool()
+
+    print(f"✅ Готово за {time.perf_counter() - started:.1f} сек")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная замена Telegram Bot API для нагрузочного теста
+aiohttp-сервер отвечает на методы, которые использует бот (getUpdates,
+sendMessage, editMessageText, answerCallbackQuery, sendDocument и др.),
+с настраиваемой задержкой и случайными ответами 429 (flood control).
+Обновления для бота кладутся в очередь через push_update(), ответы бота
+по каждому чату можно дождаться через wait_for()
+"""
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+# Методы, на которые может прийти 429 (как у настоящего API — только «отправляющие»)
+RATE_LIMITED_METHODS = {'sendMessage', 'editMessageText', 'sendDocument'}
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+
+
+class FakeTelegramAPI:
+    """
+    latency — задержка ответа на каждый запрос (сек)
+    flood_rate — доля запросов из RATE_LIMITED_METHODS, получающих 429
+    retry_after — значение retry_after в ответе 429
+    """
+
+    def __init__(self, latency=0.0, flood_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._new_updates = asyncio.Condition()
+        self._message_ids = itertools.count(1000)
+
+        # Ответы бота по чатам: chat_id -> очередь (method, params)
+        self._responses = defaultdict(asyncio.Queue)
+        self.requests = Counter()
+        self.floods = Counter()
+
+        self._runner = None
+        self.url = None
+
+    # --- Управление из нагрузочного теста ---
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=host, port=port).start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def push_update(self, payload):
+        """Поставить обновление в очередь getUpdates; payload — словарь без update_id"""
+        update = {'update_id': next(self._update_ids), **payload}
+        async with self._new_updates:
+            self._updates.append(update)
+            self._new_updates.notify_all()
+        return update['update_id']
+
+    async def wait_for(self, chat_id, method, timeout=30.0):
+        """Дождаться запроса бота method в чат chat_id (другие запросы пропускаются)"""
+        queue = self._responses[chat_id]
+        deadline = time.monotonic() + timeout
+        while True:
+            received, params = await asyncio.wait_for(queue.get(), deadline - time.monotonic())
+            if received == method:
+                return params
+
+    def new_message_id(self):
+        return next(self._message_ids)
+
+    # --- Обработка запросов бота ---
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.requests[method] += 1
+
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(params))
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if (method in RATE_LIMITED_METHODS and self.flood_rate
+                and self._random.random() < self.flood_rate):
+            self.floods[method] += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            })
+
+        result = self._result(method, params)
+        chat_id = params.get('chat_id')
+        if chat_id is not None:
+            self._responses[int(chat_id)].put_nowait((method, params))
+        return self._ok(result)
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+
+        async with self._new_updates:
+            # Подтверждённые (id < offset) обновления больше не нужны
+            if offset:
+                self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            if not self._updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self._updates[:100]
+
+    def _result(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            message = {
+                'message_id': int(params.get('message_id') or self.new_message_id()),
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'from': BOT_USER,
+            }
+            if method == 'sendDocument':
+                message['document'] = {'file_id': 'doc', 'file_unique_id': 'doc'}
+            else:
+                message['text'] = params.get('text', '')
+            return message
+        # answerCallbackQuery, deleteMessage, deleteWebhook, setWebhook и прочие
+        return True
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
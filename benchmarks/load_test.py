@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест бота без Telegram
+Поднимает локальный фейковый Bot API (benchmarks/fake_api.py), запускает
+bot.py:main() с TELEGRAM_API_URL на него и прогоняет пользовательские сценарии
+/start → «Условия доступа» → контакт → тариф «БАЗОВЫЙ» с заданной частотой.
+Печатает обновления/сек, перцентили задержек по шагам и обработчикам,
+нагрузку на БД и запросы к API. Результат можно сохранить (--output)
+и сравнить с прошлым прогоном (--baseline):
+
+    python -m benchmarks.load_test --users 500 --rate 50 --latency 0.02
+    python -m benchmarks.load_test --users 500 --rate 50 --output base.json
+    python -m benchmarks.load_test --users 500 --rate 50 --baseline base.json
+
+По умолчанию используется временная база SQLite; чтобы мерить PostgreSQL,
+задайте DATABASE_URL (или POSTGRES_*) в окружении
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.fake_api import FakeTelegramAPI, BOT_USER
+
+# Шаги сценария: (имя, какой ответ бота ждём и сколько раз)
+STEPS = (
+    ('start', 'sendMessage', 1),
+    ('tariffs', 'sendMessage', 1),
+    ('contact', 'sendMessage', 2),
+    ('select_basic', 'editMessageText', 1),
+)
+
+# Пользователи теста не пересекаются с настоящими id
+USER_ID_BASE = 9_000_000_000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на фейковом Bot API")
+    parser.add_argument('--users', type=int, default=200, help="сколько сценариев прогнать")
+    parser.add_argument('--rate', type=float, default=20.0, help="новых сценариев в секунду")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа API, сек")
+    parser.add_argument('--flood-rate', type=float, default=0.0,
+                        help="доля отправок, получающих 429 (0..1)")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after для 429, сек")
+    parser.add_argument('--timeout', type=float, default=30.0, help="таймаут ответа на шаг, сек")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help="сохранить результат в JSON")
+    parser.add_argument('--baseline', help="сравнить с сохранённым результатом")
+    parser.add_argument('--verbose', action='store_true', help="не глушить логи бота")
+    return parser.parse_args(argv)
+
+
+def percentile(values, q):
+    """Перцентиль q (0..100) методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class _UpdateFactory:
+    """Обновления Telegram от имени тестового пользователя"""
+
+    def __init__(self, user_id):
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f"Bench{user_id % 1000}"}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self._ids = iter(range(1, 1000))
+
+    def _message(self, **fields):
+        return {'message': {
+            'message_id': next(self._ids), 'date': int(time.time()),
+            'chat': self.chat, 'from': self.user, **fields
+        }}
+
+    def command(self, text):
+        return self._message(text=text, entities=[
+            {'type': 'bot_command', 'offset': 0, 'length': len(text)}
+        ])
+
+    def contact(self):
+        return self._message(contact={
+            'phone_number': f"+7{self.user['id'] % 10 ** 10:010d}",
+            'first_name': self.user['first_name'],
+            'user_id': self.user['id'],
+        })
+
+    def callback(self, data):
+        return {'callback_query': {
+            'id': f"{self.user['id']}-{next(self._ids)}",
+            'from': self.user,
+            'chat_instance': 'benchmark',
+            'data': data,
+            'message': {
+                'message_id': 1, 'date': int(time.time()),
+                'chat': self.chat, 'from': BOT_USER, 'text': '...'
+            },
+        }}
+
+
+async def run_journey(api, user_id, latencies, errors, timeout):
+    """Один сценарий пользователя; задержка каждого шага — до нужного ответа бота"""
+    factory = _UpdateFactory(user_id)
+    updates = {
+        'start': lambda: factory.command('/start'),
+        'tariffs': lambda: factory.callback('tariffs'),
+        'contact': factory.contact,
+        'select_basic': lambda: factory.callback('select_basic'),
+    }
+    for step, method, responses in STEPS:
+        started = time.perf_counter()
+        await api.push_update(updates[step]())
+        try:
+            for _ in range(responses):
+                await api.wait_for(user_id, method, timeout=timeout)
+        except asyncio.TimeoutError:
+            errors[step] += 1
+            return False
+        latencies[step].append(time.perf_counter() - started)
+    return True
+
+
+def _prepare_environment(api_url):
+    """Окружение бота: фейковый API, временная БД, без сервера метрик"""
+    os.environ['BOT_TOKEN'] = '123456:BENCHMARK'
+    os.environ['TELEGRAM_API_URL'] = api_url
+    os.environ['BOT_MODE'] = 'polling'
+    os.environ['ADMIN_ID'] = ''
+    os.environ['METRICS_PORT'] = '0'
+    # Статистика запросов в отчёте (в боте профилирование по умолчанию выключено)
+    os.environ.setdefault('DB_PROFILE', 'True')
+    temp_dir = None
+    if not (os.getenv('DATABASE_URL') or os.getenv('POSTGRES_HOST')):
+        temp_dir = tempfile.TemporaryDirectory(prefix='bot-bench-')
+        os.environ['DATABASE_NAME'] = os.path.join(temp_dir.name, 'bench.db')
+    return temp_dir
+
+
+def _collect_report(args, elapsed, latencies, errors, completed, api):
+    """Итоги прогона в виде словаря (его же сохраняем в JSON)"""
+    from services.metrics import UPDATE_DURATION, DB_QUERY_DURATION
+    from database.profiler import get_query_stats
+
+    updates = sum(len(values) for values in latencies.values())
+    report = {
+        'params': {
+            'users': args.users, 'rate': args.rate, 'latency': args.latency,
+            'flood_rate': args.flood_rate,
+        },
+        'elapsed': elapsed,
+        'journeys_completed': completed,
+        'journeys_failed': args.users - completed,
+        'updates': updates,
+        'updates_per_second': updates / elapsed if elapsed else 0.0,
+        'steps': {},
+        'handlers': {},
+        'db': {},
+        'api': {'requests': dict(api.requests), 'floods': dict(api.floods)},
+        'errors': dict(errors),
+    }
+
+    for step, _, _ in STEPS:
+        values = latencies.get(step, [])
+        report['steps'][step] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else None,
+        }
+
+    for labels in UPDATE_DURATION.label_sets():
+        name = f"{labels['router']}.{labels['handler']}"
+        count = UPDATE_DURATION.get_count(**labels)
+        report['handlers'][name] = {
+            'count': count,
+            'avg': UPDATE_DURATION.get_sum(**labels) / count if count else None,
+            'p50': UPDATE_DURATION.quantile(0.5, **labels),
+            'p95': UPDATE_DURATION.quantile(0.95, **labels),
+            'p99': UPDATE_DURATION.quantile(0.99, **labels),
+        }
+
+    statements = get_query_stats()
+    queries = sum(item.calls for item in statements)
+    report['db'] = {
+        'queries': queries,
+        'query_time': sum(item.total_time for item in statements),
+        'queries_per_update': queries / updates if updates else None,
+        'functions': {
+            labels['function']: DB_QUERY_DURATION.get_count(**labels)
+            for labels in DB_QUERY_DURATION.label_sets()
+        },
+        'top_statements': [
+            {'sql': item.sql[:200], 'calls': item.calls, 'total_time': item.total_time,
+             'max_time': item.max_time, 'rows': item.rows}
+            for item in statements[:5]
+        ],
+    }
+    return report
+
+
+def _ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "       —"
+
+
+def _delta(current, previous):
+    if current is None or not previous:
+        return ""
+    return f"  ({(current - previous) / previous * 100:+.1f}%)"
+
+
+def print_report(report, baseline=None):
+    base_steps = (baseline or {}).get('steps', {})
+    print()
+    print(f"Сценариев: {report['journeys_completed']} завершено, {report['journeys_failed']} с ошибкой")
+    print(f"Обновлений: {report['updates']} за {report['elapsed']:.1f} сек — "
+          f"{report['updates_per_second']:.1f} обн./сек"
+          + _delta(report['updates_per_second'], (baseline or {}).get('updates_per_second')))
+
+    print("\nЗадержка шагов (до ответа бота), мс:")
+    print(f"  {'шаг':<14}{'кол-во':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for step, stats in report['steps'].items():
+        print(f"  {step:<14}{stats['count']:>8}{_ms(stats['p50'])} {_ms(stats['p95'])} "
+              f"{_ms(stats['p99'])} {_ms(stats['max'])}"
+              + _delta(stats['p95'], base_steps.get(step, {}).get('p95')))
+
+    print("\nОбработчики (оценка по гистограмме), мс:")
+    print(f"  {'обработчик':<40}{'кол-во':>8}{'сред.':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in sorted(report['handlers'].items(), key=lambda item: -item[1]['count']):
+        print(f"  {name:<40}{stats['count']:>8}{_ms(stats['avg'])} {_ms(stats['p50'])} "
+              f"{_ms(stats['p95'])} {_ms(stats['p99'])}")
+
+    db = report['db']
+    print(f"\nБД: {db['queries']} запросов, {db['query_time'] * 1000:.0f} мс суммарно, "
+          f"{db['queries_per_update'] or 0:.2f} запроса на обновление")
+    for item in db['top_statements']:
+        print(f"  {item['total_time'] * 1000:8.1f} мс  {item['calls']:>6} × {item['sql'][:90]}")
+
+    api = report['api']
+    print(f"\nBot API: {sum(api['requests'].values())} запросов "
+          f"({', '.join(f'{k}={v}' for k, v in sorted(api['requests'].items()))}), "
+          f"429: {sum(api['floods'].values())}")
+    if report['errors']:
+        print(f"Таймауты шагов: {report['errors']}")
+
+
+async def _stop_bot(bot_task, timeout=10.0):
+    """
+    Остановить бота так же, как при SIGTERM (aiogram сам останавливает polling
+    и выполняет shutdown), а если это невозможно — отменить задачу
+    """
+    if not bot_task.done() and os.name != 'nt':
+        signal.raise_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.shield(bot_task), timeout)
+        except (asyncio.TimeoutError, Exception):
+            pass
+    bot_task.cancel()
+    await asyncio.gather(bot_task, return_exceptions=True)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+
+    api = FakeTelegramAPI(
+        latency=args.latency, flood_rate=args.flood_rate,
+        retry_after=args.retry_after, seed=args.seed
+    )
+    api_url = await api.start()
+    temp_dir = _prepare_environment(api_url)
+
+    # Импорт после настройки окружения: config.py читает его при импорте
+    import bot
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    bot_task = asyncio.create_task(bot.main())
+    try:
+        # Ждём, пока бот начнёт опрашивать getUpdates
+        while not api.requests['getUpdates']:
+            if bot_task.done():
+                bot_task.result()
+                raise RuntimeError("Бот завершился до начала теста")
+            await asyncio.sleep(0.05)
+
+        latencies = defaultdict(list)
+        errors = Counter()
+        journeys = []
+        started = time.perf_counter()
+        for i in range(args.users):
+            journeys.append(asyncio.create_task(
+                run_journey(api, USER_ID_BASE + i, latencies, errors, args.timeout)
+            ))
+            await asyncio.sleep(1 / args.rate)
+        results = await asyncio.gather(*journeys)
+        elapsed = time.perf_counter() - started
+
+        report = _collect_report(args, elapsed, latencies, errors, sum(results), api)
+    finally:
+        await _stop_bot(bot_task)
+        await api.stop()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультат сохранён в {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
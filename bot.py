@@ -8,9 +8,23 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from config import BOT_TOKEN
-from database.db import init_db
+from config import BOT_TOKEN, TELEGRAM_API_URL, BOT_MODE, FSM_STORAGE, METRICS_HOST, METRICS_PORT
+from database.db import init_db, init_pool, close_pool
+from database.aio import shutdown_executor
+from database.fsm_storage import SQLStorage
+from database.event_writer import start_event_writer, stop_event_writer
+from services.broadcast import resume_broadcast_jobs, stop_broadcast_jobs
+from services.rollups import start_rollup_refresher, stop_rollup_refresher
+from services.retention import start_actions_maintenance, stop_actions_maintenance
+from services.webhook import run_webhook
+from services.metrics import start_metrics_server
+from middlewares.scheduler import setup_update_scheduler
+from middlewares.metrics import setup_metrics_middlewares
+from middlewares.retry import setup_retry_middleware
+from middlewares.throttling import setup_throttling_middleware
 from handlers import start, callbacks, contact, admin
 
 
@@ -34,15 +48,28 @@ async def main():
 
     logger.info("🚀 Бот запускается...")
 
-    # Инициализация базы данных
+    # Пул подключений к БД (один на весь процесс) и инициализация таблиц
+    init_pool()
     init_db()
 
     # Инициализация бота и диспетчера
+    # Свой адрес Bot API (локальный сервер или фейковый для нагрузочного теста)
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
     bot = Bot(
         token=BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher()
+
+    # Состояния FSM хранятся в БД: переживают перезапуск и общие для всех процессов
+    if FSM_STORAGE == "sql":
+        storage = SQLStorage()
+        await storage.cleanup()
+        dp = Dispatcher(storage=storage)
+    else:
+        dp = Dispatcher()
 
     # Подключение роутеров (обработчиков)
     dp.include_router(admin.router)
@@ -50,10 +77,54 @@ async def main():
     dp.include_router(contact.router)
     dp.include_router(callbacks.router)
 
+    # Обновления разных чатов — параллельно, одного чата — по порядку
+    # (вся цепочка middleware, включая FSM, выполняется уже в пуле обработчиков)
+    scheduler = setup_update_scheduler(dp)
+
+    # Ответ 429 (flood control): запрос повторяется после паузы, а не роняет обработчик
+    setup_retry_middleware(bot)
+    # Замеры времени обработчиков и запросов к Bot API (для /metrics)
+    setup_metrics_middlewares(dp, bot)
+    # Антифлуд: частые нажатия отбрасываются до обработчиков и БД
+    setup_throttling_middleware(dp)
+
     logger.info("✅ Бот успешно запущен и готов к работе!")
 
-    # Запуск бота
-    await dp.start_polling(bot, skip_updates=True)
+    # Буфер статистики: действия пишутся в БД пачками в фоне
+    start_event_writer()
+    # Сводки для /funnel досчитываются в фоне по новым действиям
+    start_rollup_refresher()
+    # Секции user_actions на будущие месяцы, архив и удаление устаревших
+    start_actions_maintenance()
+
+    # Рассылки, прерванные прошлой остановкой бота, продолжаются с места остановки
+    await resume_broadcast_jobs(bot)
+    # Останавливаем их до закрытия сессии бота, прогресс сохранится
+    dp.shutdown.register(stop_broadcast_jobs)
+
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        logger.info(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    # Запуск бота: long polling или webhook (BOT_MODE в config.py)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Если раньше бот работал через webhook — снимаем его, иначе getUpdates не работает
+            await bot.delete_webhook()
+            # С планировщиком polling только раскладывает обновления по очередям
+            await dp.start_polling(bot, skip_updates=True, handle_as_tasks=scheduler is None)
+    finally:
+        await stop_broadcast_jobs()
+        await stop_event_writer()
+        await stop_rollup_refresher()
+        await stop_actions_maintenance()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        shutdown_executor()
+        close_pool()
 
 
 if __name__ == '__main__':
@@ -11,6 +11,10 @@ load_dotenv()
 # Токен бота (получить у @BotFather)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE")
 
+# Адрес Bot API (пусто — api.telegram.org); например, локальный telegram-bot-api
+# или фейковый сервер для нагрузочного теста (benchmarks/load_test.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
 # ID администраторов (для уведомлений и статистики)
 # Чтобы узнать свой ID, используйте команду /myid в боте
 # Можно указать несколько ID через запятую: 123456789,987654321
@@ -40,3 +44,178 @@ DATABASE_NAME = os.getenv("DATABASE_NAME", "bot_database.db")
 
 # Настройки
 DEBUG = os.getenv("DEBUG", "False") == "True"
+
+# Пул подключений к БД
+# DB_POOL_MIN_SIZE — сколько подключений открыть сразу при старте
+# DB_POOL_MAX_SIZE — верхний предел одновременных подключений (не превышайте лимит PostgreSQL)
+# DB_POOL_TIMEOUT — сколько секунд ждать свободное подключение
+# DB_POOL_HEALTHCHECK_INTERVAL — после скольких секунд простоя подключение проверяется перед выдачей
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))
+
+# Режим выполнения запросов к БД из обработчиков
+# thread — в отдельном пуле потоков (event loop не блокируется, по умолчанию)
+# inline — прямо в event loop (для отладки)
+# DB_EXECUTOR_WORKERS — сколько запросов к БД выполняется одновременно
+DB_EXECUTION_MODE = os.getenv("DB_EXECUTION_MODE", "thread")
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX_SIZE)))
+
+# Буферизованная запись действий пользователей (user_actions, tariff_selections)
+# События копятся в памяти и пишутся пачкой: раз в EVENT_FLUSH_INTERVAL секунд
+# или при накоплении EVENT_BATCH_SIZE штук
+# EVENT_QUEUE_SIZE — предел очереди; при переполнении обработчики ждут (backpressure)
+# EVENT_MAX_RETRIES — сколько раз повторять пачку, если БД недоступна (потом она отбрасывается)
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "10000"))
+EVENT_MAX_RETRIES = int(os.getenv("EVENT_MAX_RETRIES", "5"))
+
+# Настройки производительности SQLite
+# WAL — читатели не блокируют запись, synchronous=NORMAL — без fsync на каждый commit
+# SQLITE_CACHE_SIZE — в КиБ при отрицательном значении (-65536 = 64 МБ)
+# SQLITE_BUSY_TIMEOUT — сколько мс ждать освобождения блокировки вместо "database is locked"
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+# Сколько секунд кэшировать статистику для /stats (0 — не кэшировать)
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+
+# Кэш «есть ли у пользователя контакт» (для кнопки «Условия доступа»)
+# CONTACT_CACHE_SIZE — сколько пользователей держать в памяти, CONTACT_CACHE_TTL — время жизни в секундах
+CONTACT_CACHE_SIZE = int(os.getenv("CONTACT_CACHE_SIZE", "50000"))
+CONTACT_CACHE_TTL = float(os.getenv("CONTACT_CACHE_TTL", "600"))
+
+# Экспорт контактов
+# EXPORT_COMPRESSION — none (обычный CSV), gzip (.csv.gz) или zip (.zip)
+# EXPORT_SPOOL_MAX_SIZE — до какого размера (байт) файл держится в памяти, дальше — временный файл на диске
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "none").lower()
+EXPORT_SPOOL_MAX_SIZE = int(os.getenv("EXPORT_SPOOL_MAX_SIZE", str(8 * 1024 * 1024)))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+# Рассылка
+# BROADCAST_RATE — сообщений в секунду на весь бот (лимит Telegram ~30/сек)
+# BROADCAST_CONCURRENCY — сколько сообщений отправляется параллельно
+# BROADCAST_MAX_RETRIES — повторы при flood control (429) и сетевых ошибках
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "28"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# BROADCAST_CHECKPOINT_SIZE — через сколько отправок сохранять прогресс рассылки в БД
+BROADCAST_CHECKPOINT_SIZE = int(os.getenv("BROADCAST_CHECKPOINT_SIZE", "100"))
+# BROADCAST_PROGRESS_INTERVAL — как часто (сек) обновлять сообщение с прогрессом рассылки
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Хранилище состояний FSM (форма контакта, рассылка)
+# FSM_STORAGE — sql (в БД бота, переживает перезапуск и общее для нескольких процессов)
+#   или memory (в памяти процесса)
+# FSM_STATE_TTL — через сколько секунд без изменений состояние считается устаревшим
+# FSM_CACHE_SIZE / FSM_CACHE_TTL — кэш состояний в памяти процесса; по умолчанию
+#   выключен (FSM_CACHE_TTL=0): другой процесс или реплика webhook иначе видели бы
+#   устаревшее состояние. Включайте, только если пользователя обслуживает один процесс
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sql").lower()
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "0"))
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+# В режиме webhook Telegram сам присылает обновления на WEBHOOK_BASE_URL + WEBHOOK_PATH
+# WEBHOOK_BASE_URL — публичный HTTPS-адрес бота, например https://bot.example.com
+# WEBHOOK_SECRET — секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+#   (A-Z, a-z, 0-9, _ и -; если не указан — вычисляется из токена бота,
+#   одинаково на всех экземплярах)
+# WEBAPP_HOST / WEBAPP_PORT — где слушает встроенный веб-сервер
+# WEBHOOK_MAX_CONNECTIONS — сколько одновременных запросов Telegram шлёт на webhook
+# WEBHOOK_SHUTDOWN_TIMEOUT — сколько секунд ждать обработки текущих обновлений при остановке
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))
+
+# Профилирование запросов к БД
+# DB_PROFILE — учитывать время и число строк каждого запроса
+# DB_SLOW_QUERY_MS — запросы дольше этого порога (мс) пишутся в лог (0 — не писать)
+# DB_EXPLAIN_SLOW — добавлять в лог план выполнения медленного запроса
+DB_PROFILE = os.getenv("DB_PROFILE", "False") == "True"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_EXPLAIN_SLOW = os.getenv("DB_EXPLAIN_SLOW", "False") == "True"
+
+# Метрики в формате Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics
+# Время обработчиков, запросов к БД и к Bot API (гистограммы для p50/p95/p99)
+# METRICS_PORT=0 — не запускать HTTP-сервер метрик
+# Эндпоинт без авторизации, поэтому по умолчанию слушает только localhost;
+# METRICS_HOST=0.0.0.0 — только за файрволом или в закрытой сети
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Защита от частых нажатий (антифлуд), на пользователя
+# THROTTLE_CALLBACK_RATE / THROTTLE_CALLBACK_BURST — нажатий одной и той же кнопки в секунду
+#   и сколько нажатий подряд допускается
+# THROTTLE_USER_RATE / THROTTLE_USER_BURST — всех нажатий и сообщений пользователя в секунду
+# THROTTLE_MAX_KEYS — сколько счётчиков держать в памяти (неактивные удаляются сами)
+# Скорость 0 отключает соответствующее ограничение
+THROTTLE_CALLBACK_RATE = float(os.getenv("THROTTLE_CALLBACK_RATE", "1"))
+THROTTLE_CALLBACK_BURST = int(os.getenv("THROTTLE_CALLBACK_BURST", "2"))
+THROTTLE_USER_RATE = float(os.getenv("THROTTLE_USER_RATE", "3"))
+THROTTLE_USER_BURST = int(os.getenv("THROTTLE_USER_BURST", "10"))
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "100000"))
+
+# Повтор запросов к Bot API после flood control (429) вне рассылок
+# API_RETRY_ATTEMPTS — сколько раз повторять (0 — не повторять),
+# API_RETRY_MAX_WAIT — дольше стольких секунд не ждать (ошибка уходит обработчику)
+API_RETRY_ATTEMPTS = int(os.getenv("API_RETRY_ATTEMPTS", "3"))
+API_RETRY_MAX_WAIT = float(os.getenv("API_RETRY_MAX_WAIT", "10"))
+
+# Кэш последнего показанного экрана в каждом сообщении: повторное нажатие
+# кнопки того же экрана не вызывает editMessageText
+# EDIT_CACHE_SIZE — сколько сообщений помнить (0 — отключить),
+# EDIT_CACHE_TTL — сколько секунд (при нескольких процессах бота держите небольшим)
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "50000"))
+EDIT_CACHE_TTL = float(os.getenv("EDIT_CACHE_TTL", "3600"))
+
+# Планировщик обновлений: параллельно для разных чатов, строго по порядку внутри чата
+# UPDATE_WORKERS — сколько обновлений обрабатывается одновременно (0 — без планировщика,
+#   каждое обновление в отдельной задаче aiogram)
+# UPDATE_CHAT_QUEUE_SIZE — сколько обновлений одного чата может ждать (лишние отбрасываются)
+# UPDATE_MAX_PENDING — сколько обновлений всего может ждать; дальше приём новых
+#   обновлений приостанавливается, пока очередь не освободится
+# UPDATE_DRAIN_TIMEOUT — сколько секунд при остановке ждать обработки очереди
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+UPDATE_CHAT_QUEUE_SIZE = int(os.getenv("UPDATE_CHAT_QUEUE_SIZE", "50"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "5000"))
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "30"))
+
+# Сводки для /funnel: действия по дням и воронка по пользователям
+# досчитываются в фоне по новым строкам user_actions
+# ROLLUP_INTERVAL — как часто (сек) проверять новые действия (0 — только по команде /funnel)
+# ROLLUP_BATCH_SIZE — строк user_actions за одну транзакцию
+# ROLLUP_MAX_BATCHES — пачек за один проход (ограничивает время одного обновления)
+# ROLLUP_LAG — действия моложе стольких секунд ждут следующего прохода
+# ROLLUP_GAP_TIMEOUT — PostgreSQL: сколько секунд ждать пропущенный id перед отметкой
+#   (его транзакция может ещё не завершиться); дольше — id считается откатившимся
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "50000"))
+ROLLUP_MAX_BATCHES = int(os.getenv("ROLLUP_MAX_BATCHES", "20"))
+ROLLUP_LAG = float(os.getenv("ROLLUP_LAG", "30"))
+ROLLUP_GAP_TIMEOUT = float(os.getenv("ROLLUP_GAP_TIMEOUT", "300"))
+
+# Хранение user_actions (PostgreSQL — помесячные секции, SQLite — удаление пачками)
+# ACTIONS_RETENTION_MONTHS — сколько полных месяцев хранить кроме текущего (0 — хранить всё)
+# ACTIONS_ARCHIVE_DIR — куда сохранять устаревшие месяцы (.csv.gz) перед удалением
+#   (пусто — удалять без архива)
+# ACTIONS_PARTITIONS_AHEAD — на сколько месяцев вперёд создавать секции (PostgreSQL)
+# ACTIONS_MAINTENANCE_INTERVAL — как часто (сек) создавать секции и удалять устаревшее
+# ACTIONS_DELETE_BATCH_SIZE — строк за одно удаление в SQLite
+ACTIONS_RETENTION_MONTHS = int(os.getenv("ACTIONS_RETENTION_MONTHS", "0"))
+ACTIONS_ARCHIVE_DIR = os.getenv("ACTIONS_ARCHIVE_DIR", "data/archive")
+ACTIONS_PARTITIONS_AHEAD = int(os.getenv("ACTIONS_PARTITIONS_AHEAD", "2"))
+ACTIONS_MAINTENANCE_INTERVAL = float(os.getenv("ACTIONS_MAINTENANCE_INTERVAL", str(6 * 3600)))
+ACTIONS_DELETE_BATCH_SIZE = int(os.getenv("ACTIONS_DELETE_BATCH_SIZE", "10000"))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Асинхронные обёртки над database/db.py для обработчиков aiogram
+Синхронный запрос выполняется в ограниченном пуле потоков (DB_EXECUTOR_WORKERS)
+с подключением из пула, поэтому event loop продолжает обрабатывать
+другие чаты, пока запрос выполняется:
+
+    from database.aio import log_action
+    await log_action(user_id, 'start')
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DB_EXECUTION_MODE, DB_EXECUTOR_WORKERS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Пул потоков для запросов к БД (создаётся при первом обращении)
+_executor = None
+
+
+def get_executor():
+    """
+    Пул потоков для запросов к БД
+    Размер ограничен, чтобы тяжёлый запрос (например, /export) не занял
+    все подключения и не вытеснил запросы других пользователей
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DB_EXECUTOR_WORKERS,
+            thread_name_prefix="db"
+        )
+        logger.info(f"✅ Пул потоков БД создан (workers={DB_EXECUTOR_WORKERS})")
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Дождаться выполнения начатых запросов и остановить пул потоков
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполнить синхронную функцию БД
+    В режиме thread — в пуле потоков, в режиме inline — прямо в event loop
+    """
+    if DB_EXECUTION_MODE == "inline":
+        return func(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(),
+        functools.partial(func, *args, **kwargs)
+    )
+
+
+def _async_variant(func):
+    """Асинхронный вариант функции из database/db.py"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+async def log_action(user_id, action_type, action_data=None):
+    """
+    Записать действие пользователя для статистики
+    Если запущен буфер событий — событие ставится в очередь без ожидания БД
+    """
+    from database.event_writer import get_event_writer, ACTION
+
+    writer = get_event_writer()
+    if writer is None:
+        return await run_db(db.log_action, user_id, action_type, action_data)
+    await writer.put(ACTION, (user_id, action_type, action_data, db.event_timestamp()))
+
+
+async def log_tariff_selection(user_id, tariff_type):
+    """
+    Записать выбор тарифа пользователем (через буфер событий, если он запущен)
+    """
+    from database.event_writer import get_event_writer, TARIFF_SELECTION
+
+    writer = get_event_writer()
+    if writer is None:
+        return await run_db(db.log_tariff_selection, user_id, tariff_type)
+    await writer.put(TARIFF_SELECTION, (user_id, tariff_type, db.event_timestamp()))
+
+
+async def user_has_contact(user_id):
+    """
+    Есть ли у пользователя контакт
+    Попадание в кэш отвечает сразу, без перехода в пул потоков
+    """
+    cached = db.contact_cache.get(user_id, None)
+    if cached is not None:
+        return cached
+    return await run_db(db.user_has_contact, user_id)
+
+
+async def get_all_user_ids(batch_size=1000):
+    """
+    Асинхронный генератор user_id активных пользователей (пачками из пула потоков)
+    """
+    after = None
+    while True:
+        user_ids = await run_db(db.get_active_user_ids_page, after, batch_size)
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            yield user_id
+        after = user_ids[-1]
+
+
+add_or_update_user = _async_variant(db.add_or_update_user)
+get_user_count = _async_variant(db.get_user_count)
+get_active_user_count = _async_variant(db.get_active_user_count)
+get_tariff_stats = _async_variant(db.get_tariff_stats)
+get_dashboard_stats = _async_variant(db.get_dashboard_stats)
+get_stats_summary = _async_variant(db.get_stats_summary)
+save_phone_number = _async_variant(db.save_phone_number)
+get_user_phone = _async_variant(db.get_user_phone)
+get_users_with_contacts = _async_variant(db.get_users_with_contacts)
+get_contacts_count = _async_variant(db.get_contacts_count)
+get_recent_users_count = _async_variant(db.get_recent_users_count)
+create_broadcast_job = _async_variant(db.create_broadcast_job)
+refresh_action_rollups = _async_variant(db.refresh_action_rollups)
+get_rollup_state = _async_variant(db.get_rollup_state)
+get_funnel = _async_variant(db.get_funnel)
+get_action_rollup = _async_variant(db.get_action_rollup)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Ограниченный LRU-кэш с временем жизни записей (TTL)
+Используется для «горячих» данных, которые почти не меняются
+(например, есть ли у пользователя сохранённый контакт)
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Значение по умолчанию для get(), отличимое от сохранённого None
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш: не больше maxsize записей,
+    каждая запись живёт ttl секунд (ttl <= 0 — без ограничения по времени)
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        """Значение по ключу или default, если записи нет или она устарела"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Сохранить значение (самая давно неиспользуемая запись вытесняется)"""
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Удалить запись"""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
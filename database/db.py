@@ -4,28 +4,58 @@
 Сохранение информации о пользователях и их действиях для статистики
 """
 import os
+import json
+import inspect
+import time
 import logging
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from config import (
     USE_POSTGRES, DATABASE_URL, POSTGRES_HOST, POSTGRES_PORT,
-    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, DATABASE_NAME
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, DATABASE_NAME,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+    DB_POOL_HEALTHCHECK_INTERVAL, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+    SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT, SQLITE_CACHED_STATEMENTS,
+    STATS_CACHE_TTL, CONTACT_CACHE_SIZE, CONTACT_CACHE_TTL, DB_PROFILE,
+    ROLLUP_BATCH_SIZE, ROLLUP_MAX_BATCHES, ROLLUP_LAG, ROLLUP_GAP_TIMEOUT
 )
+from database.pool import ConnectionPool
+from database.cache import TTLCache
+from database.migrations import apply_migrations, get_schema_version
+from database.profiler import make_sqlite_connection_factory, make_postgres_cursor_factory
+from services.metrics import instrument_db_function
 
 logger = logging.getLogger(__name__)
 
 # Импорты в зависимости от типа БД
 if USE_POSTGRES:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_values, execute_batch
     from urllib.parse import urlparse
+    # Ошибки самих данных (а не подключения): строку бесполезно повторять
+    _ROW_ERRORS = (psycopg2.IntegrityError, psycopg2.DataError)
 else:
     import sqlite3
+    _ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.DataError)
 
 
-def get_connection():
+# Общий пул подключений (создаётся один раз в init_pool)
+_pool = None
+
+# Кэш статистики для /stats: (момент устаревания, данные)
+_stats_cache = None
+_stats_cache_lock = threading.Lock()
+
+# Кэш «есть ли у пользователя контакт»: user_id -> bool
+# Заполняется при чтении и сразу обновляется в save_phone_number (write-through)
+contact_cache = TTLCache(maxsize=CONTACT_CACHE_SIZE, ttl=CONTACT_CACHE_TTL)
+
+
+def create_connection():
     """
-    Получить подключение к БД (SQLite или PostgreSQL)
+    Открыть новое подключение к БД (SQLite или PostgreSQL)
+    Используется пулом; в обработчиках берите подключение через get_connection()
     """
     if USE_POSTGRES:
         # PostgreSQL подключение
@@ -37,7 +67,8 @@ def get_connection():
                 user=result.username,
                 password=result.password,
                 host=result.hostname,
-                port=result.port
+                port=result.port,
+                **_profiler_options()
             )
         else:
             # Используем отдельные переменные
@@ -46,7 +77,8 @@ def get_connection():
                 port=POSTGRES_PORT,
                 database=POSTGRES_DB,
                 user=POSTGRES_USER,
-                password=POSTGRES_PASSWORD
+                password=POSTGRES_PASSWORD,
+                **_profiler_options()
             )
     else:
         # SQLite подключение (согласно документации Bothost)
@@ -58,203 +90,364 @@ def get_connection():
         DB_PATH = DATA_DIR / DATABASE_NAME
 
         # Подключаемся к базе
-        conn = sqlite3.connect(str(DB_PATH))
+        # check_same_thread=False — подключение из пула может использоваться
+        # разными потоками (но не одновременно)
+        # cached_statements — кэш подготовленных выражений на подключение
+        conn = sqlite3.connect(
+            str(DB_PATH),
+            check_same_thread=False,
+            timeout=SQLITE_BUSY_TIMEOUT / 1000,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+            **_profiler_options()
+        )
+        _apply_sqlite_pragmas(conn)
         return conn
 
 
-def init_db():
+def _profiler_options():
     """
-    Инициализация базы данных
-    Создание таблиц если их нет
+    Аргументы подключения, включающие профилирование запросов (DB_PROFILE):
+    курсоры замеряют каждый запрос, медленные попадают в лог с планом выполнения
     """
-    # Проверяем существование базы данных (для SQLite)
-    if not USE_POSTGRES:
-        DATA_DIR = Path("data")
-        DB_PATH = DATA_DIR / DATABASE_NAME
+    if not DB_PROFILE:
+        return {}
+    if USE_POSTGRES:
+        return {'cursor_factory': make_postgres_cursor_factory()}
+    return {'factory': make_sqlite_connection_factory()}
 
-        if DB_PATH.exists():
-            logger.info(f"✅ База данных уже существует: {DB_PATH}")
-        else:
-            logger.info(f"🔨 Создаём новую базу данных: {DB_PATH}")
 
-    conn = get_connection()
+def _apply_sqlite_pragmas(conn):
+    """
+    Настройки SQLite для долгоживущих подключений из пула:
+    WAL + synchronous=NORMAL, mmap, увеличенный кэш страниц и busy_timeout
+    """
     cursor = conn.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def init_pool():
+    """
+    Создать пул подключений (вызывается один раз при старте бота)
+    """
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            create_connection,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL
+        )
+        logger.info(f"✅ Пул подключений к БД создан (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
+    return _pool
+
+
+def close_pool():
+    """
+    Закрыть пул подключений (при остановке бота)
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+        logger.info("🔌 Пул подключений к БД закрыт")
+
+
+def get_connection():
+    """
+    Подключение из пула для блока with:
+        with get_connection() as conn:
+            ...
+    При выходе из блока — commit (или rollback при ошибке) и возврат в пул
+    """
+    if _pool is None:
+        init_pool()
+    return _pool.connection()
 
-    if USE_POSTGRES:
-        # PostgreSQL синтаксис
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                phone_number TEXT,
-                first_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_actions (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                action_type TEXT,
-                action_data TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tariff_selections (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                tariff_type TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-    else:
-        # SQLite синтаксис
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                phone_number TEXT,
-                first_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_actions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action_type TEXT,
-                action_data TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tariff_selections (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                tariff_type TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        ''')
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """
+    Инициализация базы данных
+    Применение миграций схемы (таблицы, индексы) — см. database/migrations.py
+    """
+    with get_connection() as conn:
+        # Файл SQLite к этому моменту уже создан пулом подключений,
+        # поэтому новая база — та, в которой ещё нет таблиц
+        if not USE_POSTGRES:
+            DB_PATH = Path("data") / DATABASE_NAME
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+            if cursor.fetchone():
+                logger.info(f"✅ База данных уже существует: {DB_PATH}")
+            else:
+                logger.info(f"🔨 Создаём новую базу данных: {DB_PATH}")
+
+        applied = apply_migrations(conn)
+        version = get_schema_version(conn)
 
     db_type = "PostgreSQL" if USE_POSTGRES else "SQLite"
-    logger.info(f"✅ База данных инициализирована ({db_type})")
+    if applied:
+        logger.info(f"🔧 Применено миграций: {len(applied)}")
+    logger.info(f"✅ База данных инициализирована ({db_type}, схема v{version})")
 
 
 def add_or_update_user(user_id, username=None, first_name=None, last_name=None):
     """
     Добавить или обновить информацию о пользователе
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    if USE_POSTGRES:
-        # PostgreSQL: используем %s вместо ?
-        cursor.execute('''
-            INSERT INTO users (user_id, username, first_name, last_name)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username=EXCLUDED.username,
-                first_name=EXCLUDED.first_name,
-                last_name=EXCLUDED.last_name,
-                last_interaction=CURRENT_TIMESTAMP
-        ''', (user_id, username, first_name, last_name))
-    else:
-        # SQLite: используем ?
-        cursor.execute('''
-            INSERT INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username=excluded.username,
-                first_name=excluded.first_name,
-                last_name=excluded.last_name,
-                last_interaction=CURRENT_TIMESTAMP
-        ''', (user_id, username, first_name, last_name))
-
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        if USE_POSTGRES:
+            # PostgreSQL: используем %s вместо ?
+            cursor.execute('''
+                INSERT INTO users (user_id, username, first_name, last_name)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username=EXCLUDED.username,
+                    first_name=EXCLUDED.first_name,
+                    last_name=EXCLUDED.last_name,
+                    last_interaction=CURRENT_TIMESTAMP,
+                    delivery_status=NULL
+            ''', (user_id, username, first_name, last_name))
+        else:
+            # SQLite: используем ?
+            cursor.execute('''
+                INSERT INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username=excluded.username,
+                    first_name=excluded.first_name,
+                    last_name=excluded.last_name,
+                    last_interaction=CURRENT_TIMESTAMP,
+                    delivery_status=NULL
+            ''', (user_id, username, first_name, last_name))
 
 
 def log_action(user_id, action_type, action_data=None):
     """
     Записать действие пользователя для статистики
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    placeholder = '%s' if USE_POSTGRES else '?'
-    cursor.execute(f'''
-        INSERT INTO user_actions (user_id, action_type, action_data)
-        VALUES ({placeholder}, {placeholder}, {placeholder})
-    ''', (user_id, action_type, action_data))
-
-    conn.commit()
-    conn.close()
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f'''
+            INSERT INTO user_actions (user_id, action_type, action_data)
+            VALUES ({placeholder}, {placeholder}, {placeholder})
+        ''', (user_id, action_type, action_data))
 
 
 def log_tariff_selection(user_id, tariff_type):
     """
     Записать выбор тарифа пользователем
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    placeholder = '%s' if USE_POSTGRES else '?'
-    cursor.execute(f'''
-        INSERT INTO tariff_selections (user_id, tariff_type)
-        VALUES ({placeholder}, {placeholder})
-    ''', (user_id, tariff_type))
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f'''
+            INSERT INTO tariff_selections (user_id, tariff_type)
+            VALUES ({placeholder}, {placeholder})
+        ''', (user_id, tariff_type))
 
-    conn.commit()
-    conn.close()
+        # Последний выбранный тариф храним прямо в users (для /users и /export)
+        cursor.execute(f'''
+            UPDATE users SET last_tariff = {placeholder}
+            WHERE user_id = {placeholder}
+        ''', (tariff_type, user_id))
+
+
+def event_timestamp():
+    """
+    Момент события для отложенной записи (буфер EventWriter)
+    Время фиксируется при постановке в очередь, а не при вставке в БД:
+    для PostgreSQL — aware datetime (приводится к часовому поясу сессии),
+    для SQLite — UTC-строка в формате CURRENT_TIMESTAMP
+    """
+    now = datetime.now(timezone.utc)
+    if USE_POSTGRES:
+        return now
+    return now.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def log_events_batch(actions=(), tariff_selections=()):
+    """
+    Записать пачку событий одной транзакцией
+    actions — список (user_id, action_type, action_data, timestamp)
+    tariff_selections — список (user_id, tariff_type, timestamp)
+    PostgreSQL: многострочный INSERT (execute_values), SQLite: executemany
+    """
+    if not actions and not tariff_selections:
+        return
+
+    # Последний тариф каждого пользователя в пачке (события идут по порядку)
+    last_tariffs = {user_id: tariff_type for user_id, tariff_type, _ in tariff_selections}
+    last_tariff_rows = [(tariff_type, user_id) for user_id, tariff_type in last_tariffs.items()]
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        if USE_POSTGRES:
+            if actions:
+                execute_values(cursor, """
+                    INSERT INTO user_actions (user_id, action_type, action_data, timestamp)
+                    VALUES %s
+                """, actions, page_size=1000)
+            if tariff_selections:
+                execute_values(cursor, """
+                    INSERT INTO tariff_selections (user_id, tariff_type, timestamp)
+                    VALUES %s
+                """, tariff_selections, page_size=1000)
+                cursor.executemany(
+                    "UPDATE users SET last_tariff = %s WHERE user_id = %s",
+                    last_tariff_rows
+                )
+        else:
+            if actions:
+                cursor.executemany("""
+                    INSERT INTO user_actions (user_id, action_type, action_data, timestamp)
+                    VALUES (?, ?, ?, ?)
+                """, actions)
+            if tariff_selections:
+                cursor.executemany("""
+                    INSERT INTO tariff_selections (user_id, tariff_type, timestamp)
+                    VALUES (?, ?, ?)
+                """, tariff_selections)
+                cursor.executemany(
+                    "UPDATE users SET last_tariff = ? WHERE user_id = ?",
+                    last_tariff_rows
+                )
+
+
+def log_events_each(actions=(), tariff_selections=()):
+    """
+    Записать события по одному, каждое — своей транзакцией
+    (если пачка не записалась из-за отдельных строк, например действия
+    пользователя, которого ещё нет в users).
+    Строки с ошибкой данных пропускаются; на ошибке подключения запись
+    останавливается. Возвращает (отклонено, незаписанные actions,
+    незаписанные tariff_selections); отклонено — список (строка, ошибка)
+    """
+    rejected = []
+    actions, tariff_selections = list(actions), list(tariff_selections)
+    for rows, kind in ((actions, 'actions'), (tariff_selections, 'tariff_selections')):
+        while rows:
+            try:
+                log_events_batch(**{kind: rows[:1]})
+            except _ROW_ERRORS as e:
+                rejected.append((rows[0], e))
+            except Exception:
+                logger.exception("❌ Запись событий по одному прервана")
+                return rejected, actions, tariff_selections
+            rows.pop(0)
+    return rejected, actions, tariff_selections
 
 
 def get_user_count():
     """
     Получить общее количество пользователей
+    Читается из счётчика stats_counters (поддерживается триггером), без COUNT(*) по users
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute('SELECT COUNT(*) FROM users')
-    count = cursor.fetchone()[0]
+        cursor.execute("SELECT value FROM stats_counters WHERE name = 'users'")
+        result = cursor.fetchone()
 
-    conn.close()
-    return count
+    return result[0] if result else 0
 
 
 def get_tariff_stats():
     """
-    Получить статистику по выбранным тарифам
+    Получить статистику по выбранным тарифам (из счётчиков stats_counters)
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT name, value
+            FROM stats_counters
+            WHERE name LIKE 'tariff:%'
+        """)
+
+        stats = cursor.fetchall()
 
-    cursor.execute('''
-        SELECT tariff_type, COUNT(*) as count
-        FROM tariff_selections
-        GROUP BY tariff_type
-    ''')
+    return {name[len('tariff:'):]: value for name, value in stats}
 
-    stats = cursor.fetchall()
-    conn.close()
 
-    return {row[0]: row[1] for row in stats}
+def get_dashboard_stats():
+    """
+    Все цифры для /stats одним запросом:
+    счётчики (пользователи, контакты, тарифы) и новые пользователи
+    за последние 24 часа / 7 / 30 дней (дневная сводка stats_daily_users
+    плюс неполный граничный день из users).
+    Результат кэшируется на STATS_CACHE_TTL секунд
+    """
+    global _stats_cache
+
+    now = time.monotonic()
+    with _stats_cache_lock:
+        if _stats_cache is not None and _stats_cache[0] > now:
+            return dict(_stats_cache[1])
+
+    # Окна «последние N дней», как раньше по users.first_interaction: целые дни
+    # после граничного — из stats_daily_users, граничный день — по индексу users
+    if USE_POSTGRES:
+        since = "NOW() - INTERVAL '{} days'"
+        boundary_day = "({})::date"
+        next_day = "({})::date + 1"
+    else:
+        since = "datetime('now', '-{} days')"
+        boundary_day = "date({})"
+        next_day = "date({}, '+1 day')"
+
+    def new_users(days):
+        start = since.format(days)
+        return f"""
+            SELECT 'new_users:{days}',
+                (SELECT COALESCE(SUM(new_users), 0) FROM stats_daily_users
+                 WHERE day > {boundary_day.format(start)})
+              + (SELECT COUNT(*) FROM users
+                 WHERE first_interaction >= {start}
+                   AND first_interaction < {next_day.format(start)})
+        """
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(f"""
+            SELECT name, value FROM stats_counters
+            UNION ALL {new_users(1)}
+            UNION ALL {new_users(7)}
+            UNION ALL {new_users(30)}
+        """)
+
+        rows = dict(cursor.fetchall())
+
+    stats = {
+        'total_users': rows.get('users', 0),
+        'contacts': rows.get('contacts', 0),
+        'tariffs': {
+            name[len('tariff:'):]: value
+            for name, value in rows.items() if name.startswith('tariff:')
+        },
+        'new_today': rows.get('new_users:1', 0),
+        'new_week': rows.get('new_users:7', 0),
+        'new_month': rows.get('new_users:30', 0),
+    }
+
+    if STATS_CACHE_TTL > 0:
+        with _stats_cache_lock:
+            _stats_cache = (now + STATS_CACHE_TTL, stats)
+
+    return dict(stats)
 
 
 def get_stats_summary():
@@ -275,47 +468,100 @@ def save_phone_number(user_id, phone_number):
     """
     Сохранить номер телефона пользователя
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    placeholder = '%s' if USE_POSTGRES else '?'
-    cursor.execute(f"""
-        UPDATE users
-        SET phone_number = {placeholder}
-        WHERE user_id = {placeholder}
-    """, (phone_number, user_id))
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            UPDATE users
+            SET phone_number = {placeholder}
+            WHERE user_id = {placeholder}
+        """, (phone_number, user_id))
 
-    conn.commit()
-    conn.close()
+    # Обновляем кэш только после успешного commit
+    contact_cache.set(user_id, bool(phone_number))
 
 
 def get_user_phone(user_id):
     """
     Получить номер телефона пользователя
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    placeholder = '%s' if USE_POSTGRES else '?'
-    cursor.execute(f"""
-        SELECT phone_number
-        FROM users
-        WHERE user_id = {placeholder}
-    """, (user_id,))
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            SELECT phone_number
+            FROM users
+            WHERE user_id = {placeholder}
+        """, (user_id,))
 
-    result = cursor.fetchone()
-    conn.close()
+        result = cursor.fetchone()
 
     return result[0] if result and result[0] else None
 
 
-def get_users_with_contacts(limit=None):
+def user_has_contact(user_id):
     """
-    Получить пользователей с контактами
+    Есть ли у пользователя сохранённый контакт
+    Сначала проверяется кэш contact_cache, при промахе — запрос к БД
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    cached = contact_cache.get(user_id, None)
+    if cached is not None:
+        return cached
+
+    has_contact = get_user_phone(user_id) is not None
+    contact_cache.set(user_id, has_contact)
+    return has_contact
+
+
+def get_users_with_contacts(limit=None, after=None):
+    """
+    Получить пользователей с контактами (новые сначала)
+    Постраничная выборка по курсору (keyset): after — (first_interaction, user_id)
+    последней строки предыдущей страницы. Последний тариф берётся из users.last_tariff
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        params = []
+        query = """
+            SELECT
+                u.user_id,
+                u.username,
+                u.first_name,
+                u.last_name,
+                u.phone_number,
+                u.first_interaction,
+                u.last_tariff as tariff
+            FROM users u
+            WHERE u.phone_number IS NOT NULL
+        """
+
+        if after is not None:
+            query += f" AND (u.first_interaction, u.user_id) < ({placeholder}, {placeholder})"
+            params.extend(after)
+
+        query += " ORDER BY u.first_interaction DESC, u.user_id DESC"
+
+        if limit:
+            query += f" LIMIT {placeholder}"
+            params.append(limit)
+
+        cursor.execute(query, params)
+        results = cursor.fetchall()
 
+    return results
+
+
+def iter_users_with_contacts(batch_size=1000):
+    """
+    Потоково перебрать всех пользователей с контактами (для экспорта)
+    Строки не загружаются в память целиком: PostgreSQL — серверный (именованный)
+    курсор, SQLite — чтение пачками через fetchmany.
+    Подключение из пула занято, пока генератор не будет исчерпан или закрыт
+    """
     query = """
         SELECT
             u.user_id,
@@ -324,55 +570,108 @@ def get_users_with_contacts(limit=None):
             u.last_name,
             u.phone_number,
             u.first_interaction,
-            COALESCE(
-                (SELECT tariff_type FROM tariff_selections
-                 WHERE user_id = u.user_id
-                 ORDER BY timestamp DESC LIMIT 1),
-                NULL
-            ) as tariff
+            u.last_tariff as tariff
         FROM users u
         WHERE u.phone_number IS NOT NULL
-        ORDER BY u.first_interaction DESC
+        ORDER BY u.first_interaction DESC, u.user_id DESC
     """
 
-    if limit:
-        query += f" LIMIT {limit}"
+    with get_connection() as conn:
+        if USE_POSTGRES:
+            cursor = conn.cursor(name="export_users_with_contacts")
+            cursor.itersize = batch_size
+        else:
+            cursor = conn.cursor()
 
-    cursor.execute(query)
-    results = cursor.fetchall()
-    conn.close()
+        cursor.execute(query)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
 
-    return results
 
+def get_users_cursor(row):
+    """
+    Курсор для следующей страницы get_users_with_contacts по последней строке
+    """
+    return (row[5], row[0])
+
+
+# Статусы пользователей, которым сообщения больше не доставляются
+# (NULL в users.delivery_status — пользователь активен)
+DELIVERY_BLOCKED = 'blocked'
+DELIVERY_DEACTIVATED = 'deactivated'
+DELIVERY_CHAT_NOT_FOUND = 'chat_not_found'
+INACTIVE_DELIVERY_STATUSES = (DELIVERY_BLOCKED, DELIVERY_DEACTIVATED, DELIVERY_CHAT_NOT_FOUND)
 
-def get_all_user_ids():
+
+def get_active_user_ids_page(after_user_id=None, limit=1000):
     """
-    Получить все user_id для рассылки
+    Пачка user_id активных пользователей (по возрастанию, после after_user_id)
+    Пользователи, заблокировавшие бота или удалённые, пропускаются
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        query = "SELECT user_id FROM users WHERE delivery_status IS NULL"
+        params = []
 
-    cursor.execute("SELECT user_id FROM users")
-    results = cursor.fetchall()
-    conn.close()
+        if after_user_id is not None:
+            query += f" AND user_id > {placeholder}"
+            params.append(after_user_id)
+
+        query += f" ORDER BY user_id LIMIT {placeholder}"
+        params.append(limit)
+
+        cursor.execute(query, params)
+        results = cursor.fetchall()
 
     return [row[0] for row in results]
 
 
+def get_active_user_count():
+    """
+    Количество активных пользователей — получателей рассылки
+    (те же, что перебирает get_all_user_ids)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT COUNT(*) FROM users WHERE delivery_status IS NULL")
+        result = cursor.fetchone()
+
+    return result[0] if result else 0
+
+
+def get_all_user_ids(batch_size=1000):
+    """
+    Генератор user_id активных пользователей для рассылки
+    Читает пачками по первичному ключу, подключение не держится между пачками
+    """
+    after = None
+    while True:
+        user_ids = get_active_user_ids_page(after, batch_size)
+        if not user_ids:
+            return
+        yield from user_ids
+        after = user_ids[-1]
+
+
 def get_contacts_count():
     """
-    Количество пользователей, оставивших контакты
+    Количество пользователей, оставивших контакты (из счётчика stats_counters)
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT COUNT(*) FROM users
-        WHERE phone_number IS NOT NULL
-    """)
+        cursor.execute("SELECT value FROM stats_counters WHERE name = 'contacts'")
 
-    result = cursor.fetchone()
-    conn.close()
+        result = cursor.fetchone()
 
     return result[0] if result else 0
 
@@ -381,23 +680,608 @@ def get_recent_users_count(days=1):
     """
     Количество новых пользователей за последние N дней
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        if USE_POSTGRES:
+            # PostgreSQL синтаксис для дат
+            cursor.execute("""
+                SELECT COUNT(*) FROM users
+                WHERE first_interaction >= NOW() - INTERVAL '%s days'
+            """, (days,))
+        else:
+            # SQLite синтаксис для дат
+            cursor.execute("""
+                SELECT COUNT(*) FROM users
+                WHERE first_interaction >= datetime('now', '-{} days')
+            """.format(days))
+
+        result = cursor.fetchone()
+
+    return result[0] if result else 0
+
+
+def create_broadcast_job(text, admin_chat_id):
+    """
+    Создать задание рассылки и список получателей (все пользователи на текущий момент)
+    Возвращает (job_id, total)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        if USE_POSTGRES:
+            cursor.execute("""
+                INSERT INTO broadcast_jobs (text, admin_chat_id)
+                VALUES (%s, %s)
+                RETURNING id
+            """, (text, admin_chat_id))
+            job_id = cursor.fetchone()[0]
+        else:
+            cursor.execute("""
+                INSERT INTO broadcast_jobs (text, admin_chat_id)
+                VALUES (?, ?)
+            """, (text, admin_chat_id))
+            job_id = cursor.lastrowid
+
+        # Снимок получателей одним INSERT ... SELECT, без выгрузки в Python
+        # (только активные пользователи — заблокировавшие бота пропускаются)
+        cursor.execute(f"""
+            INSERT INTO broadcast_deliveries (job_id, user_id)
+            SELECT {placeholder}, user_id FROM users
+            WHERE delivery_status IS NULL
+        """, (job_id,))
+        total = cursor.rowcount
+
+        cursor.execute(f"""
+            UPDATE broadcast_jobs SET total = {placeholder}
+            WHERE id = {placeholder}
+        """, (total, job_id))
+
+    return job_id, total
+
+
+def get_pending_deliveries(job_id, after_user_id=None, limit=1000):
+    """
+    Следующая пачка получателей задания, которым сообщение ещё не отправлено
+    (по возрастанию user_id, после after_user_id)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        query = f"""
+            SELECT user_id FROM broadcast_deliveries
+            WHERE job_id = {placeholder} AND status = 'pending'
+        """
+        params = [job_id]
+
+        if after_user_id is not None:
+            query += f" AND user_id > {placeholder}"
+            params.append(after_user_id)
+
+        query += f" ORDER BY user_id LIMIT {placeholder}"
+        params.append(limit)
+
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+
+    return [row[0] for row in results]
+
+
+def save_delivery_results(job_id, results):
+    """
+    Чекпоинт рассылки: сохранить пачку результатов доставки
+    results — список (user_id, delivered: bool, error: str | None)
+    Пользователи с ошибкой из INACTIVE_DELIVERY_STATUSES помечаются в users
+    """
+    if not results:
+        return
+
+    placeholder = '%s' if USE_POSTGRES else '?'
+    rows = [
+        ('sent' if delivered else 'failed', error, job_id, user_id)
+        for user_id, delivered, error in results
+    ]
+    success = sum(1 for _, delivered, _ in results if delivered)
+    failed = len(results) - success
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        query = f"""
+            UPDATE broadcast_deliveries
+            SET status = {placeholder}, error = {placeholder}, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = {placeholder} AND user_id = {placeholder}
+        """
+        if USE_POSTGRES:
+            execute_batch(cursor, query, rows, page_size=500)
+        else:
+            cursor.executemany(query, rows)
+
+        cursor.execute(f"""
+            UPDATE broadcast_jobs
+            SET success = success + {placeholder}, failed = failed + {placeholder}
+            WHERE id = {placeholder}
+        """, (success, failed, job_id))
+
+        # Запоминаем недоступных пользователей, чтобы не тратить на них следующие рассылки
+        inactive = [
+            (error, user_id)
+            for user_id, delivered, error in results
+            if not delivered and error in INACTIVE_DELIVERY_STATUSES
+        ]
+        if inactive:
+            query = f"""
+                UPDATE users
+                SET delivery_status = {placeholder}, last_error_at = CURRENT_TIMESTAMP
+                WHERE user_id = {placeholder}
+            """
+            if USE_POSTGRES:
+                execute_batch(cursor, query, inactive, page_size=500)
+            else:
+                cursor.executemany(query, inactive)
+
+
+def start_broadcast_run(job_id, progress_message_id=None):
+    """
+    Отметить запуск (или возобновление) рассылки и сообщение с прогрессом
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            UPDATE broadcast_jobs
+            SET started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                progress_message_id = {placeholder}
+            WHERE id = {placeholder}
+        """, (progress_message_id, job_id))
+
+
+def save_broadcast_run_stats(job_id, duration, retried):
+    """
+    Добавить к заданию время работы и число повторов очередного запуска
+    (задание могло выполняться в несколько запусков из-за перезапусков бота)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            UPDATE broadcast_jobs
+            SET duration_seconds = duration_seconds + {placeholder},
+                retried = retried + {placeholder}
+            WHERE id = {placeholder}
+        """, (duration, retried, job_id))
+
+
+def get_broadcast_error_breakdown(job_id):
+    """
+    Разбивка неудачных доставок задания по типу ошибки: {error: count}
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            SELECT COALESCE(error, 'unknown'), COUNT(*)
+            FROM broadcast_deliveries
+            WHERE job_id = {placeholder} AND status = 'failed'
+            GROUP BY COALESCE(error, 'unknown')
+        """, (job_id,))
+        results = cursor.fetchall()
+
+    return {error: count for error, count in results}
+
+
+def finish_broadcast_job(job_id, status='finished'):
+    """
+    Отметить задание рассылки завершённым и сохранить итоговую телеметрию:
+    средний темп (сообщений/сек) и разбивку ошибок (JSON)
+    """
+    breakdown = get_broadcast_error_breakdown(job_id)
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            UPDATE broadcast_jobs
+            SET status = {placeholder},
+                finished_at = CURRENT_TIMESTAMP,
+                error_breakdown = {placeholder},
+                messages_per_second = CASE
+                    WHEN duration_seconds > 0 THEN (success + failed) / duration_seconds
+                END
+            WHERE id = {placeholder}
+        """, (status, json.dumps(breakdown, ensure_ascii=False), job_id))
+
+
+def get_broadcast_job(job_id):
+    """
+    Задание рассылки: словарь с полями или None
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            SELECT id, text, admin_chat_id, status, total, success, failed,
+                   retried, duration_seconds, messages_per_second, error_breakdown,
+                   progress_message_id
+            FROM broadcast_jobs
+            WHERE id = {placeholder}
+        """, (job_id,))
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    keys = (
+        'id', 'text', 'admin_chat_id', 'status', 'total', 'success', 'failed',
+        'retried', 'duration_seconds', 'messages_per_second', 'error_breakdown',
+        'progress_message_id'
+    )
+    return dict(zip(keys, row))
+
+
+def get_unfinished_broadcast_jobs():
+    """
+    id заданий рассылки, прерванных остановкой бота (для возобновления при старте)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
 
-    if USE_POSTGRES:
-        # PostgreSQL синтаксис для дат
         cursor.execute("""
-            SELECT COUNT(*) FROM users
-            WHERE first_interaction >= NOW() - INTERVAL '%s days'
-        """, (days,))
+            SELECT id FROM broadcast_jobs
+            WHERE status = 'running'
+            ORDER BY id
+        """)
+        results = cursor.fetchall()
+
+    return [row[0] for row in results]
+
+
+def get_fsm_record(key, min_updated_at=0):
+    """
+    Состояние FSM по ключу: (state, data_json) или None
+    Записи, не обновлявшиеся с min_updated_at (unix time), считаются устаревшими
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            SELECT state, data FROM fsm_storage
+            WHERE key = {placeholder} AND updated_at >= {placeholder}
+        """, (key, min_updated_at))
+        return cursor.fetchone()
+
+
+def save_fsm_record(key, state, data_json):
+    """
+    Сохранить состояние FSM (state и данные целиком)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"""
+            INSERT INTO fsm_storage (key, state, data, updated_at)
+            VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder})
+            ON CONFLICT(key) DO UPDATE SET
+                state = EXCLUDED.state,
+                data = EXCLUDED.data,
+                updated_at = EXCLUDED.updated_at
+        """, (key, state, data_json, time.time()))
+
+
+def delete_fsm_record(key):
+    """
+    Удалить состояние FSM (пустое состояние без данных не храним)
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(f"DELETE FROM fsm_storage WHERE key = {placeholder}", (key,))
+
+
+def delete_stale_fsm_records(min_updated_at):
+    """
+    Удалить состояния FSM, не обновлявшиеся с min_updated_at (unix time)
+    Возвращает число удалённых записей
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        placeholder = '%s' if USE_POSTGRES else '?'
+        cursor.execute(
+            f"DELETE FROM fsm_storage WHERE updated_at < {placeholder}", (min_updated_at,)
+        )
+        return cursor.rowcount
+
+
+# Шаги воронки /funnel: колонка funnel_users -> действия user_actions
+FUNNEL_STEPS = (
+    ('started_at', ('start',)),
+    ('tariffs_at', ('view_tariffs',)),
+    ('contact_at', ('shared_contact',)),
+    ('selected_at', ('select_basic', 'select_assistant')),
+)
+
+# Сводки обновляет один поток процесса (фоновая задача или /funnel)
+_rollup_lock = threading.Lock()
+
+
+def _sql_list(values):
+    return ', '.join(f"'{value}'" for value in values)
+
+
+def _rollup_batch(cursor, last_id, upper_id):
+    """Добавить строки user_actions с id в (last_id, upper_id] в сводки"""
+    placeholder = '%s' if USE_POSTGRES else '?'
+    day = "timestamp::date" if USE_POSTGRES else "date(timestamp)"
+    batch = f"""
+        FROM user_actions
+        WHERE id > {placeholder} AND id <= {placeholder}
+          AND action_type IS NOT NULL AND timestamp IS NOT NULL
+    """
+
+    cursor.execute(f"""
+        INSERT INTO action_daily_rollup (day, action_type, events, users)
+        SELECT {day}, action_type, COUNT(*), 0
+        {batch}
+        GROUP BY {day}, action_type
+        ON CONFLICT (day, action_type) DO UPDATE
+        SET events = action_daily_rollup.events + excluded.events
+    """, (last_id, upper_id))
+
+    # Уникальные пользователи: к users прибавляются только те, кого ещё нет
+    # в action_daily_users за этот день и действие
+    distinct_users = f"SELECT DISTINCT {day} AS day, action_type, user_id {batch} AND user_id IS NOT NULL"
+    add_users = """
+        INSERT INTO action_daily_rollup (day, action_type, events, users)
+        SELECT day, action_type, 0, COUNT(*) FROM new_users
+        WHERE true
+        GROUP BY day, action_type
+        ON CONFLICT (day, action_type) DO UPDATE
+        SET users = action_daily_rollup.users + excluded.users
+    """
+    if USE_POSTGRES:
+        # Вставка и подсчёт одним запросом: параллельные пачки не учтут пользователя дважды
+        cursor.execute(f"""
+            WITH new_users AS (
+                INSERT INTO action_daily_users (day, action_type, user_id)
+                {distinct_users}
+                ON CONFLICT DO NOTHING
+                RETURNING day, action_type
+            )
+            {add_users}
+        """, (last_id, upper_id))
     else:
-        # SQLite синтаксис для дат
+        # SQLite: пишет одна транзакция за раз, поэтому проверка и вставка не разойдутся
+        cursor.execute(f"""
+            WITH new_users AS (
+                SELECT * FROM ({distinct_users}) batch_users
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM action_daily_users u
+                    WHERE u.day = batch_users.day AND u.action_type = batch_users.action_type
+                      AND u.user_id = batch_users.user_id
+                )
+            )
+            {add_users}
+        """, (last_id, upper_id))
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO action_daily_users (day, action_type, user_id)
+            {distinct_users}
+        """, (last_id, upper_id))
+
+    # Первое время каждого шага воронки по пользователю
+    columns = [column for column, _ in FUNNEL_STEPS]
+    firsts = ",\n".join(
+        f"MIN(CASE WHEN action_type IN ({_sql_list(actions)}) THEN timestamp END)"
+        for _, actions in FUNNEL_STEPS
+    )
+    earliest = ",\n".join(
+        f"{column} = CASE WHEN funnel_users.{column} IS NULL "
+        f"OR excluded.{column} < funnel_users.{column} "
+        f"THEN excluded.{column} ELSE funnel_users.{column} END"
+        for column in columns
+    )
+    all_actions = [action for _, actions in FUNNEL_STEPS for action in actions]
+    cursor.execute(f"""
+        INSERT INTO funnel_users (user_id, {', '.join(columns)})
+        SELECT user_id, {firsts}
+        FROM user_actions
+        WHERE id > {placeholder} AND id <= {placeholder}
+          AND user_id IS NOT NULL AND action_type IN ({_sql_list(all_actions)})
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET {earliest}
+    """, (last_id, upper_id))
+
+
+def _rollup_upper_id(cursor, last_id, batch_size, cutoff, gap_timeout):
+    """
+    Граница следующей пачки: id, до которого все строки после last_id уже видны.
+    PostgreSQL выдаёт id из последовательности до коммита, поэтому строка с меньшим
+    id может появиться позже строки с большим. Пачка останавливается на первом
+    пропуске в id; пропуск сразу после отметки, не заполнившийся за gap_timeout
+    секунд (gap_since), считается откатившейся вставкой и перешагивается.
+    Возвращает (upper_id, строк) или (None, 0)
+    """
+    placeholder = '%s' if USE_POSTGRES else '?'
+    # Следующие batch_size строк по первичному ключу
+    cursor.execute(f"""
+        SELECT id, timestamp IS NULL OR timestamp < {placeholder} FROM user_actions
+        WHERE id > {placeholder}
+        ORDER BY id
+        LIMIT {placeholder}
+    """, (cutoff, last_id, batch_size))
+
+    upper_id, rows = last_id, 0
+    for row_id, settled in cursor.fetchall():
+        # Самые свежие действия ждут следующего прохода
+        if not settled:
+            break
+        if USE_POSTGRES and row_id != upper_id + 1:
+            if upper_id != last_id:
+                break
+            # Пропуск сразу после отметки: ждём его не дольше gap_timeout
+            cursor.execute("""
+                UPDATE rollup_state SET gap_since = COALESCE(gap_since, CURRENT_TIMESTAMP)
+                WHERE name = 'user_actions'
+                RETURNING gap_since < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (gap_timeout,))
+            if not cursor.fetchone()[0]:
+                break
+            logger.warning(f"⚠️ Сводки: id {last_id + 1}–{row_id - 1} не появились "
+                           f"за {gap_timeout:.0f} с, пропущены")
+        upper_id = row_id
+        rows += 1
+
+    if upper_id == last_id:
+        return None, 0
+    return upper_id, rows
+
+
+def _rollup_next_batch(batch_size, lag_seconds, gap_timeout=ROLLUP_GAP_TIMEOUT):
+    """
+    Одна пачка сводок в отдельной транзакции
+    Отметка last_id сдвигается сравнением со старым значением: если её уже
+    сдвинул другой процесс, пачка пропускается. Возвращает число строк
+    """
+    placeholder = '%s' if USE_POSTGRES else '?'
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=lag_seconds)
+    if not USE_POSTGRES:
+        cutoff = cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
         cursor.execute("""
-            SELECT COUNT(*) FROM users
-            WHERE first_interaction >= datetime('now', '-{} days')
-        """.format(days))
+            INSERT INTO rollup_state (name, last_id) VALUES ('user_actions', 0)
+            ON CONFLICT (name) DO NOTHING
+        """)
+        cursor.execute("SELECT last_id FROM rollup_state WHERE name = 'user_actions'")
+        last_id = cursor.fetchone()[0]
+
+        if USE_POSTGRES:
+            # Строки до миграции 11 ещё переносятся в секции (database/retention.py):
+            # пока среди них есть не учтённые, пропуск в id не должен их перешагнуть
+            cursor.execute("SELECT to_regclass('user_actions_legacy') IS NOT NULL")
+            if cursor.fetchone()[0]:
+                cursor.execute(
+                    "SELECT EXISTS (SELECT 1 FROM user_actions_legacy WHERE id > %s)", (last_id,)
+                )
+                if cursor.fetchone()[0]:
+                    return 0
+
+        upper_id, rows = _rollup_upper_id(cursor, last_id, batch_size, cutoff, gap_timeout)
+        if upper_id is None:
+            return 0
+
+        cursor.execute(f"""
+            UPDATE rollup_state
+            SET last_id = {placeholder}, updated_at = CURRENT_TIMESTAMP, gap_since = NULL
+            WHERE name = 'user_actions' AND last_id = {placeholder}
+        """, (upper_id, last_id))
+        if cursor.rowcount != 1:
+            return 0
+
+        _rollup_batch(cursor, last_id, upper_id)
+        return rows
+
+
+def refresh_action_rollups(batch_size=ROLLUP_BATCH_SIZE, max_batches=ROLLUP_MAX_BATCHES,
+                           lag_seconds=ROLLUP_LAG, wait=True):
+    """
+    Досчитать сводки /funnel по новым строкам user_actions (id больше отметки)
+    Обрабатывает не больше max_batches пачек, чтобы один вызов не занимал
+    подключение надолго; остаток — в следующий раз.
+    Возвращает (строк, пачек) или None, если сводки уже обновляются (wait=False)
+    """
+    if not _rollup_lock.acquire(blocking=wait):
+        return None
+    try:
+        rows = batches = 0
+        for _ in range(max_batches):
+            processed = _rollup_next_batch(batch_size, lag_seconds)
+            if not processed:
+                break
+            rows += processed
+            batches += 1
+        return rows, batches
+    finally:
+        _rollup_lock.release()
+
+
+def get_rollup_state():
+    """(last_id, время последнего обновления сводок) или (0, None)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT last_id, updated_at FROM rollup_state WHERE name = 'user_actions'")
+        row = cursor.fetchone()
+    return tuple(row) if row else (0, None)
+
+
+def _day_bounds(date_from, date_to):
+    """Границы [date_from, date_to + 1 день) в формате БД"""
+    date_end = date_to + timedelta(days=1)
+    if USE_POSTGRES:
+        return date_from, date_end
+    return date_from.isoformat(), date_end.isoformat()
 
-    result = cursor.fetchone()
-    conn.close()
 
-    return result[0] if result else 0
+def get_funnel(date_from, date_to):
+    """
+    Воронка пользователей, впервые нажавших /start в [date_from, date_to]:
+    сколько из них дошли до каждого шага FUNNEL_STEPS (за всё время)
+    """
+    placeholder = '%s' if USE_POSTGRES else '?'
+    counts = ', '.join(f"COUNT({column})" for column, _ in FUNNEL_STEPS[1:])
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT COUNT(*), {counts} FROM funnel_users
+            WHERE started_at >= {placeholder} AND started_at < {placeholder}
+        """, _day_bounds(date_from, date_to))
+        row = cursor.fetchone()
+    return {column: value or 0 for (column, _), value in zip(FUNNEL_STEPS, row)}
+
+
+def get_action_rollup(date_from, date_to):
+    """
+    Действия за дни [date_from, date_to] из дневной сводки:
+    {action_type: (событий, сумма уникальных пользователей по дням)}
+    """
+    placeholder = '%s' if USE_POSTGRES else '?'
+    day_from, day_end = _day_bounds(date_from, date_to)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT action_type, SUM(events), SUM(users) FROM action_daily_rollup
+            WHERE day >= {placeholder} AND day < {placeholder}
+            GROUP BY action_type
+        """, (day_from, day_end))
+        return {action_type: (events, users) for action_type, events, users in cursor.fetchall()}
+
+
+def _instrument_module():
+    """
+    Время выполнения и ошибки каждой публичной функции модуля — в метрики
+    (bot_db_query_duration_seconds). Генераторы не оборачиваются: их время
+    растянуто на весь перебор
+    """
+    skip = {'create_connection', 'get_connection', 'init_pool', 'close_pool', 'init_db',
+            'event_timestamp', 'get_users_cursor'}
+    module = globals()
+    for name, func in list(module.items()):
+        if (inspect.isfunction(func) and func.__module__ == __name__
+                and not name.startswith('_') and name not in skip
+                and not inspect.isgeneratorfunction(func)):
+            module[name] = instrument_db_function(func)
+
+
+_instrument_module()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Отложенная (write-behind) запись статистики действий
+log_action / log_tariff_selection не ждут БД: событие кладётся в очередь
+в памяти, а фоновая задача пишет события пачками
+"""
+import asyncio
+import logging
+
+from config import EVENT_BATCH_SIZE, EVENT_FLUSH_INTERVAL, EVENT_QUEUE_SIZE, EVENT_MAX_RETRIES
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Типы событий в очереди
+ACTION = "action"
+TARIFF_SELECTION = "tariff_selection"
+
+
+class EventWriter:
+    """
+    Буфер событий с периодическим сбросом в БД
+
+    - сброс раз в flush_interval секунд или при накоплении batch_size событий
+    - очередь ограничена max_queue: при переполнении put() ждёт (backpressure)
+    - при остановке оставшиеся события записываются (flush-on-shutdown)
+    """
+
+    def __init__(self, batch_size=EVENT_BATCH_SIZE, flush_interval=EVENT_FLUSH_INTERVAL,
+                 max_queue=EVENT_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        # Собираемая пачка (хранится в объекте, чтобы не потерять её при остановке)
+        self._batch = []
+        # Пачка, которую не удалось записать (повторим при следующем сбросе)
+        self._retry = []
+        self._retry_attempts = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запустить фоновую задачу записи"""
+        if not self.running:
+            self._task = asyncio.create_task(self._run(), name="event-writer")
+
+    async def put(self, kind, row):
+        """
+        Добавить событие в очередь
+        Ждёт только при переполнении очереди, но не записи в БД
+        """
+        await self._queue.put((kind, row))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+
+            # Добираем пачку до batch_size или до истечения интервала
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch, self._batch = self._batch, []
+            await self._flush(batch)
+
+    def _drain(self):
+        """Забрать всё, что уже лежит в очереди"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return batch
+
+    async def _flush(self, batch):
+        from database.aio import run_db
+
+        batch = self._retry + batch
+        self._retry = []
+
+        actions = [row for kind, row in batch if kind == ACTION]
+        tariff_selections = [row for kind, row in batch if kind == TARIFF_SELECTION]
+
+        try:
+            await run_db(db.log_events_batch, actions, tariff_selections)
+            self._retry_attempts = 0
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Пачка событий ({len(batch)} шт.) не записана ({e}), пишем по одному")
+
+        # Одна «плохая» строка (например, нарушение внешнего ключа) не должна
+        # блокировать остальные: пишем по одному и отбрасываем то, что БД не принимает
+        rejected, actions, tariff_selections = await run_db(
+            db.log_events_each, actions, tariff_selections
+        )
+        if rejected:
+            errors = {type(error).__name__ for _, error in rejected}
+            logger.error(f"❌ Отброшено событий, которые БД не принимает: {len(rejected)} "
+                         f"({', '.join(sorted(errors))})")
+
+        unwritten = [(ACTION, row) for row in actions]
+        unwritten += [(TARIFF_SELECTION, row) for row in tariff_selections]
+        if not unwritten:
+            self._retry_attempts = 0
+            return
+
+        # Остальное не записалось из-за БД (а не данных) — повторим позже, но не бесконечно
+        self._retry_attempts += 1
+        if self._retry_attempts > EVENT_MAX_RETRIES:
+            logger.error(f"❌ Отброшено событий после {EVENT_MAX_RETRIES} повторов: {len(unwritten)}")
+            self._retry_attempts = 0
+            return
+        # Сохраняем для повторной попытки, но не больше размера очереди
+        self._retry = unwritten[-self.max_queue:]
+
+    async def stop(self):
+        """Остановить фоновую задачу и записать оставшиеся события"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        batch, self._batch = self._batch + self._drain(), []
+        if batch or self._retry:
+            await self._flush(batch)
+            if self._retry:
+                logger.error(f"❌ При остановке потеряно событий: {len(self._retry)}")
+
+
+# Общий экземпляр (запускается в bot.py)
+_writer = None
+
+
+def get_event_writer():
+    """Запущенный EventWriter или None (тогда события пишутся сразу)"""
+    if _writer is not None and _writer.running:
+        return _writer
+    return None
+
+
+def start_event_writer():
+    """Создать и запустить общий EventWriter"""
+    global _writer
+    if _writer is None:
+        _writer = EventWriter()
+    _writer.start()
+    logger.info(
+        f"✅ Буфер статистики запущен (batch={_writer.batch_size}, "
+        f"interval={_writer.flush_interval}s, queue={_writer.max_queue})"
+    )
+    return _writer
+
+
+async def stop_event_writer():
+    """Остановить общий EventWriter с записью оставшихся событий"""
+    global _writer
+    if _writer is not None:
+        await _writer.stop()
+        _writer = None
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище состояний FSM aiogram в БД бота (таблица fsm_storage)
+Состояния переживают перезапуск и видны всем процессам бота.
+Запись сквозная (write-through): БД обновляется сразу. Кэш в памяти
+(FSM_CACHE_TTL > 0) избавляет от запроса к БД на каждое сообщение, но
+знает только о записях своего процесса, поэтому по умолчанию выключен
+"""
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from config import FSM_STATE_TTL, FSM_CACHE_SIZE, FSM_CACHE_TTL
+from database import db
+from database.aio import run_db
+from database.cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# Пустая запись: нет состояния и данных
+_EMPTY = (None, {})
+
+
+class SQLStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite/PostgreSQL через database.db
+    Записи старше state_ttl секунд считаются устаревшими (как будто состояния нет)
+    cache_ttl <= 0 — без кэша: каждое чтение идёт в БД (состояние общее для процессов)
+    """
+
+    def __init__(self, state_ttl=FSM_STATE_TTL, cache_size=FSM_CACHE_SIZE,
+                 cache_ttl=FSM_CACHE_TTL, key_builder=None):
+        self.state_ttl = state_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = TTLCache(maxsize=cache_size if cache_ttl > 0 else 0, ttl=cache_ttl)
+
+    def _min_updated_at(self):
+        return time.time() - self.state_ttl if self.state_ttl > 0 else 0
+
+    async def _get_record(self, key):
+        """(state, data) из кэша или БД"""
+        record = self._cache.get(key)
+        if record is not MISSING:
+            return record
+
+        row = await run_db(db.get_fsm_record, key, self._min_updated_at())
+        record = (row[0], json.loads(row[1])) if row else _EMPTY
+        self._cache.set(key, record)
+        return record
+
+    async def _save_record(self, key, state, data):
+        """Записать в БД и в кэш; пустое состояние удаляется"""
+        if state is None and not data:
+            await run_db(db.delete_fsm_record, key)
+            self._cache.set(key, _EMPTY)
+            return
+
+        await run_db(db.save_fsm_record, key, state, json.dumps(data, ensure_ascii=False))
+        self._cache.set(key, (state, data))
+
+    async def set_state(self, key, state=None):
+        storage_key = self.key_builder.build(key)
+        _, data = await self._get_record(storage_key)
+        await self._save_record(
+            storage_key, state.state if isinstance(state, State) else state, data
+        )
+
+    async def get_state(self, key):
+        state, _ = await self._get_record(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise ValueError(f"Данные FSM должны быть словарём, получено {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._get_record(storage_key)
+        await self._save_record(storage_key, state, data.copy())
+
+    async def get_data(self, key):
+        _, data = await self._get_record(self.key_builder.build(key))
+        return data.copy()
+
+    async def cleanup(self):
+        """Удалить устаревшие состояния из БД (вызывается при старте бота)"""
+        if self.state_ttl <= 0:
+            return 0
+        deleted = await run_db(db.delete_stale_fsm_records, self._min_updated_at())
+        if deleted:
+            logger.info(f"🧹 FSM: удалено устаревших состояний: {deleted}")
+        return deleted
+
+    async def close(self):
+        self._cache.clear()
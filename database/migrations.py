@@ -0,0 +1,677 @@
+# -*- coding: utf-8 -*-
+"""
+Версионные миграции схемы БД (SQLite и PostgreSQL)
+Применённые версии хранятся в таблице schema_version.
+Новая миграция добавляется в конец списка MIGRATIONS со следующим номером;
+уже выпущенные миграции не редактируются
+"""
+import logging
+
+from config import USE_POSTGRES
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки PostgreSQL: не даёт двум процессам бота
+# применять миграции одновременно
+MIGRATIONS_LOCK_KEY = 727001
+
+
+class Migration:
+    """
+    Одна миграция схемы
+    sqlite / postgres — списки SQL-выражений для каждой СУБД
+    transactional=False — выражения PostgreSQL выполняются вне транзакции
+    (нужно для CREATE INDEX CONCURRENTLY на больших таблицах)
+    """
+
+    def __init__(self, version, description, sqlite, postgres, transactional=True):
+        self.version = version
+        self.description = description
+        self.sqlite = sqlite
+        self.postgres = postgres
+        self.transactional = transactional
+
+    @property
+    def statements(self):
+        return self.postgres if USE_POSTGRES else self.sqlite
+
+
+MIGRATIONS = [
+    Migration(
+        1, "Базовые таблицы: users, user_actions, tariff_selections",
+        sqlite=[
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                phone_number TEXT,
+                first_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS user_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                action_type TEXT,
+                action_data TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS tariff_selections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                tariff_type TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            ''',
+        ],
+        postgres=[
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                phone_number TEXT,
+                first_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS user_actions (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT,
+                action_type TEXT,
+                action_data TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS tariff_selections (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT,
+                tariff_type TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+            ''',
+        ],
+    ),
+    Migration(
+        2, "Индексы для админ-запросов (/stats, /users, /export)",
+        sqlite=[
+            "CREATE INDEX IF NOT EXISTS idx_tariff_selections_user_ts ON tariff_selections (user_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_user_actions_user_ts ON user_actions (user_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_user_actions_type_ts ON user_actions (action_type, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_users_first_interaction ON users (first_interaction)",
+            '''
+            CREATE INDEX IF NOT EXISTS idx_users_with_phone
+            ON users (first_interaction) WHERE phone_number IS NOT NULL
+            ''',
+        ],
+        # CONCURRENTLY — чтобы построение индексов на больших таблицах
+        # не блокировало запись пользователей
+        postgres=[
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tariff_selections_user_ts ON tariff_selections (user_id, timestamp)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_actions_user_ts ON user_actions (user_id, timestamp)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_actions_type_ts ON user_actions (action_type, timestamp)",
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_first_interaction ON users (first_interaction)",
+            '''
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_with_phone
+            ON users (first_interaction) WHERE phone_number IS NOT NULL
+            ''',
+        ],
+        transactional=False,
+    ),
+    Migration(
+        3, "Счётчики статистики (stats_counters, stats_daily_users) с триггерами",
+        sqlite=[
+            '''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS stats_daily_users (
+                day DATE PRIMARY KEY,
+                new_users INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats
+            AFTER INSERT ON users
+            BEGIN
+                INSERT INTO stats_counters (name, value) VALUES ('users', 1)
+                ON CONFLICT(name) DO UPDATE SET value = stats_counters.value + 1;
+                INSERT INTO stats_counters (name, value)
+                SELECT 'contacts', 1 WHERE NEW.phone_number IS NOT NULL
+                ON CONFLICT(name) DO UPDATE SET value = stats_counters.value + 1;
+                INSERT INTO stats_daily_users (day, new_users)
+                VALUES (date(COALESCE(NEW.first_interaction, CURRENT_TIMESTAMP)), 1)
+                ON CONFLICT(day) DO UPDATE SET new_users = stats_daily_users.new_users + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_users_phone_stats
+            AFTER UPDATE OF phone_number ON users
+            WHEN (OLD.phone_number IS NULL) <> (NEW.phone_number IS NULL)
+            BEGIN
+                INSERT INTO stats_counters (name, value)
+                VALUES ('contacts', CASE WHEN NEW.phone_number IS NULL THEN -1 ELSE 1 END)
+                ON CONFLICT(name) DO UPDATE SET value = stats_counters.value
+                    + CASE WHEN NEW.phone_number IS NULL THEN -1 ELSE 1 END;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_tariff_selections_stats
+            AFTER INSERT ON tariff_selections
+            BEGIN
+                INSERT INTO stats_counters (name, value) VALUES ('tariff:' || NEW.tariff_type, 1)
+                ON CONFLICT(name) DO UPDATE SET value = stats_counters.value + 1;
+            END
+            ''',
+            # Заполняем счётчики по уже накопленным данным
+            "DELETE FROM stats_counters",
+            "DELETE FROM stats_daily_users",
+            "INSERT INTO stats_counters (name, value) SELECT 'users', COUNT(*) FROM users",
+            '''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'contacts', COUNT(*) FROM users WHERE phone_number IS NOT NULL
+            ''',
+            '''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'tariff:' || tariff_type, COUNT(*) FROM tariff_selections
+            WHERE tariff_type IS NOT NULL GROUP BY tariff_type
+            ''',
+            '''
+            INSERT INTO stats_daily_users (day, new_users)
+            SELECT date(first_interaction), COUNT(*) FROM users
+            WHERE first_interaction IS NOT NULL GROUP BY date(first_interaction)
+            ''',
+        ],
+        postgres=[
+            '''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY,
+                value BIGINT NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS stats_daily_users (
+                day DATE PRIMARY KEY,
+                new_users BIGINT NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION stats_users_insert() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO stats_counters (name, value) VALUES ('users', 1)
+                ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + 1;
+                IF NEW.phone_number IS NOT NULL THEN
+                    INSERT INTO stats_counters (name, value) VALUES ('contacts', 1)
+                    ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + 1;
+                END IF;
+                INSERT INTO stats_daily_users (day, new_users)
+                VALUES (COALESCE(NEW.first_interaction, CURRENT_TIMESTAMP)::date, 1)
+                ON CONFLICT (day) DO UPDATE SET new_users = stats_daily_users.new_users + 1;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION stats_users_phone() RETURNS trigger AS $$
+            DECLARE
+                delta INTEGER := CASE WHEN NEW.phone_number IS NULL THEN -1 ELSE 1 END;
+            BEGIN
+                IF (OLD.phone_number IS NULL) <> (NEW.phone_number IS NULL) THEN
+                    INSERT INTO stats_counters (name, value) VALUES ('contacts', delta)
+                    ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + delta;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION stats_tariff_selection() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO stats_counters (name, value) VALUES ('tariff:' || NEW.tariff_type, 1)
+                ON CONFLICT (name) DO UPDATE SET value = stats_counters.value + 1;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            ''',
+            "DROP TRIGGER IF EXISTS trg_users_insert_stats ON users",
+            '''
+            CREATE TRIGGER trg_users_insert_stats AFTER INSERT ON users
+            FOR EACH ROW EXECUTE PROCEDURE stats_users_insert()
+            ''',
+            "DROP TRIGGER IF EXISTS trg_users_phone_stats ON users",
+            '''
+            CREATE TRIGGER trg_users_phone_stats AFTER UPDATE OF phone_number ON users
+            FOR EACH ROW EXECUTE PROCEDURE stats_users_phone()
+            ''',
+            "DROP TRIGGER IF EXISTS trg_tariff_selections_stats ON tariff_selections",
+            '''
+            CREATE TRIGGER trg_tariff_selections_stats AFTER INSERT ON tariff_selections
+            FOR EACH ROW EXECUTE PROCEDURE stats_tariff_selection()
+            ''',
+            # Заполняем счётчики по уже накопленным данным в той же транзакции,
+            # что и триггеры; SHARE-блокировка не даёт записям проскочить между ними
+            "LOCK TABLE users, tariff_selections IN SHARE MODE",
+            "DELETE FROM stats_counters",
+            "DELETE FROM stats_daily_users",
+            "INSERT INTO stats_counters (name, value) SELECT 'users', COUNT(*) FROM users",
+            '''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'contacts', COUNT(*) FROM users WHERE phone_number IS NOT NULL
+            ''',
+            '''
+            INSERT INTO stats_counters (name, value)
+            SELECT 'tariff:' || tariff_type, COUNT(*) FROM tariff_selections
+            WHERE tariff_type IS NOT NULL GROUP BY tariff_type
+            ''',
+            '''
+            INSERT INTO stats_daily_users (day, new_users)
+            SELECT first_interaction::date, COUNT(*) FROM users
+            WHERE first_interaction IS NOT NULL GROUP BY first_interaction::date
+            ''',
+        ],
+    ),
+    Migration(
+        4, "Денормализованный последний тариф users.last_tariff",
+        sqlite=[
+            "ALTER TABLE users ADD COLUMN last_tariff TEXT",
+            '''
+            UPDATE users
+            SET last_tariff = (
+                SELECT tariff_type FROM tariff_selections t
+                WHERE t.user_id = users.user_id
+                ORDER BY t.timestamp DESC, t.id DESC LIMIT 1
+            )
+            WHERE user_id IN (SELECT user_id FROM tariff_selections)
+            ''',
+        ],
+        postgres=[
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_tariff TEXT",
+            '''
+            UPDATE users u
+            SET last_tariff = t.tariff_type
+            FROM (
+                SELECT DISTINCT ON (user_id) user_id, tariff_type
+                FROM tariff_selections
+                ORDER BY user_id, timestamp DESC, id DESC
+            ) t
+            WHERE u.user_id = t.user_id
+            ''',
+        ],
+    ),
+    Migration(
+        5, "Индекс для постраничной выборки пользователей с контактами (keyset)",
+        sqlite=[
+            '''
+            CREATE INDEX IF NOT EXISTS idx_users_with_phone_keyset
+            ON users (first_interaction, user_id) WHERE phone_number IS NOT NULL
+            ''',
+            "DROP INDEX IF EXISTS idx_users_with_phone",
+        ],
+        postgres=[
+            '''
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_with_phone_keyset
+            ON users (first_interaction, user_id) WHERE phone_number IS NOT NULL
+            ''',
+            "DROP INDEX CONCURRENTLY IF EXISTS idx_users_with_phone",
+        ],
+        transactional=False,
+    ),
+    Migration(
+        6, "Рассылки: задания broadcast_jobs и доставки broadcast_deliveries",
+        sqlite=[
+            '''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                admin_chat_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'running',
+                total INTEGER NOT NULL DEFAULT 0,
+                success INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                job_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (job_id, user_id),
+                FOREIGN KEY (job_id) REFERENCES broadcast_jobs(id)
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_pending
+            ON broadcast_deliveries (job_id, user_id) WHERE status = 'pending'
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)",
+        ],
+        postgres=[
+            '''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id SERIAL PRIMARY KEY,
+                text TEXT NOT NULL,
+                admin_chat_id BIGINT,
+                status TEXT NOT NULL DEFAULT 'running',
+                total INTEGER NOT NULL DEFAULT 0,
+                success INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                job_id INTEGER NOT NULL REFERENCES broadcast_jobs(id),
+                user_id BIGINT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (job_id, user_id)
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_pending
+            ON broadcast_deliveries (job_id, user_id) WHERE status = 'pending'
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)",
+        ],
+    ),
+    Migration(
+        7, "Статус доставки пользователям (заблокировал бота, удалён, чат не найден)",
+        sqlite=[
+            "ALTER TABLE users ADD COLUMN delivery_status TEXT",
+            "ALTER TABLE users ADD COLUMN last_error_at TIMESTAMP",
+        ],
+        postgres=[
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS delivery_status TEXT",
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_error_at TIMESTAMP",
+        ],
+    ),
+    Migration(
+        8, "Телеметрия рассылок: время, темп, повторы, разбивка ошибок",
+        sqlite=[
+            "ALTER TABLE broadcast_jobs ADD COLUMN started_at TIMESTAMP",
+            "ALTER TABLE broadcast_jobs ADD COLUMN duration_seconds REAL NOT NULL DEFAULT 0",
+            "ALTER TABLE broadcast_jobs ADD COLUMN retried INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE broadcast_jobs ADD COLUMN messages_per_second REAL",
+            "ALTER TABLE broadcast_jobs ADD COLUMN error_breakdown TEXT",
+            "ALTER TABLE broadcast_jobs ADD COLUMN progress_message_id INTEGER",
+        ],
+        postgres=[
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS started_at TIMESTAMP",
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS duration_seconds DOUBLE PRECISION NOT NULL DEFAULT 0",
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS retried INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS messages_per_second DOUBLE PRECISION",
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS error_breakdown TEXT",
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS progress_message_id BIGINT",
+        ],
+    ),
+    Migration(
+        9, "Хранилище состояний FSM (fsm_storage)",
+        sqlite=[
+            '''
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at)",
+        ],
+        postgres=[
+            '''
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at DOUBLE PRECISION NOT NULL
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at)",
+        ],
+    ),
+    Migration(
+        10, "Сводки действий по дням (action_daily_rollup) и воронка по пользователям (funnel_users)",
+        sqlite=[
+            '''
+            CREATE TABLE IF NOT EXISTS action_daily_rollup (
+                day DATE NOT NULL,
+                action_type TEXT NOT NULL,
+                events INTEGER NOT NULL DEFAULT 0,
+                users INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, action_type)
+            )
+            ''',
+            # Кто уже учтён в action_daily_rollup.users: сводка досчитывает только
+            # новых пользователей из новых строк, без пересчёта COUNT(DISTINCT) за день
+            '''
+            CREATE TABLE IF NOT EXISTS action_daily_users (
+                day DATE NOT NULL,
+                action_type TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (day, action_type, user_id)
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS funnel_users (
+                user_id INTEGER PRIMARY KEY,
+                started_at TIMESTAMP,
+                tariffs_at TIMESTAMP,
+                contact_at TIMESTAMP,
+                selected_at TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_funnel_users_started_at ON funnel_users (started_at)",
+            '''
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP,
+                gap_since TIMESTAMP
+            )
+            ''',
+        ],
+        postgres=[
+            '''
+            CREATE TABLE IF NOT EXISTS action_daily_rollup (
+                day DATE NOT NULL,
+                action_type TEXT NOT NULL,
+                events BIGINT NOT NULL DEFAULT 0,
+                users INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, action_type)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS action_daily_users (
+                day DATE NOT NULL,
+                action_type TEXT NOT NULL,
+                user_id BIGINT NOT NULL,
+                PRIMARY KEY (day, action_type, user_id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS funnel_users (
+                user_id BIGINT PRIMARY KEY,
+                started_at TIMESTAMP,
+                tariffs_at TIMESTAMP,
+                contact_at TIMESTAMP,
+                selected_at TIMESTAMP
+            )
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_funnel_users_started_at ON funnel_users (started_at)",
+            '''
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name TEXT PRIMARY KEY,
+                last_id BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP,
+                gap_since TIMESTAMP
+            )
+            ''',
+        ],
+    ),
+    Migration(
+        11, "user_actions: помесячные секции (PostgreSQL), индекс по времени (SQLite)",
+        # В SQLite секционирования нет: устаревшие месяцы удаляются пачками
+        # по индексу timestamp (database/retention.py)
+        sqlite=[
+            "CREATE INDEX IF NOT EXISTS idx_user_actions_ts ON user_actions (timestamp)",
+        ],
+        # Таблица пересоздаётся секционированной по месяцам (PARTITION BY RANGE):
+        # устаревший месяц удаляется DROP секции, а не DELETE. Последовательность id
+        # сохраняется (и расширяется до BIGINT) — на ней держится отметка сводок
+        # /funnel (rollup_state). Миграция только подменяет таблицу: старые строки
+        # остаются в user_actions_legacy и переносятся в секции пачками в фоне
+        # (database/retention.py, move_legacy_actions), не задерживая запуск
+        postgres=[
+            "ALTER TABLE user_actions RENAME TO user_actions_legacy",
+            "ALTER TABLE user_actions_legacy RENAME CONSTRAINT user_actions_pkey TO user_actions_legacy_pkey",
+            "DROP INDEX IF EXISTS idx_user_actions_user_ts",
+            "DROP INDEX IF EXISTS idx_user_actions_type_ts",
+            "ALTER SEQUENCE user_actions_id_seq OWNED BY NONE",
+            "ALTER SEQUENCE user_actions_id_seq AS BIGINT",
+            '''
+            CREATE TABLE user_actions_new (
+                id BIGINT NOT NULL DEFAULT nextval('user_actions_id_seq'),
+                user_id BIGINT REFERENCES users(user_id),
+                action_type TEXT,
+                action_data TEXT,
+                timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+            ''',
+            # Секции на текущий и два следующих месяца; секции прошлых месяцев
+            # создаются при переносе старых строк
+            '''
+            DO $$
+            DECLARE
+                month_start DATE := date_trunc('month', CURRENT_DATE)::date;
+                last_month DATE := (date_trunc('month', CURRENT_DATE) + INTERVAL '2 months')::date;
+            BEGIN
+                WHILE month_start <= last_month LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF user_actions_new FOR VALUES FROM (%L) TO (%L)',
+                        'user_actions_' || to_char(month_start, 'YYYY_MM'),
+                        month_start, (month_start + INTERVAL '1 month')::date
+                    );
+                    month_start := (month_start + INTERVAL '1 month')::date;
+                END LOOP;
+            END $$
+            ''',
+            # Строки вне созданных месяцев (бот долго не запускался) — до разбиения по месяцам
+            "CREATE TABLE user_actions_default PARTITION OF user_actions_new DEFAULT",
+            "ALTER TABLE user_actions_new RENAME TO user_actions",
+            "ALTER TABLE user_actions RENAME CONSTRAINT user_actions_new_pkey TO user_actions_pkey",
+            "ALTER SEQUENCE user_actions_id_seq OWNED BY user_actions.id",
+            "CREATE INDEX IF NOT EXISTS idx_user_actions_user_ts ON user_actions (user_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_user_actions_type_ts ON user_actions (action_type, timestamp)",
+        ],
+    ),
+]
+
+
+def _ensure_version_table(cursor):
+    """Таблица применённых миграций"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def get_schema_version(conn):
+    """Текущая версия схемы (0 — миграции ещё не применялись)"""
+    cursor = conn.cursor()
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+def _apply(conn, migration):
+    """Применить одну миграцию и записать её версию (одной транзакцией)"""
+    placeholder = '%s' if USE_POSTGRES else '?'
+
+    if USE_POSTGRES and not migration.transactional:
+        conn.commit()
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            for statement in migration.statements:
+                cursor.execute(statement)
+        finally:
+            conn.autocommit = False
+    else:
+        if not USE_POSTGRES:
+            # sqlite3 сам открывает транзакцию только перед INSERT/UPDATE/DELETE,
+            # а DDL (ALTER TABLE ADD COLUMN) иначе фиксируется сразу: при сбое
+            # посреди миграции следующий запуск упал бы на «duplicate column»
+            conn.commit()
+            conn.cursor().execute("BEGIN")
+        cursor = conn.cursor()
+        for statement in migration.statements:
+            cursor.execute(statement)
+
+    cursor = conn.cursor()
+    cursor.execute(
+        f"INSERT INTO schema_version (version, description) VALUES ({placeholder}, {placeholder})",
+        (migration.version, migration.description)
+    )
+    conn.commit()
+
+
+def apply_migrations(conn, migrations=MIGRATIONS):
+    """
+    Применить все ещё не применённые миграции по порядку
+    Возвращает список применённых версий
+    """
+    cursor = conn.cursor()
+    _ensure_version_table(cursor)
+    conn.commit()
+
+    if USE_POSTGRES:
+        # Сессионная блокировка: держится и между транзакциями миграций
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+
+    applied = []
+    try:
+        current = get_schema_version(conn)
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version <= current:
+                continue
+            logger.info(f"🔧 Миграция {migration.version}: {migration.description}")
+            try:
+                _apply(conn, migration)
+            except Exception:
+                conn.rollback()
+                logger.exception(f"❌ Миграция {migration.version} не применена")
+                raise
+            applied.append(migration.version)
+    finally:
+        if USE_POSTGRES:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+            conn.commit()
+
+    return applied
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Пул подключений к БД (SQLite или PostgreSQL)
+Подключения создаются один раз и переиспользуются между вызовами,
+вместо нового TCP/auth-рукопожатия на каждое нажатие кнопки
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить подключение из пула за отведённое время"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул подключений
+
+    - держит от min_size до max_size подключений
+    - проверяет подключение перед выдачей, если оно простаивало дольше
+      healthcheck_interval секунд
+    - при ошибке внутри блока подключение закрывается и пересоздаётся
+      (recycle), а не возвращается в пул
+    """
+
+    def __init__(self, factory, min_size=1, max_size=10, timeout=30.0,
+                 healthcheck_interval=30.0, healthcheck_query="SELECT 1"):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Некорректный размер пула: min={min_size}, max={max_size}")
+
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self.healthcheck_query = healthcheck_query
+
+        # Свободные подключения: (conn, время возврата в пул)
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(min_size):
+            self._idle.append((self._factory(), time.monotonic()))
+            self._size += 1
+
+    @property
+    def size(self):
+        """Сколько подключений открыто сейчас (свободных и выданных)"""
+        return self._size
+
+    @property
+    def idle(self):
+        """Сколько подключений свободно"""
+        return len(self._idle)
+
+    def _is_alive(self, conn):
+        """Проверка подключения лёгким запросом"""
+        if getattr(conn, "closed", 0):
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.healthcheck_query)
+            cursor.fetchall()
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        """Закрыть подключение и освободить место в пуле"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def acquire(self):
+        """
+        Взять подключение из пула
+        Если свободных нет и лимит не достигнут — создаётся новое,
+        иначе ждём освобождения (не дольше timeout)
+        """
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Пул подключений закрыт")
+
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"Нет свободных подключений (max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                    if self._closed:
+                        raise RuntimeError("Пул подключений закрыт")
+
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                else:
+                    conn, released_at = None, None
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return self._factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            # Проверяем только «долго спавшие» подключения, чтобы не платить
+            # лишний round-trip на каждом запросе
+            idle_for = time.monotonic() - released_at
+            if idle_for < self.healthcheck_interval or self._is_alive(conn):
+                return conn
+
+            logger.warning("♻️ Подключение к БД не прошло проверку, пересоздаём")
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        """
+        Вернуть подключение в пул
+        broken=True — подключение закрывается (recycle)
+        """
+        if broken or self._closed or getattr(conn, "closed", 0):
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Подключение на время блока with:
+        commit при успехе, rollback при ошибке
+        Если после ошибки откатить транзакцию не удалось — подключение пересоздаётся
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            # BaseException — чтобы вернуть подключение и при GeneratorExit
+            # (например, недочитанный генератор iter_users_with_contacts)
+            try:
+                conn.rollback()
+                broken = not self._is_alive(conn)
+            except Exception:
+                broken = True
+            self.release(conn, broken=broken)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Закрыть все свободные подключения; выданные закроются при возврате"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
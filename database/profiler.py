@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Профилировщик запросов к БД и журнал медленных запросов
+Каждый выполненный запрос учитывается по нормализованному тексту
+(литералы и плейсхолдеры заменены на ?): число вызовов, суммарное и
+максимальное время, число строк. Запросы дольше DB_SLOW_QUERY_MS пишутся
+в лог вместе с планом выполнения (EXPLAIN в PostgreSQL,
+EXPLAIN QUERY PLAN в SQLite)
+
+Подключается через фабрики курсоров в database/db.py:create_connection()
+"""
+import functools
+import logging
+import re
+import threading
+import time
+
+from config import DB_SLOW_QUERY_MS, DB_EXPLAIN_SLOW
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s|\?|%\([^)]*\)s")
+_SPACES_RE = re.compile(r"\s+")
+# IN (?, ?, ...) разной длины — один и тот же запрос
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+
+# Для каких запросов можно получить план
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+class QueryStats:
+    """Накопленная статистика одного нормализованного запроса"""
+
+    __slots__ = ('sql', 'calls', 'total_time', 'max_time', 'rows', 'slow')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.slow = 0
+
+    @property
+    def avg_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+class QueryProfiler:
+    """
+    Статистика запросов (потокобезопасно: запросы идут из пула потоков БД)
+    slow_query_ms — порог журнала медленных запросов (0 — не писать)
+    explain_slow — снимать план выполнения для медленных запросов
+    """
+
+    def __init__(self, slow_query_ms=DB_SLOW_QUERY_MS, explain_slow=DB_EXPLAIN_SLOW,
+                 max_queries=1000):
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.max_queries = max_queries
+        self._stats = {}
+        # Кэш нормализации: SQL в коде почти всегда один и тот же текст
+        self._normalized = {}
+        self._lock = threading.Lock()
+
+    def normalize(self, sql):
+        """Текст запроса без литералов, плейсхолдеров и лишних пробелов"""
+        normalized = self._normalized.get(sql)
+        if normalized is None:
+            normalized = _SPACES_RE.sub(' ', sql).strip()
+            normalized = _STRING_RE.sub('?', normalized)
+            normalized = _NUMBER_RE.sub('?', normalized)
+            normalized = _PLACEHOLDER_RE.sub('?', normalized)
+            normalized = _IN_LIST_RE.sub('IN (...)', normalized)
+            if len(self._normalized) < self.max_queries * 4:
+                self._normalized[sql] = normalized
+        return normalized
+
+    def record(self, sql, duration, rows=-1):
+        """Учесть выполненный запрос; возвращает True, если он медленный"""
+        normalized = self.normalize(sql)
+        slow = bool(self.slow_query_ms) and duration * 1000 >= self.slow_query_ms
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                if len(self._stats) >= self.max_queries:
+                    return slow
+                stats = self._stats[normalized] = QueryStats(normalized)
+            stats.calls += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            if rows > 0:
+                stats.rows += rows
+            if slow:
+                stats.slow += 1
+        return slow
+
+    def add_rows(self, sql, rows):
+        """Добавить строки, прочитанные fetch*() после выполнения запроса"""
+        if rows <= 0:
+            return
+        normalized = self.normalize(sql)
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is not None:
+                stats.rows += rows
+
+    def log_slow(self, sql, params, duration, rows, plan=None, many=False):
+        message = (
+            f"🐢 Медленный запрос: {duration * 1000:.1f} мс, строк: {rows if rows >= 0 else '?'}, "
+            f"параметры: {params_shape(params, many=many)}\n{self.normalize(sql)}"
+        )
+        if plan:
+            message += "\nПлан:\n" + "\n".join(f"  {line}" for line in plan)
+        logger.warning(message)
+
+    def get_stats(self, order_by='total_time', limit=None):
+        """Статистика запросов, самые «дорогие» сверху"""
+        with self._lock:
+            stats = list(self._stats.values())
+        stats.sort(key=lambda item: getattr(item, order_by), reverse=True)
+        return stats[:limit] if limit else stats
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def params_shape(params, many=False):
+    """
+    Форма параметров без значений (в лог не попадают телефоны и тексты):
+    (int, str, NoneType) или 100 × (int, str) для executemany
+    """
+    if many:
+        params = list(params) if not isinstance(params, (list, tuple)) else params
+        if not params:
+            return "0 × ()"
+        return f"{len(params)} × {params_shape(params[0])}"
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in params.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+
+
+def _is_explainable(sql):
+    return sql.lstrip().split(None, 1)[0].upper() in _EXPLAINABLE if sql.strip() else False
+
+
+def _first_params(params, many):
+    if not many:
+        return params
+    for first in params:
+        return first
+    return None
+
+
+# Общий профилировщик процесса
+profiler = QueryProfiler()
+
+
+def get_query_stats(order_by='total_time', limit=None):
+    """Статистика запросов текущего процесса"""
+    return profiler.get_stats(order_by=order_by, limit=limit)
+
+
+class _ProfiledCursorMixin:
+    """
+    Замер execute/executemany и подсчёт строк fetch*()
+    _explain(sql, params) реализуется для конкретной БД
+    """
+
+    _last_sql = None
+
+    def _profile(self, run, sql, params, many=False):
+        started = time.perf_counter()
+        result = run()
+        duration = time.perf_counter() - started
+
+        # Запрос уже выполнен: ошибка профилировщика не должна его «провалить»
+        try:
+            self._record(sql, params, duration, many)
+        except Exception:
+            self._last_sql = None
+            logger.debug("Не удалось учесть запрос в профилировщике", exc_info=True)
+        return result
+
+    def _record(self, sql, params, duration, many):
+        # execute_values/execute_batch (psycopg2.extras) передают готовый SQL в bytes
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', errors='replace')
+            params = None
+
+        self._last_sql = sql
+        rows = self.rowcount if self.rowcount is not None else -1
+        # Строки SELECT считаются при чтении (fetch*), здесь — только изменённые
+        if profiler.record(sql, duration, rows if self.description is None else -1):
+            plan = None
+            if profiler.explain_slow and _is_explainable(sql):
+                try:
+                    plan = self._explain(sql, _first_params(params, many))
+                except Exception as e:
+                    plan = [f"не удалось получить план: {e}"]
+            profiler.log_slow(sql, params, duration, rows, plan, many=many)
+
+    def _count_rows(self, rows):
+        if self._last_sql is not None:
+            try:
+                profiler.add_rows(self._last_sql, len(rows))
+            except Exception:
+                logger.debug("Не удалось учесть строки в профилировщике", exc_info=True)
+        return rows
+
+
+@functools.lru_cache(maxsize=None)
+def make_sqlite_connection_factory():
+    """Класс подключения SQLite, курсоры которого профилируются"""
+    import sqlite3
+
+    class ProfiledSqliteCursor(_ProfiledCursorMixin, sqlite3.Cursor):
+        def execute(self, sql, parameters=()):
+            return self._profile(lambda: super(ProfiledSqliteCursor, self).execute(sql, parameters),
+                                 sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            seq_of_parameters = list(seq_of_parameters)
+            return self._profile(
+                lambda: super(ProfiledSqliteCursor, self).executemany(sql, seq_of_parameters),
+                sql, seq_of_parameters, many=True
+            )
+
+        def fetchall(self):
+            return self._count_rows(super().fetchall())
+
+        def fetchmany(self, size=None):
+            rows = super().fetchmany(self.arraysize if size is None else size)
+            return self._count_rows(rows)
+
+        def fetchone(self):
+            row = super().fetchone()
+            if row is not None:
+                self._count_rows((row,))
+            return row
+
+        def _explain(self, sql, params):
+            # Обычный курсор, чтобы EXPLAIN не попадал в статистику
+            cursor = sqlite3.Cursor(self.connection)
+            try:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+                return [row[-1] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+
+    class ProfiledSqliteConnection(sqlite3.Connection):
+        def cursor(self, factory=None):
+            return super().cursor(factory or ProfiledSqliteCursor)
+
+    return ProfiledSqliteConnection
+
+
+@functools.lru_cache(maxsize=None)
+def make_postgres_cursor_factory():
+    """Класс курсора psycopg2, который профилируется"""
+    import psycopg2.extensions
+
+    class ProfiledPostgresCursor(_ProfiledCursorMixin, psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            return self._profile(lambda: super(ProfiledPostgresCursor, self).execute(query, vars),
+                                 query, vars)
+
+        def executemany(self, query, vars_list):
+            vars_list = list(vars_list)
+            return self._profile(
+                lambda: super(ProfiledPostgresCursor, self).executemany(query, vars_list),
+                query, vars_list, many=True
+            )
+
+        def fetchall(self):
+            return self._count_rows(super().fetchall())
+
+        def fetchmany(self, size=None):
+            rows = super().fetchmany(self.arraysize if size is None else size)
+            return self._count_rows(rows)
+
+        def fetchone(self):
+            row = super().fetchone()
+            if row is not None:
+                self._count_rows((row,))
+            return row
+
+        def _explain(self, sql, params):
+            # EXPLAIN без ANALYZE: запрос не выполняется повторно
+            cursor = self.connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+            try:
+                cursor.execute(f"EXPLAIN {sql}", params)
+                return [row[0] for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+
+    return ProfiledPostgresCursor
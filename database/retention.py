@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+Хранение user_actions: помесячные секции, срок хранения и архив
+
+PostgreSQL: таблица секционирована по месяцам (миграция 11). Секции
+создаются заранее на ACTIONS_PARTITIONS_AHEAD месяцев вперёд; строки,
+попавшие в секцию по умолчанию, переносятся в секцию своего месяца.
+Устаревший месяц выгружается через COPY в .csv.gz и удаляется
+DETACH + DROP секции — без DELETE и без раздувания таблицы.
+
+Строки, записанные до миграции 11, переносятся из user_actions_legacy
+в секции пачками (move_legacy_actions), а не при запуске бота.
+
+SQLite: секций нет, устаревший месяц выгружается в .csv.gz и удаляется
+пачками по ACTIONS_DELETE_BATCH_SIZE строк (каждая — отдельная транзакция,
+чтобы не блокировать запись действий).
+
+Месяц удаляется только после того, как его действия учтены в сводках /funnel
+(rollup_state); вместе с ним удаляется и action_daily_users за те же дни.
+Запуск вручную:
+
+    python -m database.retention
+"""
+import csv
+import gzip
+import io
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+from config import (
+    USE_POSTGRES, ACTIONS_RETENTION_MONTHS, ACTIONS_ARCHIVE_DIR,
+    ACTIONS_PARTITIONS_AHEAD, ACTIONS_DELETE_BATCH_SIZE
+)
+from database import db
+
+logger = logging.getLogger(__name__)
+
+_PARTITION_RE = re.compile(r"^user_actions_(\d{4})_(\d{2})$")
+ARCHIVE_COLUMNS = ('id', 'user_id', 'action_type', 'action_data', 'timestamp')
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _this_month():
+    """
+    Первое число текущего месяца в часовом поясе колонки timestamp: в PostgreSQL
+    это пояс сессии (CURRENT_TIMESTAMP, время событий и границы секций), в SQLite — UTC
+    """
+    if USE_POSTGRES:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT date_trunc('month', CURRENT_DATE)::date")
+            return cursor.fetchone()[0]
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+def _partition_name(month):
+    return f"user_actions_{month:%Y_%m}"
+
+
+def _bounds(month):
+    """[начало месяца, начало следующего) в формате БД"""
+    start, end = month, _add_months(month, 1)
+    if USE_POSTGRES:
+        return start, end
+    return start.isoformat(), end.isoformat()
+
+
+def retention_cutoff(retention_months=ACTIONS_RETENTION_MONTHS):
+    """Начало самого старого хранимого месяца; None — хранить всё"""
+    if retention_months <= 0:
+        return None
+    return _add_months(_this_month(), -retention_months)
+
+
+# --- Секции PostgreSQL ---
+
+def _list_partitions(cursor):
+    """{первое число месяца: имя секции}"""
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'user_actions'::regclass
+    """)
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def _create_partition(cursor, month):
+    """
+    Секция месяца. Если в секции по умолчанию уже есть строки этого месяца,
+    они переносятся в новую секцию до её подключения (иначе PostgreSQL её не создаст)
+    """
+    name = _partition_name(month)
+    start, end = _bounds(month)
+    bound = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM user_actions_default WHERE timestamp >= %s AND timestamp < %s)",
+        (start, end)
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF user_actions FOR VALUES {bound}")
+        return 0
+
+    cursor.execute(f"CREATE TABLE {name} (LIKE user_actions INCLUDING DEFAULTS)")
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM user_actions_default
+            WHERE timestamp >= %s AND timestamp < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    moved = cursor.rowcount
+    cursor.execute(f"ALTER TABLE user_actions ATTACH PARTITION {name} FOR VALUES {bound}")
+    return moved
+
+
+def ensure_action_partitions(months_ahead=ACTIONS_PARTITIONS_AHEAD, since=None):
+    """
+    Создать секции на текущий и months_ahead следующих месяцев, а также для
+    месяцев, строки которых лежат в секции по умолчанию
+    since (date) — создать и секции начиная с этого месяца (перед загрузкой истории).
+    Возвращает созданные месяцы
+    """
+    if not USE_POSTGRES:
+        return []
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        existing = _list_partitions(cursor)
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', timestamp)::date FROM user_actions_default"
+        )
+        needed = {row[0] for row in cursor.fetchall()}
+
+    month = since.replace(day=1) if since else _this_month()
+    last = _add_months(_this_month(), months_ahead)
+    while month <= last:
+        needed.add(month)
+        month = _add_months(month, 1)
+
+    created = []
+    for month in sorted(needed - set(existing)):
+        # Каждая секция — своя транзакция
+        with db.get_connection() as conn:
+            moved = _create_partition(conn.cursor(), month)
+        created.append(month)
+        logger.info(f"🗂 Создана секция {_partition_name(month)}"
+                    + (f" (перенесено строк: {moved})" if moved else ""))
+    return created
+
+
+def _legacy_exists(cursor):
+    cursor.execute("SELECT to_regclass('user_actions_legacy') IS NOT NULL")
+    return cursor.fetchone()[0]
+
+
+def move_legacy_actions(batch_size=ACTIONS_DELETE_BATCH_SIZE, stop_event=None):
+    """
+    Перенести строки из user_actions_legacy (таблица до миграции 11) в секции
+    пачками по batch_size, каждая — отдельная транзакция; пустая таблица удаляется.
+    Сначала переносятся новые строки — сводки /funnel ждут именно их
+    Возвращает число перенесённых строк
+    """
+    if not USE_POSTGRES:
+        return 0
+    stop_event = stop_event or threading.Event()
+
+    moved = 0
+    while not stop_event.is_set():
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            if not _legacy_exists(cursor):
+                return moved
+            cursor.execute("""
+                SELECT DISTINCT date_trunc('month', COALESCE(timestamp, CURRENT_TIMESTAMP))::date
+                FROM (SELECT timestamp FROM user_actions_legacy ORDER BY id DESC LIMIT %s) batch
+            """, (batch_size,))
+            months = {row[0] for row in cursor.fetchall()}
+            missing = sorted(months - set(_list_partitions(cursor)))
+
+        for month in missing:
+            with db.get_connection() as conn:
+                _create_partition(conn.cursor(), month)
+            logger.info(f"🗂 Создана секция {_partition_name(month)}")
+
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH batch AS (
+                    DELETE FROM user_actions_legacy WHERE id IN (
+                        SELECT id FROM user_actions_legacy ORDER BY id DESC LIMIT %s
+                    )
+                    RETURNING *
+                )
+                INSERT INTO user_actions (id, user_id, action_type, action_data, timestamp)
+                SELECT id, user_id, action_type, action_data, COALESCE(timestamp, CURRENT_TIMESTAMP)
+                FROM batch
+            """, (batch_size,))
+            moved += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                cursor.execute("DROP TABLE user_actions_legacy")
+                logger.info(f"✅ Старые действия перенесены в секции ({moved} строк)")
+                return moved
+    return moved
+
+
+# --- Архив ---
+
+def _archive_path(archive_dir, month):
+    """Файл архива месяца; уже существующий не перезаписывается"""
+    base = os.path.join(archive_dir, _partition_name(month))
+    path, n = f"{base}.csv.gz", 1
+    while os.path.exists(path):
+        path, n = f"{base}.{n}.csv.gz", n + 1
+    return path
+
+
+@contextmanager
+def _open_archive(path):
+    """
+    Бинарный gzip-поток; файл появляется под своим именем только целиком
+    записанным и сброшенным на диск (до удаления строк из БД)
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'wb') as raw:
+            with gzip.GzipFile(filename=os.path.basename(path)[:-3], mode='wb', fileobj=raw) as gz:
+                yield gz
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _archive_month(cursor, month, path):
+    """Выгрузить действия месяца в path (.csv.gz), вернуть число строк"""
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    with _open_archive(path) as gz:
+        if USE_POSTGRES:
+            cursor.execute(f"SELECT COUNT(*) FROM {_partition_name(month)}")
+            count = cursor.fetchone()[0]
+            cursor.copy_expert(
+                f"COPY (SELECT {columns} FROM {_partition_name(month)} ORDER BY id) "
+                f"TO STDOUT WITH (FORMAT csv, HEADER true)",
+                gz
+            )
+            return count
+
+        text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(ARCHIVE_COLUMNS)
+        cursor.execute(f"""
+            SELECT {columns} FROM user_actions
+            WHERE timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp, id
+        """, _bounds(month))
+        count = 0
+        while rows := cursor.fetchmany(ACTIONS_DELETE_BATCH_SIZE):
+            writer.writerows(rows)
+            count += len(rows)
+        text.flush()
+        text.detach()
+        return count
+
+
+# --- Удаление устаревших месяцев ---
+
+def _is_rolled_up(cursor, month):
+    """Все действия месяца учтены в сводках /funnel"""
+    placeholder = '%s' if USE_POSTGRES else '?'
+    last_id, _ = db.get_rollup_state()
+    start, end = _bounds(month)
+    table = _partition_name(month) if USE_POSTGRES else 'user_actions'
+    cursor.execute(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {table}
+            WHERE timestamp >= {placeholder} AND timestamp < {placeholder} AND id > {placeholder}
+        )
+    """, (start, end, last_id))
+    return not cursor.fetchone()[0]
+
+
+def _expired_months(cutoff):
+    """Месяцы с действиями раньше cutoff (от старых к новым)"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        if USE_POSTGRES:
+            return [month for month in sorted(_list_partitions(cursor)) if month < cutoff]
+
+        months = []
+        cursor.execute("SELECT MIN(timestamp) FROM user_actions")
+        oldest = cursor.fetchone()[0]
+        if oldest:
+            month = date.fromisoformat(oldest[:10]).replace(day=1)
+            while month < cutoff:
+                months.append(month)
+                month = _add_months(month, 1)
+        return months
+
+
+def _drop_month(month, stop_event):
+    """Удалить действия месяца: DROP секции (PostgreSQL) или пачками (SQLite)"""
+    placeholder = '%s' if USE_POSTGRES else '?'
+    with db.get_connection() as conn:
+        # Уникальные пользователи за эти дни уже в action_daily_rollup.users
+        conn.cursor().execute(
+            f"DELETE FROM action_daily_users WHERE day >= {placeholder} AND day < {placeholder}",
+            _bounds(month)
+        )
+
+    if USE_POSTGRES:
+        name = _partition_name(month)
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"ALTER TABLE user_actions DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+        return True
+
+    start, end = _bounds(month)
+    while not stop_event.is_set():
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM user_actions WHERE id IN (
+                    SELECT id FROM user_actions
+                    WHERE timestamp >= ? AND timestamp < ?
+                    LIMIT ?
+                )
+            """, (start, end, ACTIONS_DELETE_BATCH_SIZE))
+            deleted = cursor.rowcount
+        if deleted < ACTIONS_DELETE_BATCH_SIZE:
+            return True
+    return False
+
+
+def expire_user_actions(retention_months=ACTIONS_RETENTION_MONTHS,
+                        archive_dir=ACTIONS_ARCHIVE_DIR, stop_event=None):
+    """
+    Архивировать и удалить месяцы старше срока хранения
+    stop_event (threading.Event) прерывает работу между месяцами и пачками удаления.
+    Возвращает список (месяц, строк, файл архива или None)
+    """
+    cutoff = retention_cutoff(retention_months)
+    if cutoff is None:
+        return []
+    stop_event = stop_event or threading.Event()
+
+    expired = []
+    for month in _expired_months(cutoff):
+        if stop_event.is_set():
+            break
+
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            if not _is_rolled_up(cursor, month):
+                logger.warning(f"⏳ {month:%m.%Y}: действия ещё не учтены в сводках /funnel, "
+                               f"удаление отложено")
+                break
+            path = _archive_path(archive_dir, month) if archive_dir else None
+            rows = _archive_month(cursor, month, path) if path else None
+
+        if not _drop_month(month, stop_event):
+            break
+        expired.append((month, rows, path))
+        logger.info(f"🗄 Действия за {month:%m.%Y} удалены"
+                    + (f", архив: {path} ({rows} строк)" if path else ""))
+    return expired
+
+
+def run_actions_maintenance(stop_event=None):
+    """Перенести строки до секционирования, создать будущие секции и удалить устаревшие месяцы"""
+    move_legacy_actions(stop_event=stop_event)
+    created = ensure_action_partitions()
+    expired = expire_user_actions(stop_event=stop_event)
+    return created, expired
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db.init_pool()
+    db.init_db()
+    try:
+        run_actions_maintenance()
+    finally:
+        db.close_pool()
@@ -1,28 +1,32 @@
 # -*- coding: utf-8 -*-
 """
 Админ-панель бота
-Команда /admin — меню с кнопками (Статистика, Пользователи, Экспорт, Рассылка)
+Команда /admin — меню с кнопками (Статистика, Воронка, Пользователи, Экспорт, Рассылка)
 """
-import asyncio
-import csv
-import io
-from datetime import datetime
+import html
+from datetime import datetime, timedelta, timezone
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, BufferedInputFile, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from config import ADMIN_IDS
-from database.db import (
-    get_user_count,
-    get_tariff_stats,
+from database.aio import (
+    get_active_user_count,
+    get_dashboard_stats,
     get_users_with_contacts,
-    get_all_user_ids,
     get_contacts_count,
-    get_recent_users_count
+    create_broadcast_job,
+    refresh_action_rollups,
+    get_rollup_state,
+    get_funnel,
+    get_action_rollup
 )
-from keyboards.inline import get_admin_menu_keyboard
+from texts.screens import get_screen
+from database.profiler import get_query_stats
+from services.export import send_contacts_export
+from services.broadcast import start_broadcast_job
 
 
 router = Router()
@@ -43,14 +47,15 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
-def _build_stats_text() -> str:
-    """Формирует текст статистики (для команды и для callback)."""
-    total_users = get_user_count()
-    contacts_count = get_contacts_count()
-    tariff_stats = get_tariff_stats()
-    today = get_recent_users_count(1)
-    week = get_recent_users_count(7)
-    month = get_recent_users_count(30)
+async def _build_stats_text() -> str:
+    """Формирует текст статистики (для команды и для callback) — один запрос к БД."""
+    stats = await get_dashboard_stats()
+    total_users = stats['total_users']
+    contacts_count = stats['contacts']
+    tariff_stats = stats['tariffs']
+    today = stats['new_today']
+    week = stats['new_week']
+    month = stats['new_month']
     contacts_percent = round(contacts_count / total_users * 100) if total_users > 0 else 0
     return f"""
 📊 <b>Статистика бота</b>
@@ -72,10 +77,10 @@ def _build_stats_text() -> str:
 """
 
 
-def _build_users_text() -> str:
+async def _build_users_text() -> str:
     """Формирует текст списка пользователей с контактами (первые 10)."""
-    users = get_users_with_contacts(limit=10)
-    total_contacts = get_contacts_count()
+    users = await get_users_with_contacts(limit=10)
+    total_contacts = await get_contacts_count()
     if not users:
         return "Пока нет пользователей с контактами."
     users_text = "👥 <b>Пользователи с контактами</b> (первые 10):\n\n"
@@ -87,7 +92,10 @@ def _build_users_text() -> str:
         username_str = f"@{username}" if username else ""
         tariff_emoji = "💼" if tariff == "basic" else "⭐" if tariff == "assistant" else "❓"
         tariff_name = "Базовый" if tariff == "basic" else "Ассистент" if tariff == "assistant" else "Не выбран"
-        reg_date = datetime.fromisoformat(registered).strftime('%d.%m.%Y')
+        # SQLite возвращает строку, PostgreSQL — datetime
+        if not isinstance(registered, datetime):
+            registered = datetime.fromisoformat(registered)
+        reg_date = registered.strftime('%d.%m.%Y')
         users_text += f"""
 {idx}. <b>{name}</b> {username_str}
    📱 <code>{phone}</code>
@@ -99,6 +107,95 @@ def _build_users_text() -> str:
     return users_text
 
 
+# Шаги воронки (колонки funnel_users) и действия — в тексте /funnel
+FUNNEL_LABELS = {
+    'started_at': "▶️ Старт (/start)",
+    'tariffs_at': "📋 Условия доступа",
+    'contact_at': "📱 Оставили контакт",
+    'selected_at': "✅ Выбрали тариф",
+}
+ACTION_LABELS = {
+    'start': "/start",
+    'view_tariffs': "Условия доступа",
+    'shared_contact': "Контакт",
+    'select_basic': "Тариф «Базовый»",
+    'select_assistant': "Тариф «Ассистент»",
+    'view_about': "О нас",
+    'ask_question': "Задать вопрос",
+}
+FUNNEL_DEFAULT_DAYS = 30
+
+
+def _parse_funnel_period(args):
+    """
+    Период для /funnel: без аргументов — последние 30 дней,
+    «7» — последние 7 дней, «01.10.2026 15.10.2026» (или 2026-10-01) — даты включительно
+    """
+    today = datetime.now(timezone.utc).date()
+    parts = (args or "").split()
+    if not parts:
+        return today - timedelta(days=FUNNEL_DEFAULT_DAYS - 1), today
+    if len(parts) == 1 and parts[0].isdigit():
+        days = max(1, int(parts[0]))
+        return today - timedelta(days=days - 1), today
+
+    dates = []
+    for part in parts[:2]:
+        for fmt in ('%d.%m.%Y', '%Y-%m-%d'):
+            try:
+                dates.append(datetime.strptime(part, fmt).date())
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(part)
+    date_from, date_to = dates[0], dates[-1] if len(dates) > 1 else today
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+    return date_from, date_to
+
+
+def _percent(part, whole):
+    return round(part / whole * 100) if whole else 0
+
+
+async def _build_funnel_text(date_from, date_to) -> str:
+    """Воронка и действия за период — из сводок (action_daily_rollup, funnel_users)"""
+    # Досчитываем свежие действия; если сводки уже обновляются в фоне — не ждём
+    await refresh_action_rollups(wait=False)
+    funnel = await get_funnel(date_from, date_to)
+    actions = await get_action_rollup(date_from, date_to)
+    _, updated_at = await get_rollup_state()
+
+    period = f"{date_from.strftime('%d.%m.%Y')} — {date_to.strftime('%d.%m.%Y')}"
+    lines = [
+        f"📉 <b>Воронка</b> {period}",
+        "<i>Пользователи, впервые нажавшие /start в эти дни</i>\n",
+    ]
+    started = previous = None
+    for column, value in funnel.items():
+        line = f"{FUNNEL_LABELS.get(column, column)}: <b>{value}</b>"
+        if started is None:
+            started = value
+        else:
+            line += f" — {_percent(value, previous)}% от предыдущего, {_percent(value, started)}% от старта"
+        previous = value
+        lines.append(line)
+
+    lines.append("\n📊 <b>Действия за период</b> (событий / пользователей по дням)")
+    if actions:
+        for action_type, (events, users) in sorted(actions.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {ACTION_LABELS.get(action_type, html.escape(action_type))}: {events} / {users}")
+    else:
+        lines.append("  Нет действий")
+
+    if updated_at:
+        if isinstance(updated_at, datetime):
+            updated_at = updated_at.strftime('%Y-%m-%d %H:%M:%S')
+        lines.append(f"\n<i>Сводки обновлены: {updated_at}</i>")
+    return "\n".join(lines)
+
+
 @router.message(Command("myid"))
 async def cmd_myid(message: Message):
     """
@@ -115,16 +212,13 @@ async def cmd_myid(message: Message):
 @router.message(Command("admin"))
 async def cmd_admin(message: Message):
     """
-    Показать админ-меню с кнопками (Статистика, Пользователи, Экспорт, Рассылка)
+    Показать админ-меню с кнопками (Статистика, Воронка, Пользователи, Экспорт, Рассылка)
     Доступно только админу
     """
     if not is_admin(message.from_user.id):
         await message.answer("У вас нет прав для использования этой команды.")
         return
-    await message.answer(
-        "🔐 <b>Админ-панель</b>\n\nВыберите действие:",
-        reply_markup=get_admin_menu_keyboard()
-    )
+    await message.answer(**get_screen('admin_menu').as_kwargs())
 
 
 @router.message(Command("stats"))
@@ -133,7 +227,7 @@ async def cmd_stats(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("У вас нет прав для использования этой команды.")
         return
-    await message.answer(_build_stats_text())
+    await message.answer(await _build_stats_text())
 
 
 @router.message(Command("users"))
@@ -142,7 +236,7 @@ async def cmd_users(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("У вас нет прав для использования этой команды.")
         return
-    await message.answer(_build_users_text())
+    await message.answer(await _build_users_text())
 
 
 @router.message(Command("export"))
@@ -155,68 +249,57 @@ async def cmd_export(message: Message):
         await message.answer("У вас нет прав для использования этой команды.")
         return
 
-    await message.answer("📤 Экспорт базы контактов...")
+    await send_contacts_export(message)
 
-    users = get_users_with_contacts()
 
-    if not users:
-        await message.answer("Нет пользователей с контактами для экспорта.")
+@router.message(Command("funnel"))
+async def cmd_funnel(message: Message, command: CommandObject):
+    """
+    Воронка /start → условия → контакт → тариф за период (из сводок)
+    /funnel, /funnel 7, /funnel 01.10.2026 15.10.2026
+    Доступно только админу
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для использования этой команды.")
         return
 
-    # Создаем CSV в памяти
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=';')  # Точка с запятой для Excel (русская версия)
-
-    # Заголовки на русском
-    writer.writerow([
-        'ID',
-        'Username',
-        'Имя',
-        'Фамилия',
-        'Телефон',
-        'Тариф',
-        'Дата регистрации'
-    ])
-
-    # Данные
-    for user in users:
-        user_id, username, first_name, last_name, phone, registered, tariff = user
+    try:
+        date_from, date_to = _parse_funnel_period(command.args)
+    except ValueError:
+        await message.answer(
+            "Не понял период. Примеры:\n"
+            "/funnel — последние 30 дней\n"
+            "/funnel 7 — последние 7 дней\n"
+            "/funnel 01.10.2026 15.10.2026"
+        )
+        return
 
-        # Преобразуем тариф в читаемый вид
-        tariff_name = {
-            'basic': 'Базовый',
-            'assistant': 'Ассистент для ассистента',
-            None: 'Не выбран'
-        }.get(tariff, 'Не выбран')
-
-        # Преобразуем дату в читаемый формат
-        try:
-            reg_date = datetime.fromisoformat(registered).strftime('%d.%m.%Y %H:%M')
-        except:
-            reg_date = registered
-
-        writer.writerow([
-            user_id,
-            f"@{username}" if username else '',
-            first_name or '',
-            last_name or '',
-            phone,
-            tariff_name,
-            reg_date
-        ])
-
-    # Конвертируем в байты
-    csv_bytes = output.getvalue().encode('utf-8-sig')  # BOM для Excel
-    output.close()
-
-    # Создаем файл для отправки
-    filename = f"contacts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    file = BufferedInputFile(csv_bytes, filename=filename)
-
-    await message.answer_document(
-        document=file,
-        caption=f"✅ Экспортировано {len(users)} контактов"
-    )
+    await message.answer(await _build_funnel_text(date_from, date_to))
+
+
+@router.message(Command("queries"))
+async def cmd_queries(message: Message):
+    """
+    Самые «дорогие» запросы к БД с момента запуска (по суммарному времени)
+    Доступно только админу
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для использования этой команды.")
+        return
+
+    stats = get_query_stats(limit=10)
+    if not stats:
+        await message.answer("Статистика запросов пуста (профилирование выключено: DB_PROFILE).")
+        return
+
+    lines = ["🐢 <b>Запросы к БД</b> (всего мс / вызовов / сред. мс / макс. мс / медленных)\n"]
+    for item in stats:
+        lines.append(
+            f"<b>{item.total_time * 1000:.0f}</b> / {item.calls} / {item.avg_time * 1000:.1f} / "
+            f"{item.max_time * 1000:.1f} / {item.slow}\n"
+            f"<code>{html.escape(item.sql[:300])}</code>\n"
+        )
+    await message.answer("\n".join(lines))
 
 
 @router.message(Command("broadcast"))
@@ -229,7 +312,7 @@ async def cmd_broadcast(message: Message, state: FSMContext):
         await message.answer("У вас нет прав для использования этой команды.")
         return
 
-    total_users = get_user_count()
+    total_users = await get_active_user_count()
 
     await state.set_state(BroadcastState.waiting_for_message)
 
@@ -263,7 +346,7 @@ async def broadcast_message_received(message: Message, state: FSMContext):
         return
 
     broadcast_text = message.text
-    total_users = get_user_count()
+    total_users = await get_active_user_count()
 
     # Сохраняем текст в состояние
     await state.update_data(broadcast_text=broadcast_text)
@@ -299,44 +382,13 @@ async def broadcast_confirmation(message: Message, state: FSMContext):
 
     await state.clear()
 
-    # Получаем всех пользователей
-    user_ids = get_all_user_ids()
-    total = len(user_ids)
-
-    await message.answer(f"📨 Рассылка началась... (0/{total})")
-
-    success = 0
-    failed = 0
-    start_time = datetime.now()
+    # Задание рассылки сохраняется в БД вместе со списком получателей,
+    # поэтому переживает перезапуск бота
+    job_id, total = await create_broadcast_job(broadcast_text, message.chat.id)
 
-    # Отправляем сообщения
-    for idx, user_id in enumerate(user_ids, 1):
-        try:
-            await message.bot.send_message(user_id, broadcast_text)
-            success += 1
-        except Exception:
-            failed += 1
-
-        # Показываем прогресс каждые 25 сообщений
-        if idx % 25 == 0 or idx == total:
-            try:
-                await message.answer(f"✅ {idx}/{total}")
-            except Exception:
-                pass
-
-        # Задержка, чтобы не попасть под ограничения Telegram
-        await asyncio.sleep(0.05)  # 50ms между сообщениями
-
-    end_time = datetime.now()
-    duration = (end_time - start_time).total_seconds()
-
-    # Итоговая статистика
-    await message.answer(
-        f"📊 <b>Рассылка завершена!</b>\n\n"
-        f"✅ Успешно: {success}\n"
-        f"❌ Ошибок: {failed} (заблокировали бота)\n"
-        f"⏱ Время: {int(duration)} сек"
-    )
+    # Отправка идёт в фоне: пул воркеров + общий лимит темпа (см. services/broadcast.py)
+    # Прогресс показывается в одном сообщении, которое обновляет сам движок рассылки
+    start_broadcast_job(message.bot, job_id)
 
 
 # --- Обработчики кнопок админ-меню (callback) ---
@@ -348,7 +400,7 @@ async def callback_admin_stats(callback: CallbackQuery):
         await callback.answer("Нет прав.", show_alert=True)
         return
     await callback.answer()
-    await callback.message.answer(_build_stats_text())
+    await callback.message.answer(await _build_stats_text())
 
 
 @router.callback_query(F.data == "admin:users")
@@ -358,7 +410,17 @@ async def callback_admin_users(callback: CallbackQuery):
         await callback.answer("Нет прав.", show_alert=True)
         return
     await callback.answer()
-    await callback.message.answer(_build_users_text())
+    await callback.message.answer(await _build_users_text())
+
+
+@router.callback_query(F.data == "admin:funnel")
+async def callback_admin_funnel(callback: CallbackQuery):
+    """Кнопка «Воронка» в админ-меню (последние 30 дней)."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.answer(await _build_funnel_text(*_parse_funnel_period(None)))
 
 
 @router.callback_query(F.data == "admin:export")
@@ -368,45 +430,7 @@ async def callback_admin_export(callback: CallbackQuery):
         await callback.answer("Нет прав.", show_alert=True)
         return
     await callback.answer()
-    msg = callback.message
-    await msg.answer("📤 Экспорт базы контактов...")
-    users = get_users_with_contacts()
-    if not users:
-        await msg.answer("Нет пользователей с контактами для экспорта.")
-        return
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=';')
-    writer.writerow([
-        'ID', 'Username', 'Имя', 'Фамилия', 'Телефон', 'Тариф', 'Дата регистрации'
-    ])
-    for user in users:
-        user_id, username, first_name, last_name, phone, registered, tariff = user
-        tariff_name = {
-            'basic': 'Базовый',
-            'assistant': 'Ассистент для ассистента',
-            None: 'Не выбран'
-        }.get(tariff, 'Не выбран')
-        try:
-            reg_date = datetime.fromisoformat(registered).strftime('%d.%m.%Y %H:%M')
-        except Exception:
-            reg_date = registered
-        writer.writerow([
-            user_id,
-            f"@{username}" if username else '',
-            first_name or '',
-            last_name or '',
-            phone,
-            tariff_name,
-            reg_date
-        ])
-    csv_bytes = output.getvalue().encode('utf-8-sig')
-    output.close()
-    filename = f"contacts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    file = BufferedInputFile(csv_bytes, filename=filename)
-    await msg.answer_document(
-        document=file,
-        caption=f"✅ Экспортировано {len(users)} контактов"
-    )
+    await send_contacts_export(callback.message)
 
 
 @router.callback_query(F.data == "admin:broadcast")
@@ -416,7 +440,7 @@ async def callback_admin_broadcast(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Нет прав.", show_alert=True)
         return
     await callback.answer()
-    total_users = get_user_count()
+    total_users = await get_active_user_count()
     await state.set_state(BroadcastState.waiting_for_message)
     await callback.message.answer(
         f"📢 <b>Рассылка сообщений</b>\n\n"
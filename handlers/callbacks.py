@@ -6,22 +6,9 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from texts.messages import (
-    get_welcome_message,
-    get_tariffs_text_and_entities,
-    BASIC_TARIFF_MESSAGE,
-    ASSISTANT_TARIFF_MESSAGE,
-    ABOUT_AUTHORS_MESSAGE,
-    ASK_QUESTION_MESSAGE
-)
-from keyboards.inline import (
-    get_main_menu_keyboard,
-    get_tariffs_keyboard,
-    get_contact_manager_keyboard,
-    get_about_authors_keyboard,
-    get_ask_question_keyboard
-)
-from database.db import log_action, log_tariff_selection
+from texts.screens import get_screen, get_welcome_screen
+from database.aio import log_action, log_tariff_selection
+from services.editing import edit_screen, forget_message
 
 
 router = Router()
@@ -33,12 +20,9 @@ async def callback_main_menu(callback: CallbackQuery):
     Возврат в главное меню
     """
     user = callback.from_user
-    welcome_text = get_welcome_message(user.first_name)
+    screen = get_welcome_screen(user.first_name)
 
-    await callback.message.edit_text(
-        text=welcome_text,
-        reply_markup=get_main_menu_keyboard()
-    )
+    await edit_screen(callback.message, screen)
     await callback.answer()
 
 
@@ -47,28 +31,21 @@ async def callback_tariffs(callback: CallbackQuery, state: FSMContext):
     """
     Запрос контакта перед показом тарифов
     """
-    from database.db import get_user_phone
+    from database.aio import user_has_contact
     from handlers.contact import request_contact
 
     user_id = callback.from_user.id
 
-    # Проверяем, есть ли уже контакт в БД
-    phone = get_user_phone(user_id)
-
-    if phone:
+    # Проверяем, есть ли уже контакт (кэш, при промахе — БД)
+    if await user_has_contact(user_id):
         # Контакт уже есть, показываем тарифы (через entities — раскрывающиеся цитаты)
-        log_action(user_id, 'view_tariffs')
-        text, entities = get_tariffs_text_and_entities()
-        await callback.message.edit_text(
-            text=text,
-            entities=entities,
-            parse_mode=None,
-            reply_markup=get_tariffs_keyboard()
-        )
+        await log_action(user_id, 'view_tariffs')
+        await edit_screen(callback.message, get_screen('tariffs'))
         await callback.answer()
     else:
         # Контакта нет, запрашиваем
         await callback.message.delete()
+        forget_message(callback.message)
         await callback.answer()
         await request_contact(callback.message, state, 'view_tariffs')
 
@@ -78,19 +55,14 @@ async def callback_select_basic(callback: CallbackQuery):
     """
     Выбран тариф БАЗОВЫЙ
     """
-    from keyboards.inline import get_contact_manager_keyboard
-
     user_id = callback.from_user.id
-    log_action(user_id, 'select_basic')
-    log_tariff_selection(user_id, 'basic')
+    await log_action(user_id, 'select_basic')
+    await log_tariff_selection(user_id, 'basic')
 
     await callback.answer("✅ Отличный выбор!")
 
     # Показываем информацию о тарифе и контакт менеджера
-    await callback.message.edit_text(
-        text=BASIC_TARIFF_MESSAGE,
-        reply_markup=get_contact_manager_keyboard()
-    )
+    await edit_screen(callback.message, get_screen('basic_selected'))
 
 
 @router.callback_query(F.data == "select_assistant")
@@ -98,19 +70,14 @@ async def callback_select_assistant(callback: CallbackQuery):
     """
     Выбран тариф АССИСТЕНТ ДЛЯ АССИСТЕНТА
     """
-    from keyboards.inline import get_contact_manager_keyboard
-
     user_id = callback.from_user.id
-    log_action(user_id, 'select_assistant')
-    log_tariff_selection(user_id, 'assistant')
+    await log_action(user_id, 'select_assistant')
+    await log_tariff_selection(user_id, 'assistant')
 
     await callback.answer("⭐ Превосходный выбор!")
 
     # Показываем информацию о тарифе и контакт менеджера
-    await callback.message.edit_text(
-        text=ASSISTANT_TARIFF_MESSAGE,
-        reply_markup=get_contact_manager_keyboard()
-    )
+    await edit_screen(callback.message, get_screen('assistant_selected'))
 
 
 @router.callback_query(F.data == "about_authors")
@@ -119,12 +86,9 @@ async def callback_about_authors(callback: CallbackQuery):
     Показать информацию об авторах
     """
     user_id = callback.from_user.id
-    log_action(user_id, 'view_about')
+    await log_action(user_id, 'view_about')
 
-    await callback.message.edit_text(
-        text=ABOUT_AUTHORS_MESSAGE,
-        reply_markup=get_about_authors_keyboard()
-    )
+    await edit_screen(callback.message, get_screen('about_authors'))
     await callback.answer()
 
 
@@ -134,10 +98,7 @@ async def callback_ask_question(callback: CallbackQuery):
     Задать вопрос - показать контакт менеджера
     """
     user_id = callback.from_user.id
-    log_action(user_id, 'ask_question')
+    await log_action(user_id, 'ask_question')
 
-    await callback.message.edit_text(
-        text=ASK_QUESTION_MESSAGE,
-        reply_markup=get_ask_question_keyboard()
-    )
+    await edit_screen(callback.message, get_screen('ask_question'))
     await callback.answer()
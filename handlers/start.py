@@ -6,9 +6,8 @@ from aiogram import Router
 from aiogram.filters import CommandStart
 from aiogram.types import Message
 
-from texts.messages import get_welcome_message
-from keyboards.inline import get_main_menu_keyboard
-from database.db import add_or_update_user, log_action
+from texts.screens import get_welcome_screen
+from database.aio import add_or_update_user, log_action
 
 
 router = Router()
@@ -23,7 +22,7 @@ async def cmd_start(message: Message):
     user = message.from_user
 
     # Сохраняем пользователя в БД
-    add_or_update_user(
+    await add_or_update_user(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -31,13 +30,7 @@ async def cmd_start(message: Message):
     )
 
     # Логируем действие
-    log_action(user.id, 'start')
+    await log_action(user.id, 'start')
 
-    # Получаем приветственное сообщение с именем
-    welcome_text = get_welcome_message(user.first_name)
-
-    # Отправляем сообщение с главным меню
-    await message.answer(
-        text=welcome_text,
-        reply_markup=get_main_menu_keyboard()
-    )
+    # Приветствие с именем и главное меню (клавиатура собрана заранее)
+    await message.answer(**get_welcome_screen(user.first_name).as_kwargs())
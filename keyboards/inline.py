@@ -2,7 +2,9 @@
 """
 Inline-клавиатуры (кнопки) для бота
 """
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from texts.messages import MANAGER_USERNAME
 
@@ -89,10 +91,11 @@ def get_ask_question_keyboard():
 def get_admin_menu_keyboard():
     """
     Меню админ-панели (по команде /admin):
-    - Статистика, Пользователи, Экспорт, Рассылка
+    - Статистика, Воронка, Пользователи, Экспорт, Рассылка
     """
     builder = InlineKeyboardBuilder()
     builder.button(text="📊 Статистика", callback_data="admin:stats")
+    builder.button(text="📉 Воронка", callback_data="admin:funnel")
     builder.button(text="👥 Пользователи", callback_data="admin:users")
     builder.button(text="📤 Экспорт", callback_data="admin:export")
     builder.button(text="📢 Рассылка", callback_data="admin:broadcast")
@@ -102,19 +105,12 @@ def get_admin_menu_keyboard():
 
 def get_contact_request_keyboard():
     """
-    Клавиатура для запроса контакта (номера телефона)
+    Клавиатура для запроса контакта (номера телефона), без кнопки «Пропустить»
     """
-    from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-    
-    keyboard = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    contact_button = KeyboardButton(
-        text="📱 Поделиться контактом",
-        request_contact=True
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="📱 Поделиться контактом", request_contact=True)]
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True
     )
-    skip_button = KeyboardButton(text="⏭ Пропустить")
-    
-    keyboard.add(contact_button)
-    keyboard.add(skip_button)
-    
-    return keyboard
-
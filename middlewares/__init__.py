@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Middleware для диспетчера и сессии бота
+"""
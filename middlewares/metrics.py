@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Замер времени обработки обновлений и запросов к Bot API
+
+Обработчик становится известен только после маршрутизации, поэтому:
+- UpdateMetricsMiddleware (outer, на dp.update) замеряет всё обновление целиком;
+- HandlerInfoMiddleware (inner, на событиях диспетчера — действует и для
+  вложенных роутеров) записывает, какой обработчик сработал
+"""
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError
+
+from services.metrics import (
+    UPDATE_DURATION, UPDATE_ERRORS, API_REQUEST_DURATION, API_REQUEST_ERRORS
+)
+
+# Ключ в data обработчика, через который inner-middleware сообщает имя обработчика
+METRICS_CONTEXT_KEY = "metrics_context"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Время обработки каждого обновления с разбивкой по роутеру и обработчику"""
+
+    async def __call__(self, handler, event, data):
+        context = {"router": "-", "handler": "unhandled"}
+        data[METRICS_CONTEXT_KEY] = context
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.inc(event_type=event.event_type, **context)
+            raise
+        finally:
+            UPDATE_DURATION.observe(
+                time.perf_counter() - started, event_type=event.event_type, **context
+            )
+
+
+class HandlerInfoMiddleware(BaseMiddleware):
+    """Записывает сработавший обработчик в контекст UpdateMetricsMiddleware"""
+
+    async def __call__(self, handler, event, data):
+        context = data.get(METRICS_CONTEXT_KEY)
+        handler_object = data.get("handler")
+        if context is not None and handler_object is not None:
+            callback = handler_object.callback
+            # Модуль обработчика = роутер (handlers.admin, handlers.start, ...)
+            context["router"] = getattr(callback, "__module__", "-")
+            context["handler"] = getattr(callback, "__name__", "unknown")
+        return await handler(event, data)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Время каждого запроса к Bot API по методу (sendMessage, editMessageText, ...)"""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramAPIError as e:
+            API_REQUEST_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_REQUEST_DURATION.observe(time.perf_counter() - started, method=name)
+
+
+def setup_metrics_middlewares(dp, bot):
+    """Подключить замеры к диспетчеру и сессии бота"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_info = HandlerInfoMiddleware()
+    for observer in dp.observers.values():
+        if observer.event_name not in ("update", "error"):
+            observer.middleware(handler_info)
+    bot.session.middleware(RequestMetricsMiddleware())
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Повтор запросов к Bot API после flood control (ответ 429)
+
+Без повтора TelegramRetryAfter доходит до обработчика: ответ пользователю
+(sendMessage, editMessageText в edit_screen) теряется, сценарий обрывается.
+RetryAfterMiddleware на сессии бота ждёт retry_after секунд и повторяет
+запрос — не больше API_RETRY_ATTEMPTS раз и только если ждать не дольше
+API_RETRY_MAX_WAIT секунд (иначе ошибка уходит обработчику как раньше)
+
+Рассылка сама повторяет отправку и ставит на паузу общий TokenBucket
+(services/broadcast.py), поэтому её отправки идут внутри without_api_retry()
+"""
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import API_RETRY_ATTEMPTS, API_RETRY_MAX_WAIT
+from services.metrics import API_RETRIES
+
+logger = logging.getLogger(__name__)
+
+_retry_enabled = ContextVar("api_retry_enabled", default=True)
+
+
+@contextmanager
+def without_api_retry():
+    """Запросы внутри блока не повторяются: TelegramRetryAfter сразу уходит вызывающему"""
+    token = _retry_enabled.set(False)
+    try:
+        yield
+    finally:
+        _retry_enabled.reset(token)
+
+
+class RetryAfterMiddleware(BaseRequestMiddleware):
+    """Повтор запроса после TelegramRetryAfter"""
+
+    def __init__(self, attempts=API_RETRY_ATTEMPTS, max_wait=API_RETRY_MAX_WAIT):
+        self.attempts = attempts
+        self.max_wait = max_wait
+
+    async def __call__(self, make_request, bot, method):
+        attempt = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if (not _retry_enabled.get() or attempt >= self.attempts
+                        or e.retry_after > self.max_wait):
+                    raise
+                attempt += 1
+                API_RETRIES.inc(method=method.__api_method__)
+                logger.warning(f"⏸ {method.__api_method__}: flood control, "
+                               f"повтор через {e.retry_after} сек")
+                await asyncio.sleep(e.retry_after)
+
+
+def setup_retry_middleware(bot):
+    """Подключить повтор запросов к сессии бота (API_RETRY_ATTEMPTS=0 — не подключать)"""
+    if API_RETRY_ATTEMPTS <= 0:
+        return
+    bot.session.middleware(RetryAfterMiddleware())
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик обновлений: параллельно для разных чатов, по порядку внутри чата
+
+aiogram либо обрабатывает обновления по одному, либо запускает задачу на
+каждое без ограничений. Здесь обновления раскладываются по очередям чатов
+и выполняются пулом из UPDATE_WORKERS обработчиков:
+- обновления одного чата выполняются строго по очереди (форма контакта,
+  ввод рассылки не обгоняют сами себя);
+- разные чаты обрабатываются параллельно, но не больше UPDATE_WORKERS сразу;
+- очередь чата ограничена UPDATE_CHAT_QUEUE_SIZE, все очереди вместе —
+  UPDATE_MAX_PENDING (приём новых обновлений ждёт, пока освободится место)
+
+Планировщик подменяет Dispatcher.feed_update — общую точку входа polling
+и webhook — и ставит в очередь чата само обновление, до всех middleware.
+Поэтому вся цепочка (обработка ошибок, контекст пользователя, FSM, метрики,
+антифлуд, обработчики) выполняется уже в пуле: состояние FSM читается, когда
+до обновления дошла очередь, а не когда оно пришло
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+
+from config import (
+    UPDATE_WORKERS, UPDATE_CHAT_QUEUE_SIZE, UPDATE_MAX_PENDING, UPDATE_DRAIN_TIMEOUT
+)
+from services.metrics import (
+    SCHEDULER_PENDING, SCHEDULER_CHATS, SCHEDULER_MAX_CHAT_DEPTH,
+    SCHEDULER_BUSY_WORKERS, SCHEDULER_WAIT, SCHEDULER_DROPPED
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateScheduler:
+    """
+    Очереди обновлений по чатам и пул обработчиков
+    feed_update — исходный Dispatcher.feed_update, им обновление обрабатывается в пуле.
+    Инвариант: чат есть в _chats, пока у него есть ожидающие или выполняемое
+    обновление, и в очереди готовых _ready он стоит не больше одного раза
+    """
+
+    def __init__(self, feed_update, workers=UPDATE_WORKERS,
+                 chat_queue_size=UPDATE_CHAT_QUEUE_SIZE, max_pending=UPDATE_MAX_PENDING):
+        self.feed_update = feed_update
+        self.workers = workers
+        self.chat_queue_size = chat_queue_size
+        # chat_key -> deque[(bot, update, kwargs, время постановки)]
+        self._chats = {}
+        # Чаты, у которых есть обновления и которые сейчас никто не обрабатывает
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pending = 0
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker_tasks = []
+        SCHEDULER_MAX_CHAT_DEPTH.set_function(self.max_chat_depth)
+
+    def max_chat_depth(self):
+        """Длина самой длинной очереди чата (считается при чтении метрик)"""
+        return max((len(queue) for queue in list(self._chats.values())), default=0)
+
+    @staticmethod
+    def _chat_key(update):
+        context = UserContextMiddleware.resolve_event_context(update)
+        if context.chat is not None:
+            return context.chat.id
+        if context.user is not None:
+            return context.user.id
+        # Обновления без чата и пользователя (опросы и т.п.) ни с чем не упорядочиваются
+        return ("update", update.update_id)
+
+    async def submit(self, bot, update, **kwargs):
+        """Поставить обновление в очередь его чата (вместо Dispatcher.feed_update)"""
+        key = self._chat_key(update)
+        queue = self._chats.get(key)
+        if queue is not None and len(queue) >= self.chat_queue_size:
+            SCHEDULER_DROPPED.inc()
+            logger.warning(
+                f"⚠️ Очередь чата {key} переполнена ({len(queue)}), "
+                f"обновление {update.update_id} отброшено"
+            )
+            return None
+
+        # Все очереди заполнены — приём обновлений ждёт (backpressure для polling)
+        await self._slots.acquire()
+        self._start_workers()
+
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        queue.append((bot, update, kwargs, time.perf_counter()))
+        self._pending += 1
+        self._idle.clear()
+        self._update_gauges()
+        return None
+
+    def _start_workers(self):
+        if self._worker_tasks:
+            return
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(), name=f"update-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"✅ Планировщик обновлений запущен (workers={self.workers})")
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._chats[key]
+            bot, update, kwargs, enqueued_at = queue.popleft()
+            SCHEDULER_WAIT.observe(time.perf_counter() - enqueued_at)
+
+            self._busy += 1
+            try:
+                await self.feed_update(bot, update, **kwargs)
+            except Exception as e:
+                # Сюда доходят только ошибки, не обработанные dp.errors
+                logger.exception(f"❌ Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                self._busy -= 1
+                self._pending -= 1
+                self._slots.release()
+                # Следующее обновление чата — в конец очереди готовых (чаты по кругу)
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                if not self._pending:
+                    self._idle.set()
+                self._update_gauges()
+
+    def _update_gauges(self):
+        SCHEDULER_PENDING.set(self._pending)
+        SCHEDULER_CHATS.set(len(self._chats))
+        SCHEDULER_BUSY_WORKERS.set(self._busy)
+
+    async def stop(self, timeout=UPDATE_DRAIN_TIMEOUT):
+        """Дождаться обработки принятых обновлений и остановить пул"""
+        if not self._worker_tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Остановка: не обработано обновлений: {self._pending}")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        logger.info("🛑 Планировщик обновлений остановлен")
+
+
+def setup_update_scheduler(dp):
+    """
+    Подключить планировщик к диспетчеру: обновления из polling и webhook
+    попадают в очереди чатов, а не сразу в цепочку middleware
+    Возвращает планировщик или None, если он отключён (UPDATE_WORKERS=0)
+    """
+    if UPDATE_WORKERS <= 0:
+        return None
+    scheduler = UpdateScheduler(dp.feed_update)
+    dp.feed_update = scheduler.submit
+    dp.shutdown.register(scheduler.stop)
+    return scheduler
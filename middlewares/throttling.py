@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Антифлуд: ограничение частоты нажатий и сообщений на пользователя
+Каждое нажатие тарифа — две записи в БД и editMessageText, поэтому
+частые повторы отбрасываются ещё до фильтров, чтения состояния FSM
+(запрос к БД в SQLStorage) и обработчиков: на нажатие сразу отвечается
+answerCallbackQuery, сообщение игнорируется
+
+Счётчики — token bucket в памяти процесса:
+- на кнопку (user_id, callback_data) — повторные нажатия одной кнопки;
+- на пользователя — все его нажатия и сообщения вместе
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from config import (
+    THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST,
+    THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_MAX_KEYS
+)
+from middlewares.metrics import METRICS_CONTEXT_KEY
+from services.metrics import THROTTLED_EVENTS
+from texts.messages import THROTTLED_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedRateLimiter:
+    """
+    Token bucket на каждый ключ: rate событий в секунду, до burst подряд
+    Счётчик, простоявший burst / rate секунд, снова полон — такой же, как новый,
+    поэтому он удаляется; сверх max_keys вытесняются самые давние
+    """
+
+    def __init__(self, rate, burst, max_keys=THROTTLE_MAX_KEYS):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.idle_timeout = self.burst / rate if rate > 0 else 0.0
+        # key -> (токены, время обновления); порядок — от давних к недавним
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now=None):
+        """Разрешить событие (и списать токен) или отказать"""
+        if self.rate <= 0:
+            return True
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+
+        state = self._buckets.pop(key, None)
+        if state is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, state[0] + (now - state[1]) * self.rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def _expire(self, now):
+        """Удалить полностью восстановившиеся счётчики (они в начале очереди)"""
+        buckets = self._buckets
+        while buckets:
+            key = next(iter(buckets))
+            if now - buckets[key][1] < self.idle_timeout:
+                break
+            del buckets[key]
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update, стоящий перед FSMContextMiddleware
+    (см. setup_throttling_middleware): отброшенное сообщение или нажатие
+    не доходит ни до FSM-хранилища, ни до фильтров и обработчиков
+    """
+
+    def __init__(self, callback_limiter=None, user_limiter=None):
+        self.callback_limiter = callback_limiter or KeyedRateLimiter(
+            THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST
+        )
+        self.user_limiter = user_limiter or KeyedRateLimiter(
+            THROTTLE_USER_RATE, THROTTLE_USER_BURST
+        )
+
+    async def __call__(self, handler, event, data):
+        update, event = event, event.callback_query or event.message
+        user = data.get("event_from_user")
+        if event is None or user is None:
+            return await handler(update, data)
+
+        limit = None
+        if isinstance(event, CallbackQuery) and not self.callback_limiter.allow((user.id, event.data)):
+            limit = "callback"
+        elif not self.user_limiter.allow(user.id):
+            limit = "user"
+
+        if limit is None:
+            return await handler(update, data)
+
+        event_type = "callback_query" if isinstance(event, CallbackQuery) else "message"
+        THROTTLED_EVENTS.inc(event_type=event_type, limit=limit)
+        context = data.get(METRICS_CONTEXT_KEY)
+        if context is not None:
+            context["handler"] = "throttled"
+        logger.debug(f"⏳ Антифлуд: {event_type} от {user.id} отброшен ({limit})")
+
+        if isinstance(event, CallbackQuery):
+            # Без ответа у пользователя будет крутиться индикатор загрузки на кнопке
+            await event.answer(THROTTLED_MESSAGE)
+        return None
+
+
+def setup_throttling_middleware(dp):
+    """
+    Подключить антифлуд к сообщениям и нажатиям кнопок
+    Dispatcher сам регистрирует FSMContextMiddleware на update, и outer-middleware
+    на message/callback_query выполнялись бы уже после чтения состояния.
+    Поэтому антифлуд ставится на update, а FSM переставляется за ним
+    """
+    if THROTTLE_CALLBACK_RATE <= 0 and THROTTLE_USER_RATE <= 0:
+        return
+    throttling = ThrottlingMiddleware()
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(throttling)
+    dp.update.outer_middleware(dp.fsm)
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Сервисы бота (экспорт, рассылки и т.д.)
+"""
@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+"""
+Движок рассылки
+Сообщения отправляет пул воркеров (BROADCAST_CONCURRENCY), общий темп
+ограничивает token bucket (BROADCAST_RATE сообщений/сек, лимит Telegram ~30/сек).
+TelegramRetryAfter ставит на паузу весь bucket, после чего отправка повторяется.
+Задания рассылки хранятся в БД (broadcast_jobs / broadcast_deliveries)
+и возобновляются после перезапуска бота
+Прогресс показывается в одном сообщении админу, которое редактируется не чаще
+раза в BROADCAST_PROGRESS_INTERVAL секунд (темп, ETA, разбивка ошибок)
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramServerError,
+    TelegramAPIError,
+)
+
+from config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES,
+    BROADCAST_CHECKPOINT_SIZE, BROADCAST_PROGRESS_INTERVAL
+)
+from database import db
+from database.aio import run_db
+from middlewares.retry import without_api_retry
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничитель темпа: не больше rate операций в секунду,
+    всплеск — не больше capacity операций подряд
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = None
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self._updated_at is None:
+            self._updated_at = now
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        """Дождаться разрешения на одну операцию"""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Остановить выдачу разрешений на seconds секунд (ответ 429 от Telegram)"""
+        now = asyncio.get_running_loop().time()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated_at = self._paused_until
+
+
+# Общий лимит всех рассылок процесса: задания, возобновлённые после перезапуска,
+# и новое задание делят один темп BROADCAST_RATE, а не складывают свои
+_bucket = None
+
+
+def get_broadcast_bucket():
+    """Общий TokenBucket рассылок (создаётся при первом обращении)"""
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(BROADCAST_RATE)
+    return _bucket
+
+
+def classify_error(error):
+    """
+    Ключ ошибки доставки: статус недоступного пользователя
+    (db.DELIVERY_BLOCKED / DELIVERY_DEACTIVATED / DELIVERY_CHAT_NOT_FOUND)
+    или имя класса исключения для прочих ошибок
+    """
+    message = str(getattr(error, 'message', error)).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if 'deactivated' in message:
+            return db.DELIVERY_DEACTIVATED
+        return db.DELIVERY_BLOCKED
+    if isinstance(error, TelegramBadRequest) and 'chat not found' in message:
+        return db.DELIVERY_CHAT_NOT_FOUND
+    return type(error).__name__
+
+
+class BroadcastResult:
+    """Итоги рассылки"""
+
+    def __init__(self, total=0, success=0, failed=0):
+        self.total = total
+        self.success = success
+        self.failed = failed
+        # Недоступные пользователи (заблокировали бота, удалены, чат не найден)
+        self.blocked = 0
+        self.retried = 0
+        # Разбивка ошибок по классам исключений
+        self.errors = Counter()
+
+    @property
+    def processed(self):
+        return self.success + self.failed
+
+
+async def _iterate(user_ids):
+    """Перебор получателей: обычный или асинхронный итерируемый объект"""
+    if hasattr(user_ids, '__aiter__'):
+        async for user_id in user_ids:
+            yield user_id
+    else:
+        for user_id in user_ids:
+            yield user_id
+
+
+async def run_broadcast(bot, user_ids, text, concurrency=BROADCAST_CONCURRENCY,
+                        max_retries=BROADCAST_MAX_RETRIES,
+                        on_progress=None, progress_every=25, on_delivery=None,
+                        result=None, bucket=None):
+    """
+    Разослать text всем user_ids (список или асинхронный генератор)
+    on_progress(result) — корутина, вызывается каждые progress_every отправок
+    on_delivery(user_id, delivered, error) — вызывается после каждого получателя
+    result — BroadcastResult с уже накопленными итогами (при возобновлении)
+    bucket — TokenBucket темпа (по умолчанию общий для всех рассылок)
+    """
+    if bucket is None:
+        bucket = get_broadcast_bucket()
+    if result is None:
+        result = BroadcastResult()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def send(user_id):
+        """Отправить одно сообщение с повторами; None — доставлено, иначе имя ошибки"""
+        for attempt in range(max_retries + 1):
+            await bucket.acquire()
+            try:
+                # Повторы — здесь, с паузой всего bucket, а не в сессии бота
+                with without_api_retry():
+                    await bot.send_message(user_id, text)
+                return None
+            except TelegramRetryAfter as e:
+                # Лимит превышен: паузим весь bucket, а не только этот воркер
+                logger.warning(f"⏸ Рассылка: flood control, пауза {e.retry_after} сек")
+                bucket.pause(e.retry_after)
+                error = e
+            except (TelegramNetworkError, TelegramServerError) as e:
+                await asyncio.sleep(min(2 ** attempt, 30))
+                error = e
+            except TelegramAPIError as e:
+                # Заблокировал бота, удалён и т.п. — повторять бессмысленно
+                key = classify_error(e)
+                if key in db.INACTIVE_DELIVERY_STATUSES:
+                    result.blocked += 1
+                return key
+
+            if attempt < max_retries:
+                result.retried += 1
+
+        return type(error).__name__
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            try:
+                try:
+                    error = await send(user_id)
+                except Exception as e:
+                    logger.exception(f"❌ Рассылка: ошибка отправки {user_id}")
+                    error = type(e).__name__
+
+                if error is None:
+                    result.success += 1
+                else:
+                    result.failed += 1
+                    result.errors[error] += 1
+
+                if on_delivery:
+                    on_delivery(user_id, error is None, error)
+
+                if on_progress and result.processed % progress_every == 0:
+                    try:
+                        await on_progress(result)
+                    except Exception:
+                        logger.exception("❌ Рассылка: ошибка обновления прогресса")
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async for user_id in _iterate(user_ids):
+            await queue.put(user_id)
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    return result
+
+
+async def _pending_recipients(job_id, batch_size=BROADCAST_CHECKPOINT_SIZE * 10):
+    """Получатели задания, которым ещё не отправлено, пачками из БД"""
+    after = None
+    while True:
+        user_ids = await run_db(db.get_pending_deliveries, job_id, after, batch_size)
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            yield user_id
+        after = user_ids[-1]
+
+
+def _format_duration(seconds):
+    """Длительность в виде 1ч 02м 03с"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}ч {minutes:02d}м {seconds:02d}с"
+    if minutes:
+        return f"{minutes}м {seconds:02d}с"
+    return f"{seconds}с"
+
+
+def _format_errors(errors):
+    """Разбивка ошибок по типам, самые частые сверху"""
+    return "\n".join(f"   • {error}: {count}" for error, count in errors.most_common())
+
+
+def _format_progress(job_id, result, rate, remaining):
+    """Текст сообщения с прогрессом рассылки"""
+    percent = result.processed * 100 // result.total if result.total else 100
+    eta = _format_duration(remaining / rate) if rate > 0 else "—"
+
+    text = (
+        f"📨 <b>Рассылка #{job_id}</b>: {result.processed}/{result.total} ({percent}%)\n\n"
+        f"✅ Успешно: {result.success}\n"
+        f"❌ Ошибок: {result.failed}\n"
+        f"🔁 Повторов: {result.retried}\n"
+        f"⚡ Скорость: {rate:.1f} сообщ./сек\n"
+        f"⏳ Осталось: ~{eta}"
+    )
+    if result.errors:
+        text += f"\n\n{_format_errors(result.errors)}"
+    return text
+
+
+async def run_broadcast_job(bot, job_id):
+    """
+    Выполнить (или продолжить) задание рассылки из БД
+    Результаты сохраняются пачками по BROADCAST_CHECKPOINT_SIZE: после
+    перезапуска отправка продолжится с неотправленных получателей.
+    Время работы, повторы, средний темп и разбивка ошибок сохраняются в broadcast_jobs
+    """
+    job = await run_db(db.get_broadcast_job, job_id)
+    if job is None or job['status'] != 'running':
+        return None
+
+    admin_chat_id = job['admin_chat_id']
+    result = BroadcastResult(total=job['total'], success=job['success'], failed=job['failed'])
+    result.retried = job['retried']
+    if result.failed:
+        # При возобновлении продолжаем разбивку ошибок прошлых запусков
+        result.errors.update(await run_db(db.get_broadcast_error_breakdown, job_id))
+        result.blocked = sum(result.errors[key] for key in db.INACTIVE_DELIVERY_STATUSES)
+    pending = []
+    checkpoint_lock = asyncio.Lock()
+    # Через общий bucket идут и правки сообщения с прогрессом — они тоже
+    # расходуют лимит Telegram
+    bucket = get_broadcast_bucket()
+
+    async def checkpoint():
+        async with checkpoint_lock:
+            batch = pending[:]
+            del pending[:len(batch)]
+            if not batch:
+                return
+            try:
+                await run_db(db.save_delivery_results, job_id, batch)
+            except Exception:
+                # Вернём пачку в очередь — сохраним при следующем чекпоинте
+                pending[:0] = batch
+                raise
+
+    def on_delivery(user_id, delivered, error):
+        pending.append((user_id, delivered, error))
+
+    async def save_progress(result):
+        if len(pending) >= BROADCAST_CHECKPOINT_SIZE:
+            await checkpoint()
+
+    # Темп считаем только по текущему запуску (без отправленного до перезапуска)
+    started_processed = result.processed
+    started_at = time.monotonic()
+
+    def current_rate():
+        elapsed = time.monotonic() - started_at
+        return (result.processed - started_processed) / elapsed if elapsed > 0 else 0.0
+
+    progress_message_id = None
+    last_text = None
+
+    async def update_progress():
+        nonlocal last_text
+        text = _format_progress(job_id, result, current_rate(), result.total - result.processed)
+        if progress_message_id is None or text == last_text:
+            return
+        await bucket.acquire()
+        try:
+            await bot.edit_message_text(text, chat_id=admin_chat_id, message_id=progress_message_id)
+        except TelegramBadRequest as e:
+            if 'not modified' not in str(e.message).lower():
+                raise
+        last_text = text
+
+    async def progress_loop():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            try:
+                await update_progress()
+            except TelegramRetryAfter as e:
+                bucket.pause(e.retry_after)
+            except Exception:
+                logger.exception("❌ Рассылка: ошибка обновления прогресса")
+
+    if admin_chat_id:
+        text = _format_progress(job_id, result, 0.0, result.total - result.processed)
+        # При возобновлении правим сообщение прошлого запуска, а не шлём новое
+        if job['progress_message_id']:
+            try:
+                await bot.edit_message_text(
+                    text, chat_id=admin_chat_id, message_id=job['progress_message_id']
+                )
+                progress_message_id = job['progress_message_id']
+            except TelegramBadRequest as e:
+                if 'not modified' in str(e.message).lower():
+                    progress_message_id = job['progress_message_id']
+                else:
+                    logger.warning(f"⚠️ Рассылка #{job_id}: сообщение с прогрессом недоступно ({e.message})")
+            except Exception:
+                logger.exception(f"❌ Рассылка #{job_id}: не удалось обновить сообщение с прогрессом")
+        if progress_message_id is None:
+            try:
+                message = await bot.send_message(admin_chat_id, text)
+                progress_message_id = message.message_id
+            except Exception:
+                logger.exception(f"❌ Рассылка #{job_id}: не удалось отправить сообщение с прогрессом")
+        last_text = text
+    await run_db(db.start_broadcast_run, job_id, progress_message_id)
+
+    progress_task = asyncio.create_task(progress_loop())
+    try:
+        await run_broadcast(
+            bot, _pending_recipients(job_id), job['text'],
+            on_progress=save_progress, on_delivery=on_delivery, result=result,
+            bucket=bucket
+        )
+    finally:
+        progress_task.cancel()
+        # Сохраняем всё, что успели отправить (в том числе при остановке бота),
+        # и время работы этого запуска
+        await asyncio.shield(checkpoint())
+        duration = time.monotonic() - started_at
+        await asyncio.shield(run_db(
+            db.save_broadcast_run_stats, job_id, duration, result.retried - job['retried']
+        ))
+
+    await run_db(db.finish_broadcast_job, job_id)
+    job = await run_db(db.get_broadcast_job, job_id)
+    logger.info(
+        f"📨 Рассылка #{job_id} завершена: {result.success} успешно, {result.failed} ошибок, "
+        f"{job['duration_seconds']:.1f} сек, {job['messages_per_second'] or 0:.1f} сообщ./сек"
+    )
+
+    if admin_chat_id:
+        try:
+            await update_progress()
+        except Exception:
+            logger.exception("❌ Рассылка: ошибка обновления прогресса")
+
+        # Итоговая статистика
+        text = (
+            f"📊 <b>Рассылка #{job_id} завершена!</b>\n\n"
+            f"✅ Успешно: {result.success}\n"
+            f"❌ Ошибок: {result.failed} (из них заблокировали бота или удалены: {result.blocked})\n"
+            f"🔁 Повторов: {job['retried']}\n"
+            f"⏱ Время: {_format_duration(job['duration_seconds'])}\n"
+            f"⚡ Средняя скорость: {job['messages_per_second'] or 0:.1f} сообщ./сек"
+        )
+        if result.errors:
+            text += f"\n\n{_format_errors(result.errors)}"
+        await bot.send_message(admin_chat_id, text)
+    return result
+
+
+# Выполняющиеся задания рассылки: job_id -> asyncio.Task
+_running_jobs = {}
+
+
+def start_broadcast_job(bot, job_id):
+    """Запустить задание рассылки в фоне"""
+    task = _running_jobs.get(job_id)
+    if task is not None and not task.done():
+        return task
+
+    task = asyncio.create_task(run_broadcast_job(bot, job_id), name=f"broadcast-{job_id}")
+    _running_jobs[job_id] = task
+    task.add_done_callback(lambda t: _on_job_done(job_id, t))
+    return task
+
+
+def _on_job_done(job_id, task):
+    _running_jobs.pop(job_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"❌ Рассылка #{job_id} прервана ошибкой", exc_info=task.exception())
+
+
+async def resume_broadcast_jobs(bot):
+    """Возобновить рассылки, прерванные перезапуском (вызывается при старте бота)"""
+    job_ids = await run_db(db.get_unfinished_broadcast_jobs)
+    for job_id in job_ids:
+        logger.info(f"🔁 Возобновляем рассылку #{job_id}")
+        start_broadcast_job(bot, job_id)
+    return job_ids
+
+
+async def stop_broadcast_jobs():
+    """
+    Остановить выполняющиеся рассылки (при остановке бота)
+    Прогресс сохраняется, задания останутся в статусе running и продолжатся при старте
+    """
+    tasks = list(_running_jobs.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
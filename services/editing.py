@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Редактирование сообщений без лишних запросов к Bot API
+Для каждого сообщения запоминается отпечаток последнего показанного экрана
+(текст + entities + клавиатура). Если пользователь снова нажимает кнопку
+экрана, который уже на месте, editMessageText не вызывается:
+Telegram всё равно ответил бы «message is not modified»
+
+Все правки экранов в обработчиках кнопок должны идти через edit_screen(),
+иначе кэш не узнает о новом содержимом сообщения
+"""
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from config import EDIT_CACHE_SIZE, EDIT_CACHE_TTL
+from database.cache import TTLCache
+from services.metrics import EDITS_SKIPPED
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, message_id) -> отпечаток показанного экрана
+_rendered = TTLCache(maxsize=EDIT_CACHE_SIZE, ttl=EDIT_CACHE_TTL)
+
+
+def _message_key(message: Message):
+    return message.chat.id, message.message_id
+
+
+async def edit_screen(message: Message, screen) -> bool:
+    """
+    Показать экран в сообщении; возвращает False, если сообщение
+    уже показывает этот экран и редактировать нечего
+    """
+    key = _message_key(message)
+    fingerprint = screen.fingerprint()
+    if _rendered.get(key, None) == fingerprint:
+        EDITS_SKIPPED.inc(reason="cache")
+        return False
+
+    try:
+        await message.edit_text(**screen.as_kwargs())
+    except TelegramBadRequest as e:
+        # Кэш пуст (перезапуск, другой процесс), а экран уже тот же
+        if 'not modified' not in str(e.message).lower():
+            _rendered.pop(key)
+            raise
+        EDITS_SKIPPED.inc(reason="not_modified")
+        _rendered.set(key, fingerprint)
+        return False
+
+    _rendered.set(key, fingerprint)
+    return True
+
+
+def forget_message(message: Message):
+    """Забыть сообщение (например, после удаления)"""
+    _rendered.pop(_message_key(message))
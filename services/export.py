@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Экспорт базы контактов в CSV (общий для /export и кнопки «Экспорт»)
+Строки читаются из БД потоково и сразу пишутся во временный файл
+(SpooledTemporaryFile: в памяти до EXPORT_SPOOL_MAX_SIZE, дальше — на диске),
+по желанию со сжатием gzip/zip. Вся работа идёт в пуле потоков БД
+"""
+import csv
+import gzip
+import io
+import logging
+import tempfile
+import zipfile
+from datetime import datetime
+
+from aiogram.types import Message
+from aiogram.types.input_file import InputFile
+
+from config import EXPORT_COMPRESSION, EXPORT_SPOOL_MAX_SIZE, EXPORT_BATCH_SIZE
+from database.db import iter_users_with_contacts
+from database.aio import run_db
+
+logger = logging.getLogger(__name__)
+
+# Заголовки на русском
+CSV_HEADER = ['ID', 'Username', 'Имя', 'Фамилия', 'Телефон', 'Тариф', 'Дата регистрации']
+
+TARIFF_NAMES = {
+    'basic': 'Базовый',
+    'assistant': 'Ассистент для ассистента',
+    None: 'Не выбран'
+}
+
+
+class SpooledInputFile(InputFile):
+    """
+    Файл для отправки в Telegram из уже открытого файлового объекта
+    Читается кусками по chunk_size и закрывается после отправки
+    """
+
+    def __init__(self, file, filename, chunk_size=64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+def _format_row(user):
+    """Строка CSV в читаемом виде"""
+    user_id, username, first_name, last_name, phone, registered, tariff = user
+
+    # Преобразуем дату в читаемый формат (SQLite — строка, PostgreSQL — datetime)
+    if isinstance(registered, datetime):
+        reg_date = registered.strftime('%d.%m.%Y %H:%M')
+    else:
+        try:
+            reg_date = datetime.fromisoformat(registered).strftime('%d.%m.%Y %H:%M')
+        except (TypeError, ValueError):
+            reg_date = registered
+
+    return [
+        user_id,
+        f"@{username}" if username else '',
+        first_name or '',
+        last_name or '',
+        phone,
+        TARIFF_NAMES.get(tariff, 'Не выбран'),
+        reg_date
+    ]
+
+
+def _write_csv(binary, rows):
+    """Записать CSV (UTF-8 с BOM для Excel) в бинарный поток, вернуть число строк"""
+    text = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text, delimiter=';')  # Точка с запятой для Excel (русская версия)
+    writer.writerow(CSV_HEADER)
+
+    count = 0
+    for user in rows:
+        writer.writerow(_format_row(user))
+        count += 1
+
+    text.flush()
+    # Отсоединяем обёртку, чтобы она не закрыла нижележащий поток
+    text.detach()
+    return count
+
+
+def build_contacts_export(compression=EXPORT_COMPRESSION):
+    """
+    Сформировать файл экспорта (синхронно, вызывать вне event loop)
+    Возвращает (file, filename, count); file — SpooledTemporaryFile,
+    закрыть его должен вызывающий
+    """
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    csv_name = f"contacts_{stamp}.csv"
+    rows = iter_users_with_contacts(batch_size=EXPORT_BATCH_SIZE)
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        if compression == 'gzip':
+            filename = f"{csv_name}.gz"
+            with gzip.GzipFile(filename=csv_name, mode='wb', fileobj=spooled) as gz:
+                count = _write_csv(gz, rows)
+        elif compression == 'zip':
+            filename = f"contacts_{stamp}.zip"
+            with zipfile.ZipFile(spooled, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+                with archive.open(csv_name, mode='w', force_zip64=True) as member:
+                    count = _write_csv(member, rows)
+        else:
+            filename = csv_name
+            count = _write_csv(spooled, rows)
+    except BaseException:
+        spooled.close()
+        raise
+    finally:
+        rows.close()
+
+    spooled.seek(0)
+    return spooled, filename, count
+
+
+async def send_contacts_export(message: Message):
+    """
+    Экспорт всех контактов и отправка файла в чат
+    """
+    await message.answer("📤 Экспорт базы контактов...")
+
+    file, filename, count = await run_db(build_contacts_export)
+
+    if not count:
+        file.close()
+        await message.answer("Нет пользователей с контактами для экспорта.")
+        return
+
+    document = SpooledInputFile(file, filename=filename)
+    try:
+        await message.answer_document(
+            document=document,
+            caption=f"✅ Экспортировано {count} контактов"
+        )
+    finally:
+        document.close()
+    logger.info(f"📤 Экспорт контактов: {count} строк, файл {filename}")
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики бота в текстовом формате Prometheus (без внешних зависимостей)
+Счётчики и гистограммы потокобезопасны: время запросов к БД
+записывается из пула потоков БД
+
+    DB_QUERY_DURATION.observe(0.012, function='log_action')
+    print(render_metrics())
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Границы корзин гистограмм (секунды): от 5 мс до 10 сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание, метки"""
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Метрика {self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение (глубина очереди, число занятых обработчиков)
+    set_function() — значение без меток вычисляется при каждом чтении /metrics
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма длительностей (кумулятивные корзины, сумма и количество)
+    Квантили p50/p95/p99 считает Prometheus: histogram_quantile(0.95, ...)
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам..., сумма, количество]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замерить время выполнения блока with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q, **labels):
+        """
+        Оценка квантиля q (0..1) по корзинам, как histogram_quantile в Prometheus
+        (линейная интерполяция внутри корзины); None — наблюдений нет
+        """
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            state = list(state) if state else None
+        if not state or not state[-1]:
+            return None
+
+        rank = q * state[-1]
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, state):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        # Выше последней границы точнее не оценить
+        return self.buckets[-1]
+
+    def label_sets(self):
+        """Наборы меток, по которым есть наблюдения"""
+        with self._lock:
+            keys = list(self._values)
+        return [dict(zip(self.labelnames, key)) for key in keys]
+
+    def get_sum(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+        return state[-2] if state else 0.0
+
+    def get_count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+        lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Набор метрик для /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Обработка обновлений: время от входа в диспетчер до ответа обработчика
+UPDATE_DURATION = REGISTRY.register(Histogram(
+    'bot_update_duration_seconds', 'Время обработки обновления',
+    ('event_type', 'router', 'handler')
+))
+UPDATE_ERRORS = REGISTRY.register(Counter(
+    'bot_update_errors_total', 'Обновления, обработка которых завершилась ошибкой',
+    ('event_type', 'router', 'handler')
+))
+
+# Запросы к БД (функции database/db.py)
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    'bot_db_query_duration_seconds', 'Время выполнения функции database/db.py',
+    ('function',)
+))
+DB_QUERY_ERRORS = REGISTRY.register(Counter(
+    'bot_db_query_errors_total', 'Ошибки функций database/db.py', ('function',)
+))
+
+# Запросы к Bot API
+API_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'bot_api_request_duration_seconds', 'Время запроса к Telegram Bot API', ('method',)
+))
+API_REQUEST_ERRORS = REGISTRY.register(Counter(
+    'bot_api_request_errors_total', 'Ошибки запросов к Telegram Bot API', ('method', 'error')
+))
+API_RETRIES = REGISTRY.register(Counter(
+    'bot_api_retries_total', 'Повторы запросов к Bot API после flood control', ('method',)
+))
+
+# Антифлуд: события, отброшенные до обработчика
+THROTTLED_EVENTS = REGISTRY.register(Counter(
+    'bot_throttled_events_total', 'События, отброшенные антифлудом', ('event_type', 'limit')
+))
+
+# Пропущенные editMessageText: сообщение уже показывает этот экран
+EDITS_SKIPPED = REGISTRY.register(Counter(
+    'bot_edits_skipped_total', 'Пропущенные одинаковые редактирования сообщений', ('reason',)
+))
+
+# Планировщик обновлений: очереди по чатам и пул обработчиков
+SCHEDULER_PENDING = REGISTRY.register(Gauge(
+    'bot_scheduler_pending_updates', 'Обновления в очередях планировщика (включая выполняемые)'
+))
+SCHEDULER_CHATS = REGISTRY.register(Gauge(
+    'bot_scheduler_active_chats', 'Чаты с обновлениями в очереди'
+))
+SCHEDULER_MAX_CHAT_DEPTH = REGISTRY.register(Gauge(
+    'bot_scheduler_max_chat_queue_depth', 'Самая длинная очередь одного чата'
+))
+SCHEDULER_BUSY_WORKERS = REGISTRY.register(Gauge(
+    'bot_scheduler_busy_workers', 'Обработчики, занятые обновлением'
+))
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    'bot_scheduler_wait_seconds', 'Время обновления в очереди до начала обработки'
+))
+SCHEDULER_DROPPED = REGISTRY.register(Counter(
+    'bot_scheduler_dropped_total', 'Обновления, отброшенные из-за переполненной очереди чата'
+))
+
+
+def render_metrics():
+    """Все метрики в текстовом формате Prometheus"""
+    return REGISTRY.render()
+
+
+def instrument_db_function(func):
+    """Обернуть функцию БД: время выполнения и ошибки попадают в метрики"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.inc(function=name)
+            raise
+        finally:
+            DB_QUERY_DURATION.observe(time.perf_counter() - started, function=name)
+
+    return wrapper
+
+
+async def _handle_metrics(request):
+    return web.Response(
+        text=render_metrics(),
+        content_type='text/plain',
+        charset='utf-8',
+        headers={'X-Content-Type-Options': 'nosniff'},
+    )
+
+
+async def start_metrics_server(host, port):
+    """
+    HTTP-сервер с GET /metrics (отдельный порт, чтобы не открывать метрики
+    на публичном адресе webhook). Возвращает AppRunner — остановить через cleanup()
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
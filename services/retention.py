@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновое обслуживание user_actions
+Раз в ACTIONS_MAINTENANCE_INTERVAL секунд создаются секции на будущие месяцы
+(PostgreSQL) и архивируются/удаляются месяцы старше ACTIONS_RETENTION_MONTHS
+(database/retention.py). Проход может идти минуты (выгрузка месяца в архив),
+поэтому выполняется в отдельном потоке, а не в пуле запросов обработчиков
+"""
+import asyncio
+import logging
+import threading
+
+from config import ACTIONS_MAINTENANCE_INTERVAL
+from database.retention import run_actions_maintenance
+
+logger = logging.getLogger(__name__)
+
+_task = None
+_stop = None
+# Прерывает проход в потоке между месяцами и пачками удаления
+_stop_thread = None
+
+
+async def _run(interval):
+    while not _stop.is_set():
+        try:
+            await asyncio.to_thread(run_actions_maintenance, _stop_thread)
+        except Exception:
+            logger.exception("❌ Не удалось выполнить обслуживание user_actions")
+
+        try:
+            await asyncio.wait_for(_stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_actions_maintenance(interval=ACTIONS_MAINTENANCE_INTERVAL):
+    """Запустить фоновое обслуживание (interval <= 0 — не запускать)"""
+    global _task, _stop, _stop_thread
+    if interval <= 0 or (_task is not None and not _task.done()):
+        return
+    _stop = asyncio.Event()
+    _stop_thread = threading.Event()
+    _task = asyncio.create_task(_run(interval), name="actions-maintenance")
+
+
+async def stop_actions_maintenance():
+    """Остановить; текущий проход прерывается после текущей пачки"""
+    global _task
+    if _task is None:
+        return
+    _stop_thread.set()
+    _stop.set()
+    await _task
+    _task = None
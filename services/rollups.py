@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновое обновление сводок для /funnel
+Раз в ROLLUP_INTERVAL секунд новые строки user_actions досчитываются
+в action_daily_rollup и funnel_users (database/db.py:refresh_action_rollups).
+Пока есть необработанные строки (например, при первом запуске на большой
+базе), проходы идут подряд, но каждый ограничен ROLLUP_MAX_BATCHES пачками
+"""
+import asyncio
+import logging
+
+from config import ROLLUP_INTERVAL, ROLLUP_MAX_BATCHES
+from database.aio import refresh_action_rollups
+
+logger = logging.getLogger(__name__)
+
+_task = None
+_stop = None
+
+
+async def _run(interval):
+    while not _stop.is_set():
+        caught_up = True
+        try:
+            result = await refresh_action_rollups()
+            if result is not None:
+                rows, batches = result
+                # Все пачки заполнены — новых строк, скорее всего, ещё больше
+                caught_up = batches < ROLLUP_MAX_BATCHES
+                if rows:
+                    logger.info(f"📈 Сводки /funnel: +{rows} действий")
+        except Exception:
+            logger.exception("❌ Не удалось обновить сводки /funnel")
+
+        # Отстали — следующий проход сразу, иначе ждём интервал (или остановки)
+        try:
+            await asyncio.wait_for(_stop.wait(), 0 if not caught_up else interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_rollup_refresher(interval=ROLLUP_INTERVAL):
+    """Запустить фоновое обновление сводок (interval <= 0 — не запускать)"""
+    global _task, _stop
+    if interval <= 0 or (_task is not None and not _task.done()):
+        return
+    _stop = asyncio.Event()
+    _task = asyncio.create_task(_run(interval), name="rollup-refresher")
+
+
+async def stop_rollup_refresher():
+    """Остановить после текущего прохода (он ограничен по размеру)"""
+    global _task
+    if _task is None:
+        return
+    _stop.set()
+    await _task
+    _task = None
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Запуск бота в режиме webhook (BOT_MODE=webhook)
+Telegram присылает обновления на встроенный aiohttp-сервер, запросы без
+правильного секрета (X-Telegram-Bot-Api-Secret-Token) отклоняются.
+Экземпляров бота за балансировщиком может быть несколько
+"""
+import asyncio
+import hashlib
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    BOT_TOKEN, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_SHUTDOWN_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_webhook_secret():
+    """
+    Секрет webhook: из WEBHOOK_SECRET или производный от токена бота
+    (одинаковый на всех экземплярах, сам токен в заголовке не передаётся)
+    """
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+
+
+def build_webhook_app(bot, dp):
+    """aiohttp-приложение: POST WEBHOOK_PATH передаёт обновления в диспетчер"""
+    app = web.Application()
+
+    # handle_in_background=False — принятые обновления дорабатываются при остановке;
+    # setup_application регистрируется первым, чтобы shutdown-хуки диспетчера
+    # выполнились до закрытия сессии бота
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=get_webhook_secret(),
+        handle_in_background=False,
+    ).register(app, path=WEBHOOK_PATH)
+    return app
+
+
+def _wait_for_stop_signal():
+    """Событие, которое выставляется по SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка по Ctrl+C придёт как KeyboardInterrupt
+            pass
+    return stop
+
+
+async def run_webhook(bot, dp):
+    """
+    Зарегистрировать webhook в Telegram и обслуживать его до сигнала остановки
+    Webhook при остановке не удаляется, а накопившиеся обновления не сбрасываются:
+    при поочерёдном перезапуске экземпляров сообщения пользователей не теряются
+    """
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для BOT_MODE=webhook нужно указать WEBHOOK_BASE_URL")
+
+    app = build_webhook_app(bot, dp)
+    runner = web.AppRunner(app, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+        await site.start()
+
+        url = f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
+        await bot.set_webhook(
+            url,
+            secret_token=get_webhook_secret(),
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"🌐 Webhook: {url} (слушаем {WEBAPP_HOST}:{WEBAPP_PORT})")
+
+        await _wait_for_stop_signal().wait()
+        logger.info("🛑 Получен сигнал остановки, завершаем обработку обновлений...")
+    finally:
+        # Сервер перестаёт принимать запросы и ждёт завершения текущих
+        # (не дольше WEBHOOK_SHUTDOWN_TIMEOUT), затем закрывается сессия бота
+        await runner.cleanup()
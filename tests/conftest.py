@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Общие фикстуры тестов: временная база SQLite со всеми миграциями
+"""
+import pytest
+
+from database import db
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Пул подключений к новой базе SQLite во временной папке (модуль database.db)"""
+    if db.USE_POSTGRES:
+        pytest.skip("тесты БД рассчитаны на SQLite")
+    # Папка data/ создаётся относительно текущего каталога
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DATABASE_NAME", "test.db")
+    db.close_pool()
+    db.init_pool()
+    db.init_db()
+    yield db
+    db.close_pool()
+
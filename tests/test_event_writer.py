@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+EventWriter на SQLite: запись пачкой, отбрасывание «плохой» строки, повтор после сбоя БД
+"""
+import asyncio
+import sqlite3
+
+from database import db
+from database.event_writer import ACTION, EventWriter
+
+
+def _action(user_id, action_type):
+    return ACTION, (user_id, action_type, None, db.event_timestamp())
+
+
+def _logged_actions():
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id, action_type FROM user_actions ORDER BY id")
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def test_batch_is_written(sqlite_db):
+    writer = EventWriter(max_queue=100)
+    asyncio.run(writer._flush([_action(1, 'start'), _action(2, 'start')]))
+    assert _logged_actions() == [(1, 'start'), (2, 'start')]
+    assert writer._retry == []
+
+
+def test_rejected_row_does_not_block_the_batch(sqlite_db):
+    # Строку, которую БД не принимает, отклоняет триггер (IntegrityError)
+    with db.get_connection() as conn:
+        conn.cursor().execute("""
+            CREATE TRIGGER reject_bad_action BEFORE INSERT ON user_actions
+            WHEN NEW.action_type = 'bad'
+            BEGIN SELECT RAISE(ABORT, 'bad action'); END
+        """)
+
+    writer = EventWriter(max_queue=100)
+    batch = [_action(1, 'start'), _action(1, 'bad'), _action(2, 'start')]
+    asyncio.run(writer._flush(batch))
+    assert _logged_actions() == [(1, 'start'), (2, 'start')]
+    assert writer._retry == []
+
+
+def test_events_are_retried_after_database_outage(sqlite_db, monkeypatch):
+    log_events_batch = db.log_events_batch
+
+    def unavailable(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    writer = EventWriter(max_queue=100)
+    monkeypatch.setattr(db, "log_events_batch", unavailable)
+    asyncio.run(writer._flush([_action(1, 'start'), _action(2, 'start')]))
+    assert _logged_actions() == []
+    assert len(writer._retry) == 2
+
+    # БД снова доступна: отложенные события пишутся со следующей пачкой
+    monkeypatch.setattr(db, "log_events_batch", log_events_batch)
+    asyncio.run(writer._flush([_action(3, 'start')]))
+    assert _logged_actions() == [(1, 'start'), (2, 'start'), (3, 'start')]
+    assert writer._retry == []
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+SQLStorage на SQLite: состояние и данные в БД, общие для экземпляров хранилища
+"""
+import asyncio
+import time
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from database import db
+from database.fsm_storage import SQLStorage
+
+
+class Form(StatesGroup):
+    waiting = State()
+
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+
+def _fsm_rows():
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT state, data FROM fsm_storage")
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def test_state_and_data_round_trip(sqlite_db):
+    async def run():
+        storage = SQLStorage()
+        await storage.set_state(KEY, Form.waiting)
+        await storage.update_data(KEY, {"phone": "+79990000000"})
+        assert await storage.get_state(KEY) == Form.waiting.state
+        assert await storage.get_data(KEY) == {"phone": "+79990000000"}
+
+        # Пустое состояние без данных в БД не хранится
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        assert await storage.get_state(KEY) is None
+
+    asyncio.run(run())
+    assert _fsm_rows() == []
+
+
+def test_storages_see_each_others_writes(sqlite_db):
+    # Два экземпляра — как два процесса бота за одним балансировщиком
+    async def run():
+        first, second = SQLStorage(), SQLStorage()
+        assert await second.get_state(KEY) is None
+        await first.set_state(KEY, Form.waiting)
+        assert await second.get_state(KEY) == Form.waiting.state
+        await first.set_state(KEY, None)
+        assert await second.get_state(KEY) is None
+
+    asyncio.run(run())
+
+
+def test_stale_state_is_ignored_and_cleaned_up(sqlite_db):
+    db.save_fsm_record("stale", "Form:waiting", "{}")
+    with db.get_connection() as conn:
+        conn.cursor().execute(
+            "UPDATE fsm_storage SET updated_at = ? WHERE key = 'stale'", (time.time() - 7200,)
+        )
+
+    async def run():
+        storage = SQLStorage(state_ttl=3600)
+        assert await storage._get_record("stale") == (None, {})
+        assert await storage.cleanup() == 1
+
+    asyncio.run(run())
+    assert _fsm_rows() == []
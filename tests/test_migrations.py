@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Миграции схемы на SQLite: новая база, повторный запуск, откат упавшей миграции
+"""
+import pytest
+
+from database import db
+from database.migrations import MIGRATIONS, Migration, apply_migrations, get_schema_version
+
+
+def _columns(table):
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {row[1] for row in cursor.fetchall()}
+
+
+def test_new_database_gets_latest_schema(sqlite_db):
+    with db.get_connection() as conn:
+        assert get_schema_version(conn) == max(m.version for m in MIGRATIONS)
+
+    assert {'delivery_status', 'last_tariff'} <= _columns('users')
+    assert _columns('action_daily_rollup') == {'day', 'action_type', 'events', 'users'}
+    assert _columns('action_daily_users') == {'day', 'action_type', 'user_id'}
+    assert 'gap_since' in _columns('rollup_state')
+
+
+def test_applied_migrations_are_not_repeated(sqlite_db):
+    with db.get_connection() as conn:
+        assert apply_migrations(conn) == []
+
+
+def test_failed_migration_leaves_no_columns_behind(sqlite_db):
+    broken = Migration(
+        1000, "Колонка и ошибка после неё",
+        sqlite=[
+            "ALTER TABLE users ADD COLUMN test_note TEXT",
+            "SELECT * FROM missing_table",
+        ],
+        postgres=[],
+    )
+    with db.get_connection() as conn:
+        with pytest.raises(Exception):
+            apply_migrations(conn, MIGRATIONS + [broken])
+    assert 'test_note' not in _columns('users')
+
+    # Исправленная миграция применяется без «duplicate column»
+    fixed = Migration(1000, "Колонка", sqlite=["ALTER TABLE users ADD COLUMN test_note TEXT"], postgres=[])
+    with db.get_connection() as conn:
+        assert apply_migrations(conn, MIGRATIONS + [fixed]) == [1000]
+        assert get_schema_version(conn) == 1000
+    assert 'test_note' in _columns('users')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Сводки /funnel на SQLite: пачки _rollup_next_batch совпадают с подсчётом по user_actions
+"""
+from datetime import datetime, timedelta, timezone
+
+from database import db
+
+
+def _query(sql, params=()):
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def _add_actions(rows):
+    """rows — (user_id, action_type, timestamp 'YYYY-MM-DD HH:MM:SS')"""
+    with db.get_connection() as conn:
+        conn.cursor().executemany(
+            "INSERT INTO user_actions (user_id, action_type, timestamp) VALUES (?, ?, ?)", rows
+        )
+
+
+def _raw_counts():
+    return _query("""
+        SELECT date(timestamp), action_type, COUNT(*), COUNT(DISTINCT user_id)
+        FROM user_actions GROUP BY 1, 2 ORDER BY 1, 2
+    """)
+
+
+def _rollup_counts():
+    return _query("SELECT day, action_type, events, users FROM action_daily_rollup ORDER BY 1, 2")
+
+
+ACTIONS = [
+    (1, 'start', '2026-10-01 10:00:00'),
+    (2, 'start', '2026-10-01 11:00:00'),
+    (1, 'start', '2026-10-01 12:00:00'),
+    (1, 'view_tariffs', '2026-10-01 12:05:00'),
+    (2, 'start', '2026-10-02 09:00:00'),
+    (3, 'start', '2026-10-02 09:30:00'),
+    (3, 'shared_contact', '2026-10-02 09:40:00'),
+    (3, 'select_basic', '2026-10-02 09:45:00'),
+    (1, 'start', '2026-10-02 10:00:00'),
+]
+
+
+def test_batches_match_raw_counts(sqlite_db):
+    _add_actions(ACTIONS)
+
+    # Пачки по 2 строки: один пользователь за день попадает в разные пачки
+    batches = 0
+    while db._rollup_next_batch(batch_size=2, lag_seconds=0):
+        batches += 1
+    assert batches == 5
+    assert _rollup_counts() == _raw_counts()
+    assert db.get_rollup_state()[0] == len(ACTIONS)
+
+    assert _query("SELECT user_id, started_at, tariffs_at, contact_at, selected_at "
+                  "FROM funnel_users ORDER BY user_id") == [
+        (1, '2026-10-01 10:00:00', '2026-10-01 12:05:00', None, None),
+        (2, '2026-10-01 11:00:00', None, None, None),
+        (3, '2026-10-02 09:30:00', None, '2026-10-02 09:40:00', '2026-10-02 09:45:00'),
+    ]
+
+
+def test_new_rows_are_added_incrementally(sqlite_db):
+    _add_actions(ACTIONS[:4])
+    assert db.refresh_action_rollups(batch_size=100, lag_seconds=0) == (4, 1)
+
+    # Те же пользователи в тот же день не считаются повторно
+    _add_actions(ACTIONS[4:] + [(2, 'start', '2026-10-01 18:00:00')])
+    assert db.refresh_action_rollups(batch_size=100, lag_seconds=0) == (6, 1)
+    assert _rollup_counts() == _raw_counts()
+    assert db.refresh_action_rollups(batch_size=100, lag_seconds=0) == (0, 0)
+
+
+def test_recent_rows_wait_for_next_pass(sqlite_db):
+    _add_actions(ACTIONS[:2])
+    recent = datetime.now(timezone.utc) - timedelta(minutes=10)
+    _add_actions([(1, 'start', recent.strftime('%Y-%m-%d %H:%M:%S'))])
+
+    assert db._rollup_next_batch(batch_size=100, lag_seconds=3600) == 2
+    assert db.get_rollup_state()[0] == 2
+    assert db._rollup_next_batch(batch_size=100, lag_seconds=3600) == 0
+
+    assert db._rollup_next_batch(batch_size=100, lag_seconds=0) == 1
+    assert _rollup_counts() == _raw_counts()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик обновлений: состояние FSM читается при обработке, а не при постановке в очередь
+"""
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Chat, Message, Update, User
+
+from middlewares.scheduler import UpdateScheduler
+
+
+class Form(StatesGroup):
+    waiting = State()
+
+
+def _message_update(bot, update_id, text):
+    user = User(id=1, is_bot=False, first_name="Test")
+    message = Message(
+        message_id=update_id, date=datetime.now(), text=text,
+        chat=Chat(id=1, type="private"), from_user=user
+    )
+    return Update(update_id=update_id, message=message).as_(bot)
+
+
+def test_second_message_sees_state_set_by_first():
+    handled = []
+    router = Router()
+
+    @router.message(F.text == "start")
+    async def start(message, state):
+        # Пока первое обновление обрабатывается, второе уже стоит в очереди чата
+        await asyncio.sleep(0.05)
+        await state.set_state(Form.waiting)
+        handled.append("start")
+
+    @router.message(Form.waiting)
+    async def waiting(message, state):
+        await state.clear()
+        handled.append("waiting")
+
+    @router.message()
+    async def fallback(message):
+        handled.append("fallback")
+
+    async def run():
+        bot = Bot("42:TEST")
+        dp = Dispatcher()
+        dp.include_router(router)
+        scheduler = UpdateScheduler(dp.feed_update, workers=4)
+        await scheduler.submit(bot, _message_update(bot, 1, "start"))
+        await scheduler.submit(bot, _message_update(bot, 2, "+79990000000"))
+        await scheduler.stop(timeout=5)
+        await bot.session.close()
+
+    asyncio.run(run())
+    assert handled == ["start", "waiting"]
+
+
+def test_handler_errors_reach_dispatcher_error_handler():
+    errors = []
+    router = Router()
+
+    @router.message()
+    async def broken(message):
+        raise RuntimeError("boom")
+
+    @router.errors()
+    async def on_error(event):
+        errors.append(str(event.exception))
+        return True
+
+    async def run():
+        bot = Bot("42:TEST")
+        dp = Dispatcher()
+        dp.include_router(router)
+        scheduler = UpdateScheduler(dp.feed_update, workers=1)
+        await scheduler.submit(bot, _message_update(bot, 1, "hi"))
+        await scheduler.stop(timeout=5)
+        await bot.session.close()
+
+    asyncio.run(run())
+    assert errors == ["boom"]
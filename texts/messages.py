@@ -95,15 +95,15 @@ def get_welcome_message(first_name=None):
     Приветственное сообщение с возможностью подстановки имени
     """
     if first_name:
-        greeting = f"Добро пожаловать, {first_name} 💛"
-    else:
-        greeting = "Добро пожаловать 💛"
+        return f"Добро пожаловать, {first_name} 💛\n{WELCOME_BODY}"
+    return f"Добро пожаловать 💛\n{WELCOME_BODY}"
 
-    return (
-        f"{greeting}\n"
-        "Ты в закрытом пространстве «Скорая помощь для ассистента» — месте, "
-        "где ассистентов поддерживают, помогают и реально упрощают работу."
-    )
+
+# Неизменная часть приветствия
+WELCOME_BODY = (
+    "Ты в закрытом пространстве «Скорая помощь для ассистента» — месте, "
+    "где ассистентов поддерживают, помогают и реально упрощают работу."
+)
 
 
 # SMS №1 - Условия доступа / тарифы (описание «Включает» — в blockquote: цитата со стрелкой раскрытия)
@@ -188,5 +188,8 @@ ASK_QUESTION_MESSAGE = """Если остались вопросы — напи
 Контакт: @sp_assistant"""
 
 
+# Ответ на слишком частые нажатия кнопок
+THROTTLED_MESSAGE = "⏳ Не так быстро, секундочку…"
+
 # Контакт менеджера
 MANAGER_USERNAME = "sp_assistant"
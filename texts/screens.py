@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Реестр экранов: текст + entities + клавиатура
+Статические экраны собираются один раз при импорте модуля (при старте бота),
+а не на каждое нажатие кнопки. Меняется только динамическая часть
+(например, имя пользователя в приветствии)
+"""
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Optional, Tuple
+
+from aiogram.types import MessageEntity
+
+from texts.messages import (
+    get_welcome_message,
+    get_tariffs_text_and_entities,
+    TARIFFS_MESSAGE,
+    BASIC_TARIFF_MESSAGE,
+    ASSISTANT_TARIFF_MESSAGE,
+    ABOUT_AUTHORS_MESSAGE,
+    ASK_QUESTION_MESSAGE
+)
+from keyboards.inline import (
+    get_main_menu_keyboard,
+    get_tariffs_keyboard,
+    get_contact_manager_keyboard,
+    get_about_authors_keyboard,
+    get_ask_question_keyboard,
+    get_admin_menu_keyboard,
+    get_contact_request_keyboard
+)
+
+
+def _layout(reply_markup, entities):
+    """Клавиатура и entities в сериализованном виде (для отпечатка экрана)"""
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+    return markup, tuple(entity.model_dump_json(exclude_none=True) for entity in entities or ())
+
+
+@dataclass(frozen=True)
+class Screen:
+    """
+    Готовый экран (неизменяемый)
+    entities — если заданы, текст отправляется без parse_mode
+    Отпечаток считается один раз при сборке экрана; with_text() переиспользует
+    сериализованную клавиатуру (layout), поэтому нажатие кнопки её не сериализует
+    """
+    text: str
+    reply_markup: Optional[object] = None
+    entities: Optional[Tuple[MessageEntity, ...]] = None
+    layout: Optional[tuple] = field(default=None, repr=False, compare=False)
+    _fingerprint: int = field(default=0, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.layout is None:
+            object.__setattr__(self, 'layout', _layout(self.reply_markup, self.entities))
+        object.__setattr__(self, '_fingerprint', hash((self.text, self.layout)))
+
+    def as_kwargs(self):
+        """Аргументы для message.answer(...) / message.edit_text(...)"""
+        kwargs = {'text': self.text, 'reply_markup': self.reply_markup}
+        if self.entities is not None:
+            kwargs['entities'] = list(self.entities)
+            kwargs['parse_mode'] = None
+        return kwargs
+
+    def fingerprint(self):
+        """Отпечаток содержимого: одинаковый у экранов, которые выглядят одинаково"""
+        return self._fingerprint
+
+    def with_text(self, text):
+        """Тот же экран с другим текстом (для динамических экранов)"""
+        return replace(self, text=text)
+
+
+def _build_tariffs_screen():
+    text, entities = get_tariffs_text_and_entities()
+    return Screen(text, get_tariffs_keyboard(), tuple(entities))
+
+
+# Все экраны бота по именам
+SCREENS = MappingProxyType({
+    'main_menu': Screen(get_welcome_message(), get_main_menu_keyboard()),
+    # Тарифы через entities — раскрывающиеся цитаты
+    'tariffs': _build_tariffs_screen(),
+    # Тарифы в HTML (после получения контакта)
+    'tariffs_html': Screen(TARIFFS_MESSAGE, get_tariffs_keyboard()),
+    'basic_selected': Screen(BASIC_TARIFF_MESSAGE, get_contact_manager_keyboard()),
+    'assistant_selected': Screen(ASSISTANT_TARIFF_MESSAGE, get_contact_manager_keyboard()),
+    'about_authors': Screen(ABOUT_AUTHORS_MESSAGE, get_about_authors_keyboard()),
+    'ask_question': Screen(ASK_QUESTION_MESSAGE, get_ask_question_keyboard()),
+    'contact_request': Screen(
+        "Чтобы менеджер мог с вами связаться, поделитесь своим контактом:",
+        get_contact_request_keyboard()
+    ),
+    'admin_menu': Screen("🔐 <b>Админ-панель</b>\n\nВыберите действие:", get_admin_menu_keyboard()),
+})
+
+
+def get_screen(name):
+    """Экран по имени"""
+    return SCREENS[name]
+
+
+def get_welcome_screen(first_name=None):
+    """Главное меню с приветствием по имени (клавиатура общая для всех)"""
+    if not first_name:
+        return SCREENS['main_menu']
+    return SCREENS['main_menu'].with_text(get_welcome_message(first_name))